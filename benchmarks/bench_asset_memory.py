@@ -0,0 +1,95 @@
+'''
+BENCHMARK: memory of N assets, slotted Asset (numeric size/mtime, lazy strings)
+vs the previous __dict__ Asset (formatted size/date strings, three stored paths)
+usage: python benchmarks/bench_asset_memory.py [--count 1000000]
+'''
+import os, sys, time, argparse, tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib.AssetFactory import Asset
+from lib.FileFactory import FileFactory
+
+class DictAsset:
+	''' the attributes the previous Asset.__init__ stored '''
+	def __init__( self, aid, filename, path_from, path_to, size, mtime ):
+		self.index = aid
+		self.name_origin = filename
+		self.name = filename
+		self.is_optimized = False
+		self.is_geotagged = False
+		self.path_src = path_from
+		self.path_dest = path_to
+		self.file_origin = '%s/%s' % (path_from, filename)
+		self.file_source = '%s/%s' % (path_to, filename)
+		self.active_file = self.file_source
+		self.ext = self.name.split('.')[-1:][0].lower()
+		self.size = format(size/1000, '.3f')
+		self.timestamp = int(mtime)
+		self.modified = FileFactory.getFormatedDatetime( self.timestamp )
+		self.type = FileFactory.determineFileType( self.ext )
+		self.probe = None
+		self.probe_stamp = None
+
+def getImports( count ):
+	''' (path_from, filename, size, mtime) like a folder import produces them,
+		every path string its own object as split from the full file path '''
+	for aid in range(count):
+		from_path = '/Users/someone/Pictures/shoot-%d/IMG_%07d.jpg' % (aid // 1000, aid)
+		yield aid, from_path.split('/')[-1], '/'.join(from_path.split('/')[0:-1]), 2500000 + aid, 1600000000.0 + aid
+
+def makeDictAssets( count, path_to ):
+	return [ DictAsset(aid, name, path_from, path_to, size, mtime) for aid, name, path_from, size, mtime in getImports(count) ]
+
+def makeSlotAssets( count, path_to ):
+	''' built by Asset.fromRecord, the same fields Asset.__init__ sets minus the
+		file linking and stat '''
+	assets = []
+	for aid, name, path_from, size, mtime in getImports(count):
+		file_source = '%s/%s' % (path_to, name)
+		assets.append( Asset.fromRecord({
+			'id': aid,
+			'name_origin': name,
+			'name': name,
+			'path_src': path_from,
+			'path_dest': path_to,
+			'path_rel': '',
+			'file_source': file_source,
+			'active_file': file_source,
+			'ext': sys.intern( name.split('.')[-1:][0].lower() ),
+			'bytes': size,
+			'mtime': mtime,
+			'content_hash': None,
+			'phash': None,
+			'duplicate_of': None,
+			'similar_to': None,
+			'is_optimized': False,
+			'is_geotagged': False,
+			'outputs': None,
+		}) )
+	return assets
+
+def measure( build, count, path_to ):
+	''' bytes allocated (and kept) building count assets, seconds taken '''
+	tracemalloc.start()
+	start = time.perf_counter()
+	assets = build(count, path_to)
+	elapsed = time.perf_counter() - start
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del assets
+	return current, elapsed
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--count', type=int, default=1000000)
+	args = parser.parse_args()
+	path_to = '/Users/someone/WAO/WAOassets/original'
+	print('%-16s %12s %14s %10s' % ('asset', 'total MB', 'bytes/asset', 'build s'))
+	results = {}
+	for label, build in (('__dict__', makeDictAssets), ('__slots__', makeSlotAssets)):
+		used, elapsed = measure(build, args.count, path_to)
+		results[label] = used
+		print('%-16s %12.1f %14.1f %10.2f' % (label, used / 1024**2, used / args.count, elapsed))
+	print('reduction: %.1f%%' % (100 * (1 - results['__slots__'] / results['__dict__'])))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,103 @@
+'''
+BENCHMARK: duplicate detection at import, a drop folder built from a synthetic
+corpus (see make_corpus.py) where part of the files come again under other
+names (exact copies) or resaved (near copies, JPEGs at another quality)
+- import seconds (content + perceptual hashing) and optimize seconds, with
+  exact duplicates processed once vs every file processed
+- the exact and near duplicates found
+usage: python benchmarks/bench_dedupe.py [--corpus DIR] [--count 120] [--seed 1] [--dup-ratio 0.3] [--copies 2] [--near-ratio 0.1] [--preset fast]
+'''
+import os, sys, time, zlib, random, shutil, argparse, tempfile
+from PIL import Image
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib import constants
+from lib.WAODirector import WAODirector
+from make_corpus import makeCorpus, DEFAULT_MIX
+
+def makeDrop( corpus, files, path_to, dup_ratio, copies, near_ratio, seed ):
+	''' the drop folder: every corpus file, copies of a dup_ratio share of them and
+		resaved JPEGs for a near_ratio share; returns (files, exact, near) '''
+	rng = random.Random(seed)
+	os.makedirs(path_to)
+	for item in files:
+		os.link( os.path.join(corpus, item['file']), os.path.join(path_to, item['file']) )
+	exact = 0
+	for item in rng.sample( files, int(len(files) * dup_ratio) ):
+		stem, ext = item['file'].rsplit('.', 1)
+		for copy in range(copies):
+			shutil.copy( os.path.join(corpus, item['file']), os.path.join(path_to, '%s_copy%d.%s' % (stem, copy + 1, ext)) )
+			exact += 1
+	jpegs = [ item for item in files if item['kind'] == 'jpeg' ]
+	near = rng.sample( jpegs, min(len(jpegs), int(len(files) * near_ratio)) )
+	for item in near:
+		with Image.open( os.path.join(corpus, item['file']) ) as pimg:
+			pimg.save( os.path.join(path_to, '%s_resaved.jpg' % item['file'].rsplit('.', 1)[0]), quality=70 )
+	return len(os.listdir(path_to)), exact, len(near)
+
+def runSession( path_drop, options, dedupe, workers ):
+	''' import the drop folder and optimize it in a fresh WAO tree, returns the timings '''
+	root = tempfile.mkdtemp( prefix='wao-dedupe-' )
+	constants.ROOT = root
+	try:
+		wao = WAODirector()
+		wao.workers = workers
+		wao.dedupe = dedupe
+		wao.perceptual_hash = dedupe
+		start = time.perf_counter()
+		wao.importFolder( path_drop )
+		imported = time.perf_counter() - start
+		assets = list(wao.uploaded)
+		wao.stageAssets( assets, wao.path_optmze, 'web', from_origin=True )
+		start = time.perf_counter()
+		results = wao.optimizeImages( assets, options, workers=workers, use_cache=False )
+		optimized = time.perf_counter() - start
+		wao.catalog.close()
+		return {
+			'files': len(assets),
+			'failed': sum( not result.ok for result in results ),
+			'import': imported,
+			'optimize': optimized,
+			'duplicates': sum( asset.duplicate_of is not None for asset in assets ),
+			'similar': sum( asset.similar_to is not None for asset in assets ),
+		}
+	finally:
+		shutil.rmtree( root, ignore_errors=True )
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--corpus', help='corpus folder, created (or reused) by make_corpus.py rules; a temporary one by default')
+	parser.add_argument('--count', type=int, default=120)
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--mix', default=DEFAULT_MIX)
+	parser.add_argument('--dup-ratio', type=float, default=0.3, help='share of the files copied under other names')
+	parser.add_argument('--copies', type=int, default=2, help='copies of each of them')
+	parser.add_argument('--near-ratio', type=float, default=0.1, help='share of the files resaved as near copies (JPEGs)')
+	parser.add_argument('--preset', choices=list(constants.PRESETS), default=constants.PRESET)
+	parser.add_argument('--workers', type=int, default=constants.WORKERS)
+	args = parser.parse_args()
+	corpus = args.corpus or os.path.join( tempfile.gettempdir(), 'wao-corpus-%d-%d-%08x' % (args.count, args.seed, zlib.crc32(args.mix.encode())) )
+	manifest = makeCorpus( corpus, args.count, args.seed, args.mix )
+	options = {
+		'width': constants.LIMITS['width'],
+		'height': constants.LIMITS['height'],
+		'qlty': constants.LIMITS['qlty'],
+		'colors': constants.LIMITS['colors'],
+		'backend': 'pillow',
+		'preset': args.preset,
+	}
+	path_drop = tempfile.mkdtemp( prefix='wao-drop-' )
+	shutil.rmtree( path_drop )
+	try:
+		files, exact, near = makeDrop( corpus, manifest['files'], path_drop, args.dup_ratio, args.copies, args.near_ratio, args.seed )
+		rows = [ ('every file', runSession(path_drop, options, False, args.workers)), ('deduped', runSession(path_drop, options, True, args.workers)) ]
+	finally:
+		shutil.rmtree( path_drop, ignore_errors=True )
+	print('%d files (%d corpus, %d exact copies, %d resaved), preset %s, %d workers' % (files, len(manifest['files']), exact, near, args.preset, args.workers))
+	print('%-11s %9s %11s %8s %11s %8s %7s' % ('run', 'import s', 'optimize s', 'speedup', 'duplicates', 'similar', 'failed'))
+	base = rows[0][1]['optimize']
+	for name, row in rows:
+		print('%-11s %9.2f %11.2f %7.2fx %11d %8d %7d' % (name, row['import'], row['optimize'], base / row['optimize'], row['duplicates'], row['similar'], row['failed']))
+	print('files per distinct file: %.2f (the copies are picked at random, the speedup follows their bytes)' % (files / (files - exact)))
+
+if __name__ == '__main__':
+	main()
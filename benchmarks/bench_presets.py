@@ -0,0 +1,108 @@
+'''
+BENCHMARK: the pillow backend presets (constants.PRESETS) on a synthetic corpus
+- every corpus file optimized once per preset, from the same originals
+- throughput (files/s, MB/s) and the output bytes per preset
+- quality: PSNR of each output against the original decoded in full and
+  LANCZOS-resized to the output size (the best the output could look)
+usage: python benchmarks/bench_presets.py [--corpus DIR] [--count 120] [--seed 1] [--workers N] [--output results.json]
+'''
+import os, sys, json, time, zlib, shutil, argparse, tempfile
+import numpy
+from PIL import Image
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib import constants
+from lib.AssetFactory import Asset
+from lib.TaskFactory import TaskPool
+from make_corpus import makeCorpus, DEFAULT_MIX
+
+def getAssets( corpus, files, path_to ):
+	''' an asset per corpus file, linked into path_to '''
+	return [ Asset(index, item['file'], corpus, path_to) for index, item in enumerate(files) ]
+
+def optimize( asset, options ):
+	''' pool task: (ok, seconds) '''
+	start = time.perf_counter()
+	is_done = asset.optimizeImage( options )
+	return is_done, time.perf_counter() - start
+
+def getPSNR( path_origin, path_output ):
+	''' PSNR (dB) of the output against the resized full decode, None for GIFs
+		(left untouched) and outputs with the original's pixels (nothing saved) '''
+	with Image.open(path_output) as out, Image.open(path_origin) as ref:
+		if ref.format == 'GIF':
+			return None
+		out = out.convert('RGB')
+		ref = ref.convert('RGB')
+		if ref.size != out.size:
+			ref = ref.resize( out.size, Image.LANCZOS )
+		diff = numpy.asarray(out, dtype=numpy.float32) - numpy.asarray(ref, dtype=numpy.float32)
+	mse = float( (diff * diff).mean() )
+	return None if mse == 0 else float( 10 * numpy.log10(255 ** 2 / mse) )
+
+def runPreset( corpus, files, options, workers ):
+	''' optimize every file with the preset, returns its result record '''
+	path_to = tempfile.mkdtemp( prefix='wao-preset-' )
+	try:
+		assets = getAssets( corpus, files, path_to )
+		bytes_in = sum( item['bytes'] for item in files )
+		start = time.perf_counter()
+		results = TaskPool(workers).map( optimize, assets, options )
+		seconds = time.perf_counter() - start
+		failed = sum( not (result.ok and result.value[0]) for result in results )
+		bytes_out = sum( os.path.getsize(asset.getActiveFile()) for asset in assets )
+		quality = {}
+		for asset, item in zip(assets, files):
+			psnr = getPSNR( os.path.join(corpus, item['file']), asset.getActiveFile() )
+			if psnr is not None:
+				quality.setdefault( 'jpeg' if item['kind'] == 'jpeg' else 'png', [] ).append( psnr )
+	finally:
+		shutil.rmtree( path_to, ignore_errors=True )
+	return {
+		'files': len(files),
+		'failed': failed,
+		'seconds': round(seconds, 4),
+		'files_per_s': round(len(files) / seconds, 2),
+		'mb_per_s': round(bytes_in / 1024**2 / seconds, 2),
+		'bytes_in': bytes_in,
+		'bytes_out': bytes_out,
+		'psnr': { kind: {'median': round(float(numpy.median(values)), 2), 'min': round(float(numpy.min(values)), 2)} for kind, values in sorted(quality.items()) },
+	}
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--corpus', help='corpus folder, created (or reused) by make_corpus.py rules; a temporary one by default')
+	parser.add_argument('--count', type=int, default=120)
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--mix', default=DEFAULT_MIX)
+	parser.add_argument('--workers', type=int, default=constants.WORKERS)
+	parser.add_argument('--output', help='write the results to this JSON file')
+	args = parser.parse_args()
+	corpus = args.corpus or os.path.join( tempfile.gettempdir(), 'wao-corpus-%d-%d-%08x' % (args.count, args.seed, zlib.crc32(args.mix.encode())) )
+	manifest = makeCorpus( corpus, args.count, args.seed, args.mix )
+	results = {}
+	for preset in constants.PRESETS:
+		options = {
+			'width': constants.LIMITS['width'],
+			'height': constants.LIMITS['height'],
+			'qlty': constants.LIMITS['qlty'],
+			'colors': constants.LIMITS['colors'],
+			'backend': 'pillow',
+			'preset': preset,
+		}
+		results[preset] = runPreset( corpus, manifest['files'], options, args.workers )
+	base = results['max']
+	print('%d files, %.1f MB, %d workers' % (len(manifest['files']), manifest['bytes'] / 1024**2, args.workers))
+	print('%-9s %8s %8s %8s %8s %9s %12s %12s' % ('preset', 'seconds', 'files/s', 'speedup', 'MB/s', 'out MB', 'JPEG PSNR', 'PNG PSNR'))
+	for preset, row in results.items():
+		print('%-9s %8.2f %8.1f %7.2fx %8.1f %9.2f %12s %12s' % (
+			preset, row['seconds'], row['files_per_s'], base['seconds'] / row['seconds'], row['mb_per_s'], row['bytes_out'] / 1024**2,
+			'%(median).1f/%(min).1f' % row['psnr']['jpeg'] if 'jpeg' in row['psnr'] else '-',
+			'%(median).1f/%(min).1f' % row['psnr']['png'] if 'png' in row['psnr'] else '-',
+		))
+	print('PSNR in dB, median/min of the rewritten files, against the full decode resized with LANCZOS')
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump( {'corpus': manifest['params'], 'workers': args.workers, 'presets': results}, f, indent=1 )
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,248 @@
+'''
+BENCHMARK: every WAO stage on a synthetic corpus (see make_corpus.py)
+- import, assess, optimize, geotag and package, run through the WAODirector
+- per stage: wall time, throughput (files/s, MB/s), p50/p95 latency per file
+  and the process peak RSS once the stage is done
+- runs offline: WAO works in a temporary root and geocodes against a local
+  Nominatim stand-in server
+- results are saved as JSON; --compare prints the change against an earlier run
+usage: python benchmarks/bench_stages.py [--corpus DIR] [--count 300] [--seed 1] [--workers N] [--output results.json] [--compare old.json]
+'''
+import os, sys, json, time, zlib, shutil, argparse, tempfile, platform, threading, contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import PIL
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib import constants
+from lib import WAODirector
+from lib.TaskFactory import TaskPool
+from lib.MetaTagFactory import NominatimProvider
+from make_corpus import makeCorpus, DEFAULT_MIX
+
+try:
+	import resource
+except ImportError:
+	# not on Windows
+	resource = None
+
+STAGES = ('import', 'assess', 'optimize', 'geotag', 'package')
+ADDRESS = '1 Bench Street, Testville'
+COORDS = (32.7157, -117.1611)
+
+class GeocodeStub(BaseHTTPRequestHandler):
+	''' answers every Nominatim /search with the same place '''
+	def do_GET( self ):
+		body = json.dumps([ {'lat': str(COORDS[0]), 'lon': str(COORDS[1])} ]).encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message( self, *args ):
+		pass
+
+def startGeocodeStub():
+	''' local server thread, returns (server, base url) '''
+	server = ThreadingHTTPServer( ('127.0.0.1', 0), GeocodeStub )
+	threading.Thread( target=server.serve_forever, daemon=True ).start()
+	return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+def getPeakRSS():
+	''' process high-water resident set size in MB (None when unknown) '''
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# bytes on macOS, kilobytes elsewhere
+	return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+def getPercentile( values, percent ):
+	''' nearest-rank percentile of a list of numbers '''
+	if not values:
+		return None
+	ordered = sorted(values)
+	rank = max( 0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1) )
+	return ordered[rank]
+
+def timed( task ):
+	''' pool task wrapper returning (task result, seconds taken) '''
+	def run( asset, *args ):
+		start = time.perf_counter()
+		value = task( asset, *args )
+		return value, time.perf_counter() - start
+	return run
+
+def getStageResult( files, seconds, latencies, bytes_in, bytes_out=None, failed=0 ):
+	''' the JSON record of a stage '''
+	return {
+		'files': files,
+		'failed': failed,
+		'seconds': round(seconds, 4),
+		'files_per_s': round(files / seconds, 2) if seconds else None,
+		'mb_per_s': round(bytes_in / 1024**2 / seconds, 2) if seconds else None,
+		'p50_ms': round(getPercentile(latencies, 50) * 1000, 3) if latencies else None,
+		'p95_ms': round(getPercentile(latencies, 95) * 1000, 3) if latencies else None,
+		'bytes_in': bytes_in,
+		'bytes_out': bytes_out,
+		'peak_rss_mb': getPeakRSS(),
+	}
+
+def getActiveBytes( assets ):
+	return sum( os.path.getsize(asset.getActiveFile()) for asset in assets )
+
+def runPoolStage( assets, task, args, workers ):
+	''' run a pool task over the assets, returns (seconds, per file latencies, failed) '''
+	latencies, failed = [], 0
+	start = time.perf_counter()
+	for result in TaskPool(workers).map( timed(task), assets, *args ):
+		if result.ok and result.value[0]:
+			latencies.append( result.value[1] )
+		else:
+			failed += 1
+	return time.perf_counter() - start, latencies, failed
+
+def benchImport( wao, corpus ):
+	''' streamed folder import; per file latency is the batch time over its size '''
+	latencies, last = [], [time.perf_counter(), 0]
+	def progress( result, done, total ):
+		now = time.perf_counter()
+		count = done - last[1]
+		if count:
+			latencies.extend( [(now - last[0]) / count] * count )
+		last[:] = [now, done]
+	start = time.perf_counter()
+	wao.importFolder( corpus, progress=progress )
+	seconds = time.perf_counter() - start
+	assets = list(wao.uploaded)
+	return assets, getStageResult( len(assets), seconds, latencies, sum( asset.bytes for asset in assets ) )
+
+def benchAssess( assets, options ):
+	''' header probe + transparency check per asset, probe cache dropped first '''
+	latencies = []
+	start = time.perf_counter()
+	for asset in assets:
+		asset.probe = None
+		tick = time.perf_counter()
+		asset.assessImage( options )
+		latencies.append( time.perf_counter() - tick )
+	seconds = time.perf_counter() - start
+	return getStageResult( len(assets), seconds, latencies, getActiveBytes(assets) )
+
+def benchOptimize( wao, assets, options, workers ):
+	''' optimize from the originals, the output cache is bypassed '''
+	wao.stageAssets( assets, wao.path_optmze, 'web', from_origin=True )
+	bytes_in = getActiveBytes(assets)
+	seconds, latencies, failed = runPoolStage( assets, WAODirector._optimizeAsset, (options, None), workers )
+	return getStageResult( len(assets), seconds, latencies, bytes_in, getActiveBytes(assets), failed )
+
+def benchGeotag( wao, assets, workers ):
+	''' address lookup against the stub, then the EXIF GPS writes '''
+	start = time.perf_counter()
+	coords = wao.geocoder.lookup( ADDRESS )
+	lookup_ms = (time.perf_counter() - start) * 1000
+	if not coords:
+		raise RuntimeError('geocode stub did not answer')
+	wao.stageAssets( assets, wao.path_geotag, 'geo' )
+	bytes_in = getActiveBytes(assets)
+	options = {'lat': coords[0], 'long': coords[1]}
+	seconds, latencies, failed = runPoolStage( assets, WAODirector._geotagAsset, (options,), workers )
+	result = getStageResult( len(assets), seconds, latencies, bytes_in, getActiveBytes(assets), failed )
+	result['geocode_ms'] = round(lookup_ms, 3)
+	return result
+
+def benchPackage( wao, assets, path_zip ):
+	''' ZIP package of the final files; per file latency from the member progress '''
+	latencies, last = [], [time.perf_counter()]
+	def progress( result, done, total ):
+		now = time.perf_counter()
+		latencies.append( now - last[0] )
+		last[0] = now
+	bytes_in = getActiveBytes(assets)
+	start = time.perf_counter()
+	zip_file = wao.packageAssets( path_zip, filename='BenchPackage', progress=progress )
+	seconds = time.perf_counter() - start
+	return getStageResult( len(assets), seconds, latencies, bytes_in, os.path.getsize(os.path.join(path_zip, zip_file)) )
+
+def runBench( corpus, workers, options ):
+	''' every stage in order on a fresh WAO root, returns the stage results '''
+	root = tempfile.mkdtemp( prefix='wao-bench-' )
+	server, url = startGeocodeStub()
+	constants.ROOT = root
+	results = {}
+	try:
+		wao = WAODirector.WAODirector( path_cache=os.path.join(root, 'cache') )
+		wao.geocoder.setProvider( NominatimProvider(url) )
+		wao.geocoder.interval = 0
+		# the stages print their progress, keep the report readable
+		with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+			assets, results['import'] = benchImport( wao, corpus )
+			results['assess'] = benchAssess( assets, options )
+			results['optimize'] = benchOptimize( wao, assets, options, workers )
+			results['geotag'] = benchGeotag( wao, assets, workers )
+			results['package'] = benchPackage( wao, assets, root )
+		wao.catalog.close()
+	finally:
+		server.shutdown()
+		shutil.rmtree( root, ignore_errors=True )
+	return results
+
+def printReport( results, baseline=None ):
+	print('%-10s %7s %9s %9s %8s %10s %10s %9s' % ('stage', 'files', 'seconds', 'files/s', 'MB/s', 'p50 ms', 'p95 ms', 'RSS MB'))
+	for stage in STAGES:
+		row = results[stage]
+		print('%-10s %7d %9.3f %9s %8s %10s %10s %9s' % (
+			stage, row['files'], row['seconds'], row['files_per_s'], row['mb_per_s'],
+			row['p50_ms'], row['p95_ms'], '%.1f' % row['peak_rss_mb'] if row['peak_rss_mb'] else '-',
+		))
+	if not baseline:
+		return
+	print('\nchange against the baseline (seconds, p95)')
+	for stage in STAGES:
+		old, new = baseline.get(stage), results[stage]
+		if not old or not old['seconds'] or not old['p95_ms']:
+			continue
+		print('%-10s %+8.1f%% %+8.1f%%' % (
+			stage, 100 * (new['seconds'] / old['seconds'] - 1), 100 * (new['p95_ms'] / old['p95_ms'] - 1),
+		))
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--corpus', help='corpus folder, created (or reused) by make_corpus.py rules; a temporary one by default')
+	parser.add_argument('--count', type=int, default=300)
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--mix', default=DEFAULT_MIX)
+	parser.add_argument('--workers', type=int, default=constants.WORKERS)
+	parser.add_argument('--output', help='write the results to this JSON file')
+	parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+	args = parser.parse_args()
+	corpus = args.corpus or os.path.join( tempfile.gettempdir(), 'wao-corpus-%d-%d-%08x' % (args.count, args.seed, zlib.crc32(args.mix.encode())) )
+	manifest = makeCorpus( corpus, args.count, args.seed, args.mix )
+	options = {
+		'width': constants.LIMITS['width'],
+		'height': constants.LIMITS['height'],
+		'qlty': constants.LIMITS['qlty'],
+		'colors': constants.LIMITS['colors'],
+		'backend': 'pillow',
+	}
+	stages = runBench( corpus, args.workers, options )
+	report = {
+		'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'python': platform.python_version(),
+		'pillow': PIL.__version__,
+		'platform': platform.platform(),
+		'cpus': os.cpu_count(),
+		'workers': args.workers,
+		'corpus': { 'path': corpus, 'params': manifest['params'], 'files': len(manifest['files']), 'bytes': manifest['bytes'] },
+		'options': options,
+		'stages': stages,
+	}
+	baseline = None
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)['stages']
+	printReport( stages, baseline )
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump( report, f, indent=1 )
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,86 @@
+'''
+BENCHMARK: target size mode, the guided quality search (downscaled trial
+predictions corrected by the full encodes) vs plain bisection of the quality
+over full size encodes, on the JPEGs of a synthetic corpus (see make_corpus.py)
+- full size encodes per image, seconds per image, how full the budget ends up
+  (output bytes / target) and the images that could not fit at all
+usage: python benchmarks/bench_target.py [--corpus DIR] [--count 120] [--seed 1] [--targets 50KB,150KB,400KB]
+'''
+import os, sys, time, zlib, argparse, tempfile
+from PIL import Image
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib import constants
+from lib.AssetFactory import Asset
+from lib.FileFactory import FileFactory
+from lib.LogFactory import Logger
+from make_corpus import makeCorpus, DEFAULT_MIX
+
+def makeAsset( name ):
+	''' just enough of an Asset for the encode helpers '''
+	asset = Asset.__new__(Asset)
+	asset.name_origin = name
+	asset.ext = 'jpg'
+	return asset
+
+def runGuided( asset, pimg, options ):
+	''' WAO's target size search, returns (bytes, full encodes) '''
+	Logger.reset()
+	buffer = asset._encodeToTarget( pimg, options, progressive=True )
+	return buffer.getbuffer().nbytes, Logger.getStats()['counters']['target_encodes']['stage=optimize']
+
+def runBisect( asset, pimg, options ):
+	''' the highest fitting quality by bisection over full encodes, returns (bytes, full encodes) '''
+	lo, hi, best, smallest, encodes = 1, options['qlty'], None, None, 0
+	while lo <= hi:
+		quality = (lo + hi + 1) // 2
+		nbytes = asset._encodeJpeg( pimg, dict(options, qlty=quality), progressive=True ).getbuffer().nbytes
+		encodes += 1
+		if nbytes <= options['target']:
+			best, lo = nbytes, quality + 1
+		else:
+			smallest, hi = nbytes, quality - 1
+	return (best if best is not None else smallest), encodes
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--corpus', help='corpus folder, created (or reused) by make_corpus.py rules; a temporary one by default')
+	parser.add_argument('--count', type=int, default=120)
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--mix', default=DEFAULT_MIX)
+	parser.add_argument('--targets', default='50KB,150KB,400KB')
+	args = parser.parse_args()
+	corpus = args.corpus or os.path.join( tempfile.gettempdir(), 'wao-corpus-%d-%d-%08x' % (args.count, args.seed, zlib.crc32(args.mix.encode())) )
+	manifest = makeCorpus( corpus, args.count, args.seed, args.mix )
+	targets = [ FileFactory.parseBytes(target) for target in args.targets.split(',') ]
+	# the JPEGs big enough for a budget to matter
+	files = [ item for item in manifest['files'] if item['kind'] == 'jpeg' and item['bytes'] > min(targets) ]
+	options = { 'width': constants.LIMITS['width'], 'height': constants.LIMITS['height'], 'qlty': constants.LIMITS['qlty'], 'colors': constants.LIMITS['colors'] }
+	img_case = (True, True, True, False)
+	totals = { name: {'seconds': 0.0, 'encodes': 0, 'fill': 0.0, 'missed': 0, 'runs': 0} for name in ('guided', 'bisect') }
+	for item in files:
+		asset = makeAsset( item['file'] )
+		with Image.open( os.path.join(corpus, item['file']) ) as pimg:
+			asset._downsizeImage( pimg, img_case, options )
+			pimg.load()
+			for target in targets:
+				for name, run in (('guided', runGuided), ('bisect', runBisect)):
+					start = time.perf_counter()
+					nbytes, encodes = run( asset, pimg, dict(options, target=target) )
+					row = totals[name]
+					row['seconds'] += time.perf_counter() - start
+					row['encodes'] += encodes
+					row['runs'] += 1
+					if nbytes > target:
+						row['missed'] += 1
+					else:
+						row['fill'] += nbytes / target
+	print('%d JPEGs x %d targets (%s)' % (len(files), len(targets), args.targets))
+	print('%-8s %12s %12s %10s %8s' % ('search', 'encodes/img', 'ms/img', 'fill', 'missed'))
+	for name, row in totals.items():
+		fitted = row['runs'] - row['missed']
+		print('%-8s %12.2f %12.1f %9.1f%% %8d' % (
+			name, row['encodes'] / row['runs'], row['seconds'] * 1000 / row['runs'], 100 * row['fill'] / fitted if fitted else 0, row['missed'],
+		))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,55 @@
+'''
+BENCHMARK: Asset._hasTransparency (row sample + PIL alpha extrema) vs Asset._scanTransparency (PIL)
+usage: python benchmarks/bench_transparency.py [--width 6000] [--height 4000] [--repeat 5]
+'''
+import os, sys, time, argparse
+import numpy
+from PIL import Image
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib.AssetFactory import Asset
+
+def makeImages( width, height ):
+	''' large RGBA and P-mode images, with and without transparency in use '''
+	images = {}
+	rgba = numpy.full((height, width, 4), 255, dtype=numpy.uint8)
+	images['RGBA opaque'] = Image.fromarray(rgba.copy(), 'RGBA')
+	rgba[height - 1, width - 1, 3] = 0
+	images['RGBA last pixel clear'] = Image.fromarray(rgba.copy(), 'RGBA')
+	rgba[:, width // 3:, 3] = 0
+	images['RGBA mostly clear'] = Image.fromarray(rgba.copy(), 'RGBA')
+	indexes = (numpy.arange(width * height) % 200).astype(numpy.uint8).reshape(height, width)
+	pal = Image.fromarray(indexes, 'L').convert('P')
+	pal.info['transparency'] = 250
+	images['P index unused'] = pal
+	pal = pal.copy()
+	pal.info['transparency'] = 199
+	images['P index used'] = pal
+	return images
+
+def timeIt( func, img, repeat ):
+	''' best of repeat runs, in seconds '''
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = func(img)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return result, best
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--width', type=int, default=6000)
+	parser.add_argument('--height', type=int, default=4000)
+	parser.add_argument('--repeat', type=int, default=5)
+	args = parser.parse_args()
+	asset = Asset.__new__(Asset)
+	print('%-24s %8s %10s %10s %8s' % ('case', 'result', 'old ms', 'new ms', 'speedup'))
+	for case, img in makeImages(args.width, args.height).items():
+		img.load()
+		old, old_s = timeIt(asset._scanTransparency, img, args.repeat)
+		new, new_s = timeIt(asset._hasTransparency, img, args.repeat)
+		assert old == new, 'mismatch on %s' % case
+		print('%-24s %8s %10.2f %10.2f %7.1fx' % (case, new, old_s * 1000, new_s * 1000, old_s / new_s))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,85 @@
+'''
+BENCHMARK: srcset ladder from one decode (preset draft + progressive reduce, parallel
+encodes) vs one full optimize run per width (full decode + LANCZOS each time)
+usage: python benchmarks/bench_variants.py [--width 6000] [--height 4000] [--widths 320,640,1024,1280,1920] [--repeat 3] [--preset max]
+'''
+import os, sys, time, argparse, tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+from PIL import Image
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib import constants
+from lib.AssetFactory import Asset
+
+def makeSource( path, width, height ):
+	''' a photo-like JPEG original '''
+	grid = numpy.random.default_rng(1).integers(0, 256, (height // 48, width // 48, 3), dtype=numpy.uint8)
+	img = Image.fromarray(grid, 'RGB').resize( (width, height), Image.BICUBIC )
+	img.save( path, quality=92 )
+	return path
+
+def makeAsset( path ):
+	''' just enough of an Asset for the encode helpers '''
+	asset = Asset.__new__(Asset)
+	asset.name_origin = os.path.basename(path)
+	asset.ext = 'jpg'
+	return asset
+
+def runSingles( asset, path, widths, options, path_to ):
+	''' today: one optimize run per width, each decoding the full original '''
+	for width in widths:
+		with Image.open(path) as pimg:
+			pimg.thumbnail( (width, pimg.size[1]), resample=Image.LANCZOS )
+			buffer = asset._encodeJpeg( pimg, options, progressive=True )
+		with open('%s/single_w%d.jpg' % (path_to, width), 'wb') as f:
+			f.write( buffer.getbuffer() )
+
+def runLadder( asset, path, widths, options, path_to, encoder ):
+	''' the variant mode: one decode (DCT-scaled when the preset drafts), each
+		rung from the one above '''
+	# no optimized output here, only the widest rung limits the draft
+	img_case = (True, True, True, False)
+	ladder = dict(options, variants=widths, width=max(widths), height=max(widths))
+	with Image.open(path) as pimg:
+		asset._draftImage( pimg, img_case, ladder )
+		return asset._makeVariants( pimg, img_case, ladder, path_to, encoder )
+
+def best( func, repeat ):
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		times.append( time.perf_counter() - start )
+	return min(times)
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--width', type=int, default=6000)
+	parser.add_argument('--height', type=int, default=4000)
+	parser.add_argument('--widths', default='320,640,1024,1280,1920')
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--workers', type=int, default=constants.WORKERS)
+	parser.add_argument('--preset', choices=list(constants.PRESETS), default=constants.PRESET)
+	args = parser.parse_args()
+	widths = [ int(width) for width in args.widths.split(',') ]
+	options = { 'qlty': 85, 'colors': 256, 'preset': args.preset }
+	with tempfile.TemporaryDirectory() as path_to, ThreadPoolExecutor(max_workers=args.workers) as encoder:
+		path = makeSource( '%s/source.jpg' % path_to, args.width, args.height )
+		asset = makeAsset( path )
+		singles = best( lambda: runSingles(asset, path, widths, options, path_to), args.repeat )
+		ladder = best( lambda: runLadder(asset, path, widths, options, path_to, encoder), args.repeat )
+		print('%dx%d source, %d rungs (%s), %d workers, preset %s' % (args.width, args.height, len(widths), args.widths, args.workers, args.preset))
+		print('%-28s %10.3f s' % ('%d single runs' % len(widths), singles))
+		print('%-28s %10.3f s' % ('ladder (one decode)', ladder))
+		print('speedup: %.1fx' % (singles / ladder))
+		# how far the ladder rungs drift from the single-run outputs
+		for width in widths:
+			with Image.open('%s/single_w%d.jpg' % (path_to, width)) as a, Image.open('%s/source_w%d.jpg' % (path_to, width)) as b:
+				if a.size != b.size:
+					print('w%-5d size differs %s %s' % (width, a.size, b.size))
+					continue
+				diff = numpy.abs( numpy.asarray(a, dtype=numpy.int16) - numpy.asarray(b, dtype=numpy.int16) )
+				print('w%-5d mean abs pixel diff %.2f' % (width, diff.mean()))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,100 @@
+'''
+BENCHMARK: watch mode memory over a long run, files dropped into the watched
+folder in waves while the daemon (python -m lib --watch, run in-process in a
+temporary root) imports, optimizes, geotags and exports them
+- the process RSS and the number of live Python objects after every wave,
+  and the growth from the first tenth of the run to the last
+- latency: seconds from a wave landing to its last file exported
+usage: python benchmarks/bench_watch.py [--waves 40] [--files 25] [--size 640] [--settle 0.2] [--poll]
+'''
+import os, sys, gc, time, signal, shutil, argparse, tempfile, threading
+import numpy
+from PIL import Image
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib import constants
+from lib import __main__ as cli
+
+def getRSS():
+	''' resident set size in MB (Linux), None elsewhere '''
+	try:
+		with open('/proc/self/status') as f:
+			for line in f:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1]) / 1024
+	except OSError:
+		return None
+
+def makeImage( path, size, seed ):
+	''' a small photo-like JPEG, different for every seed '''
+	grid = numpy.random.default_rng(seed).integers(0, 256, (size // 32, size // 32, 3), dtype=numpy.uint8)
+	Image.fromarray(grid, 'RGB').resize( (size, size * 3 // 4), Image.BICUBIC ).save( path, quality=90 )
+
+def dropWaves( args, path_drop, path_out, samples ):
+	''' drop the waves one after the other, each once the previous one is exported,
+		then stop the daemon '''
+	path_stage = tempfile.mkdtemp( prefix='wao-stage-' )
+	try:
+		for wave in range(args.waves):
+			folder = os.path.join( path_drop, 'wave%03d' % wave )
+			os.makedirs( folder )
+			names = []
+			for index in range(args.files):
+				# the same names in every wave, kept apart by their sub-folder
+				name = 'img%03d.jpg' % index
+				# written aside, then moved in (like a sync client)
+				makeImage( os.path.join(path_stage, name), args.size, wave * args.files + index )
+				os.replace( os.path.join(path_stage, name), os.path.join(folder, name) )
+				names.append( name.replace('.jpg', '_web_geo.jpg') )
+			start = time.perf_counter()
+			expected = [ os.path.join(path_out, 'wave%03d' % wave, name) for name in names ]
+			while not all( os.path.exists(path) for path in expected ):
+				if time.perf_counter() - start > 120:
+					raise RuntimeError('wave %d was not exported' % wave)
+				time.sleep( 0.05 )
+			latency = time.perf_counter() - start
+			gc.collect()
+			samples.append( (wave, getRSS(), len(gc.get_objects()), latency) )
+	finally:
+		shutil.rmtree( path_stage, ignore_errors=True )
+		os.kill( os.getpid(), signal.SIGTERM )
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--waves', type=int, default=40)
+	parser.add_argument('--files', type=int, default=25, help='files per wave')
+	parser.add_argument('--size', type=int, default=640, help='image width')
+	parser.add_argument('--settle', type=float, default=0.2)
+	parser.add_argument('--poll', action='store_true', help='polling instead of inotify')
+	args = parser.parse_args()
+	root = tempfile.mkdtemp( prefix='wao-watch-' )
+	constants.ROOT = root
+	path_drop, path_out = os.path.join(root, 'drop'), os.path.join(root, 'out')
+	os.makedirs( path_drop )
+	samples = []
+	dropper = threading.Thread( target=dropWaves, args=(args, path_drop, path_out, samples), daemon=True )
+	argv = [ '--watch', path_drop, '--out', path_out, '--geotag', '--settle', str(args.settle), '--log', os.devnull ]
+	if args.poll:
+		argv.append( '--poll' )
+	stdout = sys.stdout
+	try:
+		with open(os.devnull, 'w') as devnull:
+			sys.stdout = devnull
+			dropper.start()
+			cli.main( argv )
+	finally:
+		sys.stdout = stdout
+		shutil.rmtree( root, ignore_errors=True )
+	print('%d waves x %d files (%dpx JPEGs), settle %.1f s, %s' % (args.waves, args.files, args.size, args.settle, 'polling' if args.poll else 'inotify'))
+	print('%6s %9s %10s %10s' % ('wave', 'RSS MB', 'objects', 'latency s'))
+	step = max(1, len(samples) // 10)
+	for wave, rss, objects, latency in samples[::step] + ([samples[-1]] if (len(samples) - 1) % step else []):
+		print('%6d %9.1f %10d %10.2f' % (wave, rss or 0, objects, latency))
+	tenth = max(1, len(samples) // 10)
+	first, last = samples[:tenth], samples[-tenth:]
+	print('growth first -> last tenth: RSS %+.1f MB, objects %+d' % (
+		numpy.mean([ s[1] or 0 for s in last ]) - numpy.mean([ s[1] or 0 for s in first ]),
+		numpy.mean([ s[2] for s in last ]) - numpy.mean([ s[2] for s in first ]),
+	))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,76 @@
+'''
+BENCHMARK: how the optimize stage scales with the TaskPool worker count, a
+synthetic corpus (see make_corpus.py) optimized with the pillow backend once
+per worker count
+- optimize seconds, files/s, speedup over the fewest workers and the parallel
+  efficiency (speedup per added worker)
+- the pool runs threads, so the speedup is bounded by the CPUs and by how much
+  of the work Pillow does with the GIL released (decode, resize, encode)
+usage: python benchmarks/bench_workers.py [--corpus DIR] [--count 120] [--seed 1] [--workers 1,2,4,8] [--preset max]
+'''
+import os, sys, time, zlib, shutil, argparse, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib import constants
+from lib.WAODirector import WAODirector
+from make_corpus import makeCorpus, DEFAULT_MIX
+
+def runSession( corpus, options, workers ):
+	''' import the corpus and optimize it in a fresh WAO tree, returns the timings '''
+	root = tempfile.mkdtemp( prefix='wao-workers-' )
+	constants.ROOT = root
+	try:
+		wao = WAODirector()
+		wao.workers = workers
+		wao.importFolder( corpus )
+		assets = list(wao.uploaded)
+		wao.stageAssets( assets, wao.path_optmze, 'web', from_origin=True )
+		start = time.perf_counter()
+		results = wao.optimizeImages( assets, options, workers=workers, use_cache=False )
+		optimized = time.perf_counter() - start
+		wao.catalog.close()
+		return {
+			'files': len(assets),
+			'failed': sum( not result.ok for result in results ),
+			'optimize': optimized,
+		}
+	finally:
+		shutil.rmtree( root, ignore_errors=True )
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--corpus', help='corpus folder, created (or reused) by make_corpus.py rules; a temporary one by default')
+	parser.add_argument('--count', type=int, default=120)
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--mix', default=DEFAULT_MIX)
+	parser.add_argument('--workers', default='1,2,4,8', help='comma separated worker counts')
+	parser.add_argument('--preset', choices=list(constants.PRESETS), default=constants.PRESET)
+	args = parser.parse_args()
+	counts = sorted( set( max(1, int(count)) for count in args.workers.split(',') ) )
+	corpus = args.corpus or os.path.join( tempfile.gettempdir(), 'wao-corpus-%d-%d-%08x' % (args.count, args.seed, zlib.crc32(args.mix.encode())) )
+	manifest = makeCorpus( corpus, args.count, args.seed, args.mix )
+	options = {
+		'width': constants.LIMITS['width'],
+		'height': constants.LIMITS['height'],
+		'qlty': constants.LIMITS['qlty'],
+		'colors': constants.LIMITS['colors'],
+		'backend': 'pillow',
+		'preset': args.preset,
+	}
+	# the corpus manifest is not an image
+	path_drop = tempfile.mkdtemp( prefix='wao-drop-' )
+	try:
+		for item in manifest['files']:
+			os.link( os.path.join(corpus, item['file']), os.path.join(path_drop, item['file']) )
+		rows = [ (workers, runSession(path_drop, options, workers)) for workers in counts ]
+	finally:
+		shutil.rmtree( path_drop, ignore_errors=True )
+	print('%d files, preset %s, %d CPUs' % (len(manifest['files']), args.preset, os.cpu_count() or 1))
+	print('%-8s %11s %8s %8s %11s %7s' % ('workers', 'optimize s', 'files/s', 'speedup', 'efficiency', 'failed'))
+	# against the fewest workers asked for
+	base_workers, base = rows[0][0], rows[0][1]['optimize']
+	for workers, row in rows:
+		speedup = base / row['optimize']
+		print('%-8d %11.2f %8.1f %7.2fx %10.0f%% %7d' % (workers, row['optimize'], row['files'] / row['optimize'], speedup, 100 * speedup * base_workers / workers, row['failed']))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,158 @@
+'''
+BENCHMARK CORPUS: reproducible synthetic images for the stage benchmarks
+- JPEG photos (some with camera EXIF), true-color PNG photos and screenshots,
+  RGBA PNGs, P-mode PNGs (with and without a transparent index) and GIFs
+- sizes from icons to 8K, picked from a weighted mix
+- the same seed, count and mix always give the same files; an existing corpus
+  with a matching corpus.json is reused
+usage: python benchmarks/make_corpus.py OUT_DIR [--count 300] [--seed 1] [--mix icon=25,thumb=25,web=30,photo=15,8k=5]
+'''
+import os, sys, json, argparse
+import numpy
+from PIL import Image, ImageDraw
+
+# size class -> (min long side, max long side)
+SIZES = {
+	'icon': (16, 64),
+	'thumb': (150, 400),
+	'web': (800, 1920),
+	'photo': (3000, 4000),
+	'8k': (7680, 7680),
+}
+DEFAULT_MIX = 'icon=25,thumb=25,web=30,photo=15,8k=5'
+# kind -> (weight, file extension)
+KINDS = {
+	'jpeg': (45, 'jpg'),
+	'png-photo': (10, 'png'),
+	'png-flat': (5, 'png'),
+	'png-rgba': (15, 'png'),
+	'png-p': (15, 'png'),
+	'gif': (10, 'gif'),
+}
+ASPECTS = ( (1, 1), (4, 3), (3, 2), (16, 9), (3, 4), (2, 3), (9, 16) )
+
+def parseMix( mix ):
+	''' "icon=25,web=75" -> {'icon': 25, 'web': 75} '''
+	weights = {}
+	for part in mix.split(','):
+		name, weight = part.split('=')
+		if name not in SIZES:
+			raise ValueError('unknown size class: %s' % name)
+		weights[name] = float(weight)
+	return weights
+
+def getPlan( count, seed, mix ):
+	''' (filename, kind, width, height, item seed) for every file of the corpus '''
+	rng = numpy.random.default_rng(seed)
+	weights = parseMix(mix)
+	classes = list(weights)
+	p_class = numpy.array([ weights[name] for name in classes ])
+	kinds = list(KINDS)
+	p_kind = numpy.array([ KINDS[kind][0] for kind in kinds ], dtype=float)
+	plan = []
+	for index in range(count):
+		size_class = classes[ rng.choice(len(classes), p=p_class / p_class.sum()) ]
+		kind = kinds[ rng.choice(len(kinds), p=p_kind / p_kind.sum()) ]
+		low, high = SIZES[size_class]
+		side = int(rng.integers(low, high + 1))
+		aspect = ASPECTS[ rng.integers(len(ASPECTS)) ]
+		if aspect[0] >= aspect[1]:
+			width, height = side, max(1, side * aspect[1] // aspect[0])
+		else:
+			width, height = max(1, side * aspect[0] // aspect[1]), side
+		filename = '%s_%05d_%s_%dx%d.%s' % (size_class, index, kind, width, height, KINDS[kind][1])
+		plan.append( (filename, kind, width, height, int(rng.integers(2**31))) )
+	return plan
+
+def makePhoto( rng, width, height ):
+	''' smooth color fields plus sensor-like grain, compresses like a photo '''
+	grid = rng.integers(0, 256, (max(2, height // 48), max(2, width // 48), 3), dtype=numpy.uint8)
+	base = Image.fromarray(grid, 'RGB').resize( (width, height), Image.BICUBIC )
+	grain = rng.integers(-12, 13, (height, width, 1), dtype=numpy.int16)
+	pixels = numpy.asarray(base, dtype=numpy.int16) + grain
+	return Image.fromarray( pixels.clip(0, 255).astype(numpy.uint8), 'RGB' )
+
+def makeFlat( rng, width, height ):
+	''' screenshot or logo: flat boxes in a few colors, compresses like UI art '''
+	palette = [ tuple(int(c) for c in rng.integers(0, 256, 3)) for _ in range(int(rng.integers(3, 24))) ]
+	img = Image.new('RGB', (width, height), palette[0])
+	draw = ImageDraw.Draw(img)
+	for _ in range(int(rng.integers(4, 40))):
+		x0, x1 = sorted( int(x) for x in rng.integers(0, width, 2) )
+		y0, y1 = sorted( int(y) for y in rng.integers(0, height, 2) )
+		draw.rectangle( (x0, y0, x1, y1), fill=palette[ rng.integers(len(palette)) ] )
+	return img
+
+def makeImage( kind, width, height, seed ):
+	''' (PIL image, save keyword arguments) for one corpus file '''
+	rng = numpy.random.default_rng(seed)
+	if kind == 'jpeg':
+		img = makePhoto(rng, width, height)
+		save = { 'quality': int(rng.integers(85, 98)) }
+		# half of them carry camera EXIF, like files straight off a camera
+		if rng.random() < 0.5:
+			exif = Image.Exif()
+			exif[0x010F] = 'WAO Bench'
+			exif[0x0110] = 'Synthetic %d' % (seed % 7)
+			save['exif'] = exif.tobytes()
+		return img, save
+	if kind == 'png-photo':
+		return makePhoto(rng, width, height), {}
+	if kind == 'png-flat':
+		return makeFlat(rng, width, height), {}
+	if kind == 'png-rgba':
+		img = makePhoto(rng, width, height).convert('RGBA')
+		# a clear border around an opaque ellipse, soft enough to need every alpha level
+		mask = Image.new('L', (width, height), 0)
+		ImageDraw.Draw(mask).ellipse( (width // 8, height // 8, width - width // 8, height - height // 8), fill=255 )
+		img.putalpha(mask)
+		return img, {}
+	# P-mode, PNG or GIF
+	img = makeFlat(rng, width, height).quantize( int(rng.integers(4, 64)) )
+	save = {}
+	if rng.random() < 0.5:
+		save['transparency'] = 0
+	return img, save
+
+def makeCorpus( path, count=300, seed=1, mix=DEFAULT_MIX, progress=None ):
+	''' write the corpus into path (reused when already there), returns its corpus.json dict '''
+	params = { 'count': count, 'seed': seed, 'mix': mix }
+	manifest_file = os.path.join(path, 'corpus.json')
+	try:
+		with open(manifest_file) as f:
+			manifest = json.load(f)
+		if manifest['params'] == params and all( os.path.exists(os.path.join(path, item['file'])) for item in manifest['files'] ):
+			return manifest
+		# another corpus was there, drop its files so they are not imported too
+		for item in manifest['files']:
+			if os.path.exists(os.path.join(path, item['file'])):
+				os.remove(os.path.join(path, item['file']))
+	except (OSError, ValueError, KeyError):
+		pass
+	os.makedirs(path, exist_ok=True)
+	files = []
+	for done, (filename, kind, width, height, item_seed) in enumerate(getPlan(count, seed, mix), 1):
+		img, save = makeImage(kind, width, height, item_seed)
+		file_path = os.path.join(path, filename)
+		img.save(file_path, **save)
+		files.append({ 'file': filename, 'kind': kind, 'width': width, 'height': height, 'bytes': os.path.getsize(file_path) })
+		if progress:
+			progress(done, count)
+	manifest = { 'params': params, 'files': files, 'bytes': sum( item['bytes'] for item in files ) }
+	with open(manifest_file, 'w') as f:
+		json.dump(manifest, f, indent=1)
+	return manifest
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('path')
+	parser.add_argument('--count', type=int, default=300)
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--mix', default=DEFAULT_MIX)
+	args = parser.parse_args()
+	manifest = makeCorpus( args.path, args.count, args.seed, args.mix, progress=lambda done, total: print('\r%d/%d' % (done, total), end='', file=sys.stderr) )
+	print('', file=sys.stderr)
+	print('%d files, %.1f MB in %s' % (len(manifest['files']), manifest['bytes'] / 1024**2, args.path))
+
+if __name__ == '__main__':
+	main()
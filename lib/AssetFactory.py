@@ -1,46 +1,174 @@
-import os, sys, subprocess
-from PIL import ImageFile, Image, ExifTags
+import os, sys, io, math, functools, subprocess
+from PIL import ImageFile, Image, ExifTags, features
 ImageFile.LOAD_TRUNCATED_IMAGES = True
-from optimize_images import __main__ as optimizer
+try:
+	import numpy
+except ImportError:
+	numpy = None
 try:
 	import constants
 	from FileFactory import FileFactory
+	from MetaTagFactory import GPSWriter
+	from LogFactory import Logger
 except:
 	from . import constants
 	from .FileFactory import FileFactory
+	from .MetaTagFactory import GPSWriter
+	from .LogFactory import Logger
 '''
 AssetFactory 
+AssetRegistry (indexed asset collection)
 '''
 
 class Asset:
-	''' handles media information '''
-	def __init__( self, aid, filename, path_from, path_to ):
-		''' sets up asset values '''
+	''' handles media information; slotted, and only the file size + mtime are
+		stored, the display strings are derived when asked for '''
+	__slots__ = (
+		'index', 'name_origin', 'name', 'is_optimized', 'is_geotagged',
+		'path_src', 'path_dest', 'path_rel', 'file_source', 'active_file', 'ext',
+		'bytes', 'mtime', 'probe', 'probe_stamp', 'content_hash', 'phash',
+		'duplicate_of', 'similar_to', 'outputs', 'registry',
+	)
+
+	def __init__( self, aid, filename, path_from, path_to, st=None, path_rel='', hashed=False ):
+		''' sets up asset values, st is the imported file's stat when already known;
+			path_rel is the sub-folder it is staged in under path_to (and under every
+			stage folder), which keeps same-named files apart; with hashed a copied
+			import is hashed as it is copied (see FileFactory.importFileTo) '''
 		self.index = aid
 		self.name_origin = filename
 		self.name = filename
 		self.is_optimized = False
 		self.is_geotagged = False
-		# paths
-		self.path_src = path_from
-		self.path_dest = path_to
-		# set the file origin path (DO NOT EDIT)
-		self.file_origin = '%s/%s' % (path_from, filename)
-		# move src asset to uploads/original folder
-		self.file_source = FileFactory.copyFileFromTo(self.name, self.path_src, self.path_dest)
+		# paths, shared by every asset of the same folder
+		self.path_src = sys.intern(path_from)
+		self.path_rel = sys.intern(path_rel)
+		self.path_dest = sys.intern(self.getStagePath(path_to)) if path_to else None
+		# content hash of the original, see getContentHash
+		self.content_hash = None
+		# link src asset into uploads/original folder, ignored files stay put
+		if self.path_dest:
+			self.file_source, self.content_hash = FileFactory.importFileTo( self.name, self.path_src, self.path_dest, hashed )
+		else:
+			self.file_source = self.file_origin
 		# set the active source to the live copy source
 		self.active_file = self.file_source
-		# WAObj details
-		self.ext = self.name.split('.')[-1:][0].lower()
-		self.size = FileFactory.getSize( self.file_source )
-		self.timestamp = FileFactory.getTimestamp( self.file_source )
-		self.modified = FileFactory.getFormatedDatetime( self.timestamp )
-		self.type = FileFactory.determineFileType( self.ext )
+		# WAObj details, a single stat (links share it with the imported file)
+		self.ext = sys.intern( self.name.split('.')[-1:][0].lower() )
+		if st is None:
+			st = os.stat( self.file_source )
+		self.bytes = st.st_size
+		self.mtime = st.st_mtime
+		# image header details, see probeImage
+		self.probe = None
+		self.probe_stamp = None
+		# perceptual hash of the original, see getPerceptualHash
+		self.phash = None
+		# id of the asset this one is an exact (duplicate_of) or near (similar_to) copy of
+		self.duplicate_of = None
+		self.similar_to = None
+		# stage name -> {'file', 'options'} of the last successful run, see setOutput
+		self.outputs = None
+		# the AssetRegistry holding this asset, kept up to date by setFlag
+		self.registry = None
 
 	def __repr__( self ):
 		''' represent asset object by type, size, name, last modified '''
 		return '<Asset type=%s size=%skbs modified_on=%s name=%s>' % (self.type, self.size, self.modified, self.name)
 
+	@property
+	def file_origin( self ):
+		''' the imported file (DO NOT EDIT) '''
+		return '%s/%s' % (self.path_src, self.name_origin)
+
+	@property
+	def size( self ):
+		''' size of the imported file in KBs to three decimal places '''
+		return format(self.bytes/1000, '.3f')
+
+	@property
+	def timestamp( self ):
+		return int(self.mtime)
+
+	@property
+	def modified( self ):
+		return FileFactory.getFormatedDatetime( self.timestamp )
+
+	@property
+	def type( self ):
+		return FileFactory.determineFileType( self.ext )
+
+	@classmethod
+	def fromRecord( cls, record ):
+		''' rebuild an asset from its SessionCatalog record, nothing is re-imported '''
+		self = cls.__new__(cls)
+		self.index = record['id']
+		self.name_origin = record['name_origin']
+		self.name = record['name']
+		self.is_optimized = record['is_optimized']
+		self.is_geotagged = record['is_geotagged']
+		self.path_src = sys.intern(record['path_src'])
+		self.path_dest = sys.intern(record['path_dest']) if record['path_dest'] else None
+		self.path_rel = sys.intern(record['path_rel'] or '')
+		self.file_source = record['file_source']
+		self.active_file = record['active_file']
+		if self.active_file == self.file_source:
+			self.active_file = self.file_source
+		self.ext = record['ext']
+		self.bytes = record['bytes']
+		self.mtime = record['mtime']
+		self.probe = None
+		self.probe_stamp = None
+		self.content_hash = record['content_hash']
+		self.phash = int(record['phash'], 16) if record['phash'] else None
+		self.duplicate_of = record['duplicate_of']
+		self.similar_to = record['similar_to']
+		self.outputs = record['outputs'] or None
+		self.registry = None
+		return self
+
+	def getRecord( self ):
+		''' get asset SessionCatalog record dict '''
+		size = self.probe['size'] if self.probe else (None, None)
+		record = {
+			'id': self.index,
+			'name_origin': self.name_origin,
+			'name': self.name,
+			'path_src': self.path_src,
+			'path_dest': self.path_dest,
+			'path_rel': self.path_rel,
+			'file_source': self.file_source,
+			'active_file': self.active_file,
+			'ext': self.ext,
+			'type': self.type,
+			'bytes': self.bytes,
+			'mtime': self.mtime,
+			'width': size[0],
+			'height': size[1],
+			'content_hash': self.content_hash,
+			'phash': '%016x' % self.phash if self.phash is not None else None,
+			'duplicate_of': self.duplicate_of,
+			'similar_to': self.similar_to,
+			'is_optimized': self.is_optimized,
+			'is_geotagged': self.is_geotagged,
+			'outputs': self.outputs or {},
+		}
+		return record
+
+	def getOutput( self, stage ):
+		''' the {'file', 'options'} of the stage's last successful run, or None '''
+		return self.outputs.get(stage) if self.outputs else None
+
+	def setOutput( self, stage, output ):
+		''' record (or with None, forget) a stage output '''
+		if output is not None:
+			if self.outputs is None:
+				self.outputs = {}
+			self.outputs[stage] = output
+		elif self.outputs:
+			self.outputs.pop(stage, None)
+		return True
+
 	def getDict( self ):
 		''' get asset data tuple '''
 		asdict = {
@@ -48,18 +176,31 @@ class Asset:
 			'file': self.name,
 			'is_opt':self.is_optimized,
 			'is_geo':self.is_geotagged,
+			'duplicate_of': self.duplicate_of,
+			'similar_to': self.similar_to,
 		}
 		return asdict
 
 	def setFlag( self, attr, value ):
-		if setattr(self, attr, value):
-			return True
+		old = getattr(self, attr)
+		setattr(self, attr, value)
+		if self.registry is not None:
+			self.registry.updateFlag( self, attr, old, value )
 
 	def setActiveSrc( self, path_new, name_new ):
 		self.name = name_new
 		self.active_file = '%s/%s' % (path_new, name_new)
+		self.ext = self.name.split('.')[-1:][0].lower()
 		return True
 
+	def getStagePath( self, path_to ):
+		''' the asset's folder in a stage folder: its path_rel sub-folder, made when missing '''
+		if not self.path_rel:
+			return path_to
+		path_to = '%s/%s' % (path_to, self.path_rel)
+		os.makedirs( path_to, exist_ok=True )
+		return path_to
+
 	def getActiveFile( self ):
 		''' return active file (full path) '''
 		return str(self.active_file)
@@ -68,12 +209,43 @@ class Asset:
 		''' return active file name '''
 		return str(self.name)
 
+	def getContentHash( self ):
+		''' return the SHA-256 of the imported original, hashed once '''
+		if self.content_hash is None:
+			self.content_hash = FileFactory.getFileHash( self.file_source )
+		return self.content_hash
+
+	def getPerceptualHash( self ):
+		''' return the 64 bit difference hash (dHash) of the imported original, hashed
+			once: a grayscale 9x8 thumbnail from a tiny draft decode (JPEGs decode
+			DCT-scaled down to 1/8), one bit per horizontal neighbour pair; 0 for
+			images without any gradient to compare and None when it does not decode '''
+		if self.phash is None:
+			try:
+				with Image.open( self.file_source ) as pimg:
+					pimg.draft( 'L', (64, 64) )
+					thumb = pimg.convert('L').resize( (9, 8), Image.BOX )
+			except (OSError, ValueError):
+				return None
+			pixels, phash = thumb.tobytes(), 0
+			for row in range(8):
+				for col in range(8):
+					phash = (phash << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+			self.phash = phash
+		return self.phash
+
+	def getDuplicateLabel( self ):
+		''' '= id' for an exact copy, '≈ id' for a near copy, else '' '''
+		if self.duplicate_of is not None:
+			return '= %d' % self.duplicate_of
+		if self.similar_to is not None:
+			return '≈ %d' % self.similar_to
+		return ''
+
 	def checkExifTags( self ):
 		output = []
-		file = self.getActiveFile()
-		img = Image.open( file )
-		exif = img._getexif()
-		output.append( '<h1>%s</h1>'%(img.filename.split('/')[-1]) )
+		exif = self.probeImage()['exif']
+		output.append( '<h1>%s</h1>'%(self.getActiveName()) )
 		output.append('<p>')
 		if exif:
 			for key, val in exif.items():
@@ -86,93 +258,522 @@ class Asset:
 		output.append('<br></p>')
 		return ''.join(output)
 
-	def optimizeImage( self, options ):
-		# SKIP GIFS
-		if self.ext.lower() == 'gif':
+	def probeImage( self, pimg=None ):
+		''' read the image details from its headers (size, mode, format, exif),
+			cached until the active file changes (mtime + size); pixels are only
+			decoded when transparency cannot be ruled out from the header '''
+		st = os.stat( self.active_file )
+		stamp = (str(self.active_file), st.st_mtime_ns, st.st_size)
+		if self.probe is not None and self.probe_stamp == stamp:
+			return self.probe
+		if pimg is None:
+			with Image.open( self.active_file ) as pimg:
+				probe = self._readProbe( pimg )
+		else:
+			probe = self._readProbe( pimg )
+		self.probe = probe
+		self.probe_stamp = stamp
+		return probe
+
+	def _readProbe( self, pimg ):
+		''' image details dict of an opened (not yet decoded) image '''
+		# no transparency index (P) or alpha band (RGBA) means nothing to scan
+		if pimg.mode == 'P' and 'transparency' in pimg.info or pimg.mode == 'RGBA':
+			has_transparency = self._hasTransparency(pimg)
+		else:
+			has_transparency = False
+		probe = {
+			'format': pimg.format,
+			'mode': pimg.mode,
+			'size': pimg.size,
+			'transparency': pimg.info.get('transparency'),
+			'has_transparency': has_transparency,
+			'exif': self._readExif(pimg),
+		}
+		return probe
+
+	def _readExif( self, pimg ):
+		''' exif tags dict from the raw header bytes, sub-IFDs merged in like _getexif '''
+		raw = pimg.info.get('exif')
+		if not raw:
+			return {}
+		exif = Image.Exif()
+		exif.load(raw)
+		tags = dict(exif)
+		tags.update( exif.get_ifd(constants.EXIF_IFD) )
+		if constants.GPS_IFD in exif:
+			tags[constants.GPS_IFD] = exif.get_ifd(constants.GPS_IFD)
+		return tags
+
+	def optimizeImage( self, options, path_variants=None, encoder=None ):
+		''' optimize the active file in place; with options['variants'] and/or
+			options['formats'] (pillow backend) the srcset ladder and the WebP/AVIF
+			copies are written to path_variants from the same decode '''
+		with Logger.span( 'optimize', file=self.name_origin ) as span:
+			# SKIP GIFS
+			if self.ext.lower() == 'gif':
+				span.set( skipped='gif' )
+				return True
+			bytes_in = os.path.getsize( self.active_file )
+			if path_variants:
+				path_variants = self.getStagePath( path_variants )
+			# decode once, assess and optimize from the same image
+			with Image.open( self.active_file ) as pimg:
+				# calc image case data
+				img_case = self.assessImage( options, pimg )
+				if options.get('backend', constants.OPTIMIZER) == 'optimize-images':
+					is_done = self._optimizeWithCommand( img_case, options )
+				else:
+					self._draftImage( pimg, img_case, options )
+					if options.get('variants'):
+						self._writeVariants( pimg, img_case, options, path_variants, encoder, span )
+					formats = self._startFormats( pimg, img_case, options, encoder ) if options.get('formats') else None
+					is_done = self._optimizeWithPillow( pimg, img_case, options )
+					if formats:
+						self._writeFormats( formats, path_variants, span )
+			span.set( ok=is_done, case=img_case )
+			if is_done:
+				span.addBytes( bytes_in, os.path.getsize(self.active_file) )
+			return is_done
+
+	def _writeVariants( self, pimg, img_case, options, path_to, encoder, span, exif=None ):
+		''' variant mode: the srcset ladder from the image being optimized, recorded
+			as the asset's 'variants' output; it shares the optimized output's decode,
+			DCT-scaled only when the preset drafts (see _draftImage, sized for the
+			widest of both) '''
+		variants = self._makeVariants( pimg, img_case, options, path_to, encoder, exif )
+		self.setOutput( 'variants', {'files': variants, 'widths': sorted(options['variants'])} )
+		span.set( variants=len(variants) )
+		return variants
+
+	def _makeVariants( self, pimg, img_case, options, path_to, encoder=None, exif=None ):
+		''' the srcset ladder of the decoded image: a rung for every width in
+			options['variants'] narrower than the image, each one downscaled from
+			the rung above it and encoded in parallel on the encoder executor;
+			returns the rung records, widest first '''
+		widths = sorted( set( int(width) for width in options['variants'] if 0 < int(width) < pimg.size[0] ), reverse=True )
+		stem = self.name_origin.rsplit('.', 1)[0]
+		out_ext = self.ext.lower()
+		# resampling needs true-color pixels
+		if pimg.mode not in ('RGB', 'RGBA', 'L'):
+			pimg = pimg.convert( 'RGBA' if img_case[3] else 'RGB' )
+		rungs, (base_w, base_h) = [], pimg.size
+		for width in widths:
+			pimg = self._scaleTo( pimg, (width, max(1, int(round(base_h * width / base_w)))), options )
+			rungs.append( pimg )
+		encode = functools.partial( self._encodeVariant, img_case=img_case, options=options, out_ext=out_ext, exif=exif )
+		buffers = encoder.map( encode, rungs ) if encoder else map( encode, rungs )
+		variants = []
+		for rung, buffer in zip(rungs, buffers):
+			name = '%s_w%d.%s' % (stem, rung.size[0], out_ext)
+			FileFactory.replaceFileWith( '%s/%s' % (path_to, name), buffer )
+			variants.append({ 'file': name, 'width': rung.size[0], 'height': rung.size[1], 'bytes': buffer.getbuffer().nbytes })
+		return variants
+
+	def _scaleTo( self, pimg, size, options ):
+		''' downscale to size: Image.reduce takes the whole factors first (box
+			aligned), the preset's filter only resamples the last reducing_gap times '''
+		if pimg.size == size:
+			return pimg
+		preset = self._getPreset( options )
+		return pimg.resize( size, resample=getattr(Image, preset['resample'].upper()), reducing_gap=preset['reducing_gap'] )
+
+	def _encodeVariant( self, pimg, img_case, options, out_ext, exif=None ):
+		''' a ladder rung into an in-memory buffer, with the optimize rules of its format '''
+		if out_ext == 'png':
+			# no transparency to preserve
+			if not img_case[3]:
+				pimg = self._quantize( pimg, options )
+			return self._encodePng( pimg, options, exif )
+		return self._encodeJpeg( pimg, options, progressive=pimg.size[0] * pimg.size[1] > 100000, exif=exif )
+
+	def _startFormats( self, pimg, img_case, options, encoder=None, exif=None ):
+		''' format mode: start encoding the image as sized for the optimized output
+			in every options['formats'] Pillow can write, on the encoder executor
+			while the legacy format is encoded; returns [(format, future or buffer)] '''
+		formats = [ fmt for fmt in options['formats'] if features.check(fmt) ]
+		# only JPEGs are resized by the optimize rules
+		if self.ext.lower() in ('jpg', 'jpeg'):
+			self._downsizeImage( pimg, img_case, options )
+		encode = functools.partial( self._encodeFormat, img_case=img_case, options=options, exif=exif )
+		if encoder:
+			# save() keeps its settings on the image object, so concurrent encodes
+			# each get their own copy
+			return [ (fmt, encoder.submit(encode, pimg.copy(), fmt=fmt)) for fmt in formats ]
+		return [ (fmt, encode(pimg, fmt=fmt)) for fmt in formats ]
+
+	def _writeFormats( self, formats, path_to, span ):
+		''' keep the format copies smaller than the final legacy file, recorded as
+			the asset's 'formats' output '''
+		legacy_bytes = os.path.getsize( self.active_file )
+		stem = self.name_origin.rsplit('.', 1)[0]
+		kept, dropped = [], []
+		for fmt, buffer in formats:
+			if not isinstance(buffer, io.BytesIO):
+				buffer = buffer.result()
+			nbytes = buffer.getbuffer().nbytes
+			name = '%s.%s' % (stem, fmt)
+			if nbytes >= legacy_bytes:
+				dropped.append( fmt )
+				# a copy from an earlier run may still be there
+				if os.path.exists('%s/%s' % (path_to, name)):
+					os.remove('%s/%s' % (path_to, name))
+				continue
+			FileFactory.replaceFileWith( '%s/%s' % (path_to, name), buffer )
+			kept.append({ 'file': name, 'format': fmt, 'bytes': nbytes, 'saved': legacy_bytes - nbytes })
+		self.setOutput( 'formats', {'files': kept, 'dropped': dropped, 'legacy_bytes': legacy_bytes} )
+		span.set( formats=[ item['format'] for item in kept ] )
+		return kept
+
+	def _encodeFormat( self, pimg, img_case, options, fmt, exif=None ):
+		''' the image as WebP or AVIF into an in-memory buffer; palette images
+			(flat art) go lossless in WebP '''
+		preset = self._getPreset( options )
+		lossless = pimg.mode in ('P', '1')
+		if pimg.mode not in ('RGB', 'RGBA') or (pimg.mode == 'RGBA' and not img_case[3]):
+			pimg = pimg.convert( 'RGBA' if img_case[3] else 'RGB' )
+		buffer = io.BytesIO()
+		if fmt == 'webp':
+			pimg.save( buffer, format='WEBP', quality=options['qlty'], lossless=lossless, method=preset['webp_method'], exif=exif or b'' )
+		else:
+			pimg.save( buffer, format='AVIF', quality=options['qlty'], speed=preset['avif_speed'], exif=exif or b'' )
+		return buffer
+
+	def _getPreset( self, options ):
+		''' the speed/quality settings of options['preset'] (constants.PRESETS) '''
+		return constants.PRESETS[ options.get('preset') or constants.PRESET ]
+
+	def _draftImage( self, pimg, img_case, options ):
+		''' presets with a draft factor decode JPEGs DCT-scaled (1/2, 1/4, 1/8) down
+			to that many times the size the widest output needs '''
+		factor = self._getPreset( options )['draft']
+		if factor and pimg.format == 'JPEG':
+			width, height = self._getDraftSize( pimg, img_case, options )
+			pimg.draft( pimg.mode, (int(math.ceil(width * factor)), int(math.ceil(height * factor))) )
+		return pimg
+
+	def _getDraftSize( self, pimg, img_case, options ):
+		''' the smallest decode every output needs: the optimized image fitted in
+			the limits, and the widest srcset rung '''
+		width, height = pimg.size
+		max_w = options['width'] if img_case[1] else width
+		max_h = options['height'] if img_case[2] else height
+		needed = width * min( 1.0, max_w / width, max_h / height )
+		for rung in options.get('variants') or []:
+			if int(rung) < width:
+				needed = max( needed, int(rung) )
+		return ( int(math.ceil(needed)), int(math.ceil(needed * height / width)) )
+
+	def _optimizeWithPillow( self, pimg, img_case, options ):
+		''' apply the optimize-images rules in-process and write the result once '''
+		buffer, out_ext = self._encodeOptimized( pimg, img_case, options )
+		if buffer is None:
 			return True
-		# calc image case data
-		img_case = self.assessImage( options )
-		print(img_case)
+		file_path = self.getActiveFile()
+		if out_ext == self.ext.lower():
+			FileFactory.replaceFileWith( file_path, buffer )
+		else:
+			path_to, old_name = os.path.split( file_path )
+			new_name = '%s.%s' % (old_name.rsplit('.', 1)[0], out_ext)
+			FileFactory.replaceFileWith( '%s/%s' % (path_to, new_name), buffer )
+			os.remove( file_path )
+			self.setActiveSrc( path_to, new_name )
+		return True
+
+	def _encodeOptimized( self, pimg, img_case, options, exif=None ):
+		''' the optimized image as an in-memory (buffer, extension), the buffer is None
+			when the active file cannot be made smaller; exif is written by the encoder '''
+		orig_size = FileFactory.getBytes( self.active_file )
+		out_ext = self.ext.lower()
+		# JPGs and JPEGs
+		# target size mode searches the JPEG quality
+		encodeJpeg = self._encodeToTarget if options.get('target') else self._encodeJpeg
+		if out_ext == 'jpg' or out_ext == 'jpeg':
+			pimg = self._downsizeImage( pimg, img_case, options )
+			buffer = encodeJpeg( pimg, options, progressive=orig_size > 10000, exif=exif )
+		# for PNGS
+		elif out_ext == 'png':
+			# exceeds width and height, photos without transparency become JPGs
+			if img_case[0] and not img_case[3] and self._isPhotoImage( pimg ):
+				out_ext = 'jpg'
+				buffer = encodeJpeg( pimg.convert('RGB'), options, progressive=True, exif=exif )
+			else:
+				# no transparency to preserve
+				if not img_case[3] and pimg.mode not in ('P', '1'):
+					pimg = self._quantize( pimg, options )
+				buffer = self._encodePng( pimg, options, exif )
+		else:
+			return None, out_ext
+		# only keep the result when it saves space
+		if buffer.getbuffer().nbytes >= orig_size:
+			return None, self.ext.lower()
+		return buffer, out_ext
+
+	def processImage( self, options, latitude, longitude, path_to, app_str='web_geo', path_variants=None, encoder=None ):
+		''' pipeline mode, optimize + geotag in one pass: the imported file is decoded
+			once, optimized in memory with the GPS EXIF written by the encoder, and the
+			final file is written into path_to exactly once (no stage copies); the
+			srcset ladder (options['variants']) and the WebP/AVIF copies
+			(options['formats']) come from the same decode '''
+		with Logger.span( 'process', file=self.name_origin ) as span:
+			# restart from the imported file, like the optimize stage does
+			self.setActiveSrc( self.path_dest, self.name_origin )
+			path_to = self.getStagePath( path_to )
+			if path_variants:
+				path_variants = self.getStagePath( path_variants )
+			writer = GPSWriter()
+			stem, suffix = self.name_origin.rsplit('.', 1)
+			buffer, out_ext, formats = None, self.ext, None
+			if self.ext != 'gif':
+				with Image.open( self.file_source ) as pimg:
+					img_case = self.assessImage( options, pimg )
+					exif = writer.getExif( latitude, longitude ) if writer.canTag( self.ext ) else None
+					self._draftImage( pimg, img_case, options )
+					if options.get('variants'):
+						self._writeVariants( pimg, img_case, options, path_variants, encoder, span, exif )
+					if options.get('formats'):
+						formats = self._startFormats( pimg, img_case, options, encoder, exif )
+					buffer, out_ext = self._encodeOptimized( pimg, img_case, options, exif )
+			new_name = '%s_%s.%s' % (stem, app_str, suffix if out_ext == self.ext else out_ext)
+			file_to = '%s/%s' % (path_to, new_name)
+			if buffer is not None:
+				FileFactory.replaceFileWith( file_to, buffer )
+			elif writer.canTag( self.ext ):
+				# already as small as it gets, a tagged copy is the only write
+				writer.tagFile( self.file_source, latitude, longitude, file_to=file_to )
+			else:
+				# nothing to encode or tag (GIFs)
+				FileFactory.linkFileFromTo( self.name_origin, self.path_dest, path_to )
+				new_name = FileFactory.renameFileAppendTo( path_to, self.name_origin, app_str )
+			self.setActiveSrc( path_to, new_name )
+			if formats:
+				self._writeFormats( formats, path_variants, span )
+			span.addBytes( os.path.getsize(self.file_source), os.path.getsize(self.active_file) )
+		return True
+
+	def _optimizeWithCommand( self, img_case, options ):
+		''' shell out to the optimize-images command line tool '''
 		max_w = options['width']
 		max_h = options['height']
-		
 		# create optimize-images command
 		optimize_cmd = ['optimize-images']
-		# optimize_rules = {}
-		# optimize_rules['src_path'] = '"%s"' % self.getActiveFile()
-		
 		# limit image quality
-		optimize_cmd.append('-q %s' % options['qlty'])
-		# optimize_rules['quality'] = options['qlty']
-		
+		optimize_cmd += ['-q', str(options['qlty'])]
 		# JPGs and JPEGs 
 		if self.ext.lower() == 'jpg' or self.ext.lower() == 'jpeg':
 			# exceeds width
 			if img_case[1]:
-				optimize_cmd.append('-mw %s' % max_w)
-				# optimize_rules['max_w'] = max_w
+				optimize_cmd += ['-mw', str(max_w)]
 			# exceeds height
 			if img_case[2]:
-				optimize_cmd.append('-mh %s' % max_h)
-				# optimize_rules['max_h'] = max_h
+				optimize_cmd += ['-mh', str(max_h)]
 		# for PNGS
 		if self.ext.lower() == 'png':
 			# no transparency to preserve
 			if not img_case[3]:
-				optimize_cmd.append('-rc -mc %s' % options['colors'])
-				# optimize_rules['reduce_colors'] = True
-				# optimize_rules['max_colors'] = options['colors']
+				optimize_cmd += ['-rc', '-mc', str(options['colors'])]
 			# exceeds width and height
 			if img_case[0]:
-				optimize_cmd.append('-cb -fd')
-				# optimize_rules['conv_big'] = True
-				# optimize_rules['force_del'] = True
+				optimize_cmd += ['-cb', '-fd']
+		# include a link to the src img, rewritten in place
+		optimize_cmd.append( FileFactory.detachFile(self.getActiveFile()) )
+		# its banner and report would land in the headless JSON-lines stdout (fd 1),
+		# errors still reach stderr
+		completed = subprocess.run(optimize_cmd, stdout=subprocess.DEVNULL)
+		# big PNGs may have been converted to JPGs (and the PNG deleted)
+		path_to, old_name = os.path.split( self.getActiveFile() )
+		new_name = '%s.jpg' % old_name.rsplit('.', 1)[0]
+		if not os.path.exists( self.getActiveFile() ) and os.path.exists( '%s/%s' % (path_to, new_name) ):
+			self.setActiveSrc( path_to, new_name )
+		return completed.returncode == 0
 
-		# opt_response = optimizer.main( optimize_rules )
-		# print(opt_response)
+	def _downsizeImage( self, pimg, img_case, options ):
+		''' fit the image inside the width/height limits it exceeds '''
+		max_w = options['width'] if img_case[1] else pimg.size[0]
+		max_h = options['height'] if img_case[2] else pimg.size[1]
+		if (max_w, max_h) != pimg.size:
+			preset = self._getPreset( options )
+			pimg.thumbnail( (max_w, max_h), resample=getattr(Image, preset['resample'].upper()), reducing_gap=preset['reducing_gap'] )
+		return pimg
 
-		# include a link to the src img
-		optimize_cmd.append('"%s"' % self.getActiveFile())
-		optimizethis = ' '.join(optimize_cmd)
-		subprocess.run(optimizethis, shell=True)
-		return True
+	def _quantize( self, pimg, options ):
+		''' a true-color image down to a palette of options['colors'] '''
+		method = self._getPreset( options )['quantize']
+		if method is None:
+			return pimg.convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=options['colors'])
+		return pimg.convert('RGB').quantize( options['colors'], method=getattr(Image, method.upper()) )
+
+	def _encodePng( self, pimg, options, exif=None ):
+		''' encode a PNG into an in-memory buffer '''
+		buffer = io.BytesIO()
+		pimg.save( buffer, format='PNG', compress_level=self._getPreset(options)['compress_level'], exif=exif or b'' )
+		return buffer
+
+	def _encodeJpeg( self, pimg, options, progressive=False, exif=None ):
+		''' encode a JPEG into an in-memory buffer '''
+		if pimg.mode not in ('RGB', 'L', 'CMYK'):
+			pimg = pimg.convert('RGB')
+		optimize = self._getPreset( options )['optimize']
+		buffer = io.BytesIO()
+		try:
+			pimg.save( buffer, format='JPEG', quality=options['qlty'], optimize=optimize, progressive=progressive, exif=exif or b'' )
+		except IOError:
+			ImageFile.MAXBLOCK = pimg.size[0] * pimg.size[1]
+			pimg.save( buffer, format='JPEG', quality=options['qlty'], optimize=optimize, progressive=progressive, exif=exif or b'' )
+		return buffer
+
+	def _encodeToTarget( self, pimg, options, progressive=False, exif=None ):
+		''' target size mode: the JPEG at the highest quality (up to options['qlty'])
+			that fits in options['target'] bytes, or the lowest quality one when none
+			does; each quality tried is predicted from in-memory encodes of a
+			downscaled trial, corrected by the full encodes already made '''
+		target, max_q = options['target'], options['qlty']
+		if pimg.mode not in ('RGB', 'L', 'CMYK'):
+			pimg = pimg.convert('RGB')
+		factor = max( 1, int(math.sqrt(pimg.size[0] * pimg.size[1] / constants.TARGET_TRIAL_PIXELS)) )
+		trial = pimg.reduce( factor ) if factor > 1 else pimg
+		trial_bytes = {}
+		def getTrialBytes( quality ):
+			if quality not in trial_bytes:
+				trial_bytes[quality] = self._encodeJpeg( trial, dict(options, qlty=quality), progressive ).getbuffer().nbytes
+			return trial_bytes[quality]
+		# quality -> bytes of the full encodes
+		sizes = {}
+		lo, hi, best, smallest = 1, max_q, None, None
+		while lo <= hi:
+			if len(sizes) < constants.TARGET_TRIES:
+				quality = self._predictQuality( sizes, target, lo, hi, getTrialBytes, factor * factor )
+			else:
+				# the guesses ran out and nothing fits yet, bisect
+				quality = (lo + hi) // 2
+			buffer = self._encodeJpeg( pimg, dict(options, qlty=quality), progressive, exif )
+			sizes[quality] = buffer.getbuffer().nbytes
+			if sizes[quality] <= target:
+				best, lo = buffer, quality + 1
+				if sizes[quality] >= target * (1 - constants.TARGET_SLACK) or len(sizes) >= constants.TARGET_TRIES:
+					break
+			else:
+				smallest, hi = buffer, quality - 1
+		Logger.count( 'target_encodes', len(sizes), stage='optimize' )
+		Logger.count( 'target_met' if best is not None else 'target_missed', stage='optimize' )
+		# nothing fit: the lowest quality tried is as close as it gets
+		return best if best is not None else smallest
 
-	def assessImage( self, options=None ):
+	def _predictQuality( self, sizes, target, lo, hi, getTrialBytes, ratio ):
+		''' the highest quality in lo..hi expected to fit in target bytes: the trial
+			size times the full to trial ratio, which starts as the area ratio and
+			is then interpolated between the full encodes made '''
+		ratios = { quality: sizes[quality] / getTrialBytes(quality) for quality in sizes }
+		# sizes grow with the quality, bisect the predicted curve
+		low, high = lo, hi
+		while low < high:
+			mid = (low + high + 1) // 2
+			if getTrialBytes(mid) * self._interpolate(ratios, mid, ratio) <= target:
+				low = mid
+			else:
+				high = mid - 1
+		return low
+
+	def _interpolate( self, points, x, default, spread=1.5 ):
+		''' piecewise linear y at x through the {x: y} points (default without any);
+			past the ends it follows the end segment, kept within spread times the
+			end value '''
+		if not points:
+			return default
+		xs = sorted(points)
+		if len(xs) == 1:
+			return points[xs[0]]
+		if x < xs[0]:
+			(x0, x1), end = xs[:2], xs[0]
+		elif x > xs[-1]:
+			(x0, x1), end = xs[-2:], xs[-1]
+		else:
+			(x0, x1), end = next( (pair for pair in zip(xs, xs[1:]) if pair[0] <= x <= pair[1]) ), None
+		y = points[x0] + (points[x1] - points[x0]) * (x - x0) / (x1 - x0)
+		if end is not None:
+			y = min( max(y, points[end] / spread), points[end] * spread )
+		return y
+
+	def _isPhotoImage( self, pimg ):
+		''' big true-color images with lots of colors compress better as JPGs '''
+		if pimg.mode in ('P', 'L', 'LA', '1'):
+			return False
+		if pimg.size[0] * pimg.size[1] < constants.BIG_PNG_AREA:
+			return False
+		return pimg.getcolors( constants.BIG_PNG_COLORS ) is None
+
+	def assessImage( self, options=None, pimg=None ):
 		''' image flags 
 		- img-W > web-W = by how much?
 		- img-H > web-H = by how much?
 		- img-bkg transparent?
 		- img-WHR = ratio of width to height?
 		'''
-		# calc whats needed
-		pimg = Image.open( self.active_file )
-		w_h = pimg.size
-		ratio = float(w_h[0] / w_h[1])
-		flag_trans = self._hasTransparency(pimg)
-		# check flag - width
-		if options['width'] > 0:
-			flag_w = True if w_h[0] > options['width'] else False
-		else:
-			flag_w = True if w_h[0] > constants.LIMITS['width'] else False	
-		# check flag - height
-		if options['height'] > 0:
-			flag_h = True if w_h[1] > options['height'] else False
-		else:
-			flag_w = True if w_h[0] > constants.LIMITS['width'] else False
-		# check flag - size
-		flag_size = True if flag_w and flag_h else False
-		# check flag - ratio
-		flag_ratio = ''
-		if ratio == 1:
-			flag_ratio = 'square'
-		elif ratio > 1:
-			flag_ratio = 'landscape'
-		elif ratio < 1:
-			flag_ratio = 'portrait'
+		with Logger.span( 'assess', file=self.name_origin ) as span:
+			# calc whats needed
+			probe = self.probeImage( pimg )
+			w_h = probe['size']
+			ratio = float(w_h[0] / w_h[1])
+			flag_trans = probe['has_transparency']
+			# check flag - width
+			if options['width'] > 0:
+				flag_w = True if w_h[0] > options['width'] else False
+			else:
+				flag_w = True if w_h[0] > constants.LIMITS['width'] else False	
+			# check flag - height
+			if options['height'] > 0:
+				flag_h = True if w_h[1] > options['height'] else False
+			else:
+				flag_h = True if w_h[1] > constants.LIMITS['height'] else False
+			# check flag - size
+			flag_size = True if flag_w and flag_h else False
+			# check flag - ratio
+			flag_ratio = ''
+			if ratio == 1:
+				flag_ratio = 'square'
+			elif ratio > 1:
+				flag_ratio = 'landscape'
+			elif ratio < 1:
+				flag_ratio = 'portrait'
+			span.set( size=w_h, case=(flag_size, flag_w, flag_h, flag_trans) )
 		# return a response
 		return (flag_size, flag_w, flag_h, flag_trans)
 
-	def _hasTransparency(self, img):
+	def _hasTransparency( self, img, sample=True ):
+		''' check if an image is making use of transparency, after an optional
+			early-exit scan of a few evenly spaced rows: the alpha band (RGBA) is
+			extracted and its extrema taken by PIL (one band-sized copy, no Python
+			buffer), the palette indexes (P) by a lookup of the transparent index
+			in the index histogram '''
+		if numpy is None:
+			return self._scanTransparency(img)
+		if img.mode == "P":
+			transparent = img.info.get("transparency", -1)
+			# a per-index alpha table never matched an index before either
+			if not isinstance(transparent, int) or not 0 <= transparent < 256:
+				return False
+			if sample:
+				for band in self._sampleRows(img, 'P'):
+					if (band == transparent).any():
+						return True
+			return img.histogram()[transparent] > 0
+		elif img.mode == "RGBA":
+			if sample:
+				for band in self._sampleRows(img, 'A'):
+					if band.min() < 255:
+						return True
+			return img.getchannel('A').getextrema()[0] < 255
+		return False
+
+	def _sampleRows( self, img, rawmode ):
+		''' yields a handful of evenly spaced single-row bands of the image '''
+		width, height = img.size
+		step = max(1, height // constants.TRANSPARENCY_SAMPLE_ROWS)
+		for top in range(step // 2, height, step):
+			row = img.crop((0, top, width, top + 1))
+			yield numpy.frombuffer(row.tobytes('raw', rawmode), dtype=numpy.uint8)
+
+	def _scanTransparency( self, img ):
 		''' makes use of the PIL image library to thoroughly
 			check if an image is making use of transparency '''
 		if img.mode == "P":
@@ -185,3 +786,191 @@ class Asset:
 			if extrema[3][0] < 255:
 				return True
 		return False
+
+
+class AssetRegistry:
+	''' the imported assets in import order, indexed by id, original name and content
+		hash; keeps running counts of the optimized/geotagged flags so readiness checks
+		never rescan the assets '''
+	flags = ('is_optimized', 'is_geotagged')
+
+	def __init__( self, assets=None ):
+		self.assets = []
+		self.by_id = {}
+		self.by_name = {}
+		# built on the first hash lookup, from the hashes known by then
+		self.by_hash = None
+		# (band, bits) -> assets, the perceptual hashes cut into SIMILAR_DISTANCE + 1
+		# bands: hashes within that distance share at least one band; built on the
+		# first similarity lookup
+		self.by_band = None
+		# asset id -> position in self.assets
+		self.rows = {}
+		self.counts = dict.fromkeys(self.flags, 0)
+		# assets with every flag set
+		self.done = 0
+		if assets:
+			self.extend(assets)
+
+	def __repr__( self ):
+		return '<%s assets=%d optimized=%d geotagged=%d>' % (
+			self.__class__.__name__, len(self.assets), self.counts['is_optimized'], self.counts['is_geotagged']
+		)
+
+	def __len__( self ):
+		return len(self.assets)
+
+	def __iter__( self ):
+		return iter(self.assets)
+
+	def __getitem__( self, row ):
+		return self.assets[row]
+
+	def __contains__( self, asset ):
+		return self.by_id.get(asset.index) is asset
+
+	def add( self, asset ):
+		''' register a single asset '''
+		return self.extend([asset])
+
+	def extend( self, assets ):
+		''' register many assets at once '''
+		for asset in assets:
+			if asset.index in self.by_id:
+				raise ValueError('asset id %s is already registered' % asset.index)
+			asset.registry = self
+			self.rows[asset.index] = len(self.assets)
+			self.assets.append(asset)
+			self.by_id[asset.index] = asset
+			self.by_name[asset.name_origin] = asset
+			# assets without a content hash (dedupe off, or unreadable) are not indexed
+			if self.by_hash is not None and asset.content_hash is not None:
+				self.by_hash.setdefault(asset.content_hash, []).append(asset)
+			if self.by_band is not None:
+				self._addBands(asset)
+			self._count(asset, 1)
+		return True
+
+	def remove( self, assets ):
+		''' unregister many assets at once, returns how many were removed '''
+		dropped = set()
+		for asset in assets:
+			if asset not in self:
+				continue
+			dropped.add(asset.index)
+			asset.registry = None
+			del self.by_id[asset.index]
+			if self.by_name.get(asset.name_origin) is asset:
+				del self.by_name[asset.name_origin]
+			copies = self.by_hash.get(asset.content_hash) if self.by_hash is not None else None
+			if copies and asset in copies:
+				copies.remove(asset)
+				if not copies:
+					del self.by_hash[asset.content_hash]
+			if self.by_band is not None and asset.duplicate_of is None and asset.phash:
+				for key in _getBands(asset.phash):
+					self.by_band[key].remove(asset)
+			self._count(asset, -1)
+		# a single pass re-packs the order and positions
+		if dropped:
+			self.assets = [ asset for asset in self.assets if asset.index not in dropped ]
+			self.rows = { asset.index: row for row, asset in enumerate(self.assets) }
+		return len(dropped)
+
+	def clear( self ):
+		''' unregister every asset '''
+		for asset in self.assets:
+			asset.registry = None
+		self.assets = []
+		self.by_id.clear()
+		self.by_name.clear()
+		self.by_hash = None
+		self.by_band = None
+		self.rows.clear()
+		self.counts = dict.fromkeys(self.flags, 0)
+		self.done = 0
+		return True
+
+	def getById( self, index ):
+		return self.by_id.get(int(index))
+
+	def getByName( self, name ):
+		''' asset imported under the given original file name '''
+		return self.by_name.get(name)
+
+	def getByHash( self, content_hash ):
+		''' assets whose original has the given content hash, among the hashed ones
+			(nothing is hashed here) '''
+		if self.by_hash is None:
+			self.by_hash = {}
+			for asset in self.assets:
+				if asset.content_hash is not None:
+					self.by_hash.setdefault(asset.content_hash, []).append(asset)
+		return list(self.by_hash.get(content_hash, []))
+
+	def getSimilar( self, phash, distance=None ):
+		''' assets whose perceptual hash is within distance (at most SIMILAR_DISTANCE)
+			bits of phash, closest first; only the assets sharing a band are compared '''
+		distance = constants.SIMILAR_DISTANCE if distance is None else min(distance, constants.SIMILAR_DISTANCE)
+		if not phash:
+			return []
+		if self.by_band is None:
+			self.by_band = {}
+			for asset in self.assets:
+				self._addBands(asset)
+		found = {}
+		for key in _getBands(phash):
+			for asset in self.by_band.get(key, ()):
+				if asset.index not in found:
+					found[asset.index] = (bin(asset.phash ^ phash).count('1'), asset)
+		return [ asset for bits, asset in sorted(found.values(), key=lambda item: (item[0], item[1].index)) if bits <= distance ]
+
+	def getRow( self, asset ):
+		''' position of an asset in import order '''
+		return self.rows[asset.index]
+
+	def getCount( self, attr ):
+		''' number of assets with the flag set '''
+		return self.counts[attr]
+
+	def isOptimized( self ):
+		return self.counts['is_optimized'] == len(self.assets)
+
+	def isGeotagged( self ):
+		return self.counts['is_geotagged'] == len(self.assets)
+
+	def isReady( self ):
+		''' every asset optimized and geotagged '''
+		return self.done == len(self.assets)
+
+	def updateFlag( self, asset, attr, old, new ):
+		''' called by Asset.setFlag, moves the counters along with a flag change '''
+		if attr not in self.counts or bool(old) == bool(new):
+			return False
+		self._count(asset, -1, **{attr: old})
+		self._count(asset, 1)
+		return True
+
+	def _addBands( self, asset ):
+		''' index an asset's perceptual hash; exact duplicates (their first copy is
+			indexed) and flat images (no gradient) are left out '''
+		if asset.duplicate_of is None and asset.getPerceptualHash():
+			for key in _getBands(asset.phash):
+				self.by_band.setdefault(key, []).append(asset)
+		return True
+
+	def _count( self, asset, step, **values ):
+		''' add (or take away) an asset's flags from the counters, values
+			overrides the asset's current flags '''
+		flags = [ bool(values.get(attr, getattr(asset, attr))) for attr in self.flags ]
+		for attr, is_set in zip(self.flags, flags):
+			if is_set:
+				self.counts[attr] += step
+		if all(flags):
+			self.done += step
+
+def _getBands( phash ):
+	''' the (band, bits) keys of a 64 bit perceptual hash cut into SIMILAR_DISTANCE + 1 bands '''
+	count = constants.SIMILAR_DISTANCE + 1
+	edges = [ 64 * band // count for band in range(count + 1) ]
+	return [ (band, (phash >> edges[band]) & ((1 << (edges[band + 1] - edges[band])) - 1)) for band in range(count) ]
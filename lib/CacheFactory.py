@@ -0,0 +1,143 @@
+import os, shutil, json, hashlib, threading
+from collections import OrderedDict
+try:
+	import constants
+except:
+	from . import constants
+'''
+OptimizeCache (content-addressed, size-bounded LRU)
+'''
+
+class OptimizeCache:
+	''' stores optimized outputs keyed by source content + options + backend version '''
+	def __init__( self, path, max_bytes=None ):
+		self.path = path
+		self.max_bytes = max_bytes or constants.CACHE_LIMIT
+		self.hits = 0
+		self.misses = 0
+		self.stores = 0
+		self.evictions = 0
+		self._lock = threading.Lock()
+		# key -> (filepath, size), least recently used first
+		self._entries = OrderedDict()
+		self._bytes = 0
+		self._load()
+
+	def __repr__( self ):
+		return '<%s entries=%d bytes=%d hits=%d misses=%d>' % (
+			self.__class__.__name__, len(self._entries), self._bytes, self.hits, self.misses
+		)
+
+	def getKey( self, filepath, options ):
+		''' returns the cache key of a source file optimized with the given options '''
+		backend = options.get('backend', constants.OPTIMIZER)
+		sha = hashlib.sha256()
+		with open(filepath, 'rb') as f:
+			for chunk in iter(lambda: f.read(1 << 20), b''):
+				sha.update(chunk)
+		sha.update( json.dumps(options, sort_keys=True, default=str).encode() )
+		sha.update( _getBackendVersion(backend).encode() )
+		return sha.hexdigest()
+
+	def fetch( self, key, dest_path ):
+		''' link (or copy) a cached output over dest_path, returns the written path or None;
+			the cached output keeps its own extension (big PNGs may have become JPGs) '''
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+		cache_path = entry[0]
+		out_path = '%s.%s' % (dest_path.rsplit('.', 1)[0], cache_path.rsplit('.', 1)[-1])
+		tmp_path = '%s.tmp' % out_path
+		try:
+			os.link(cache_path, tmp_path)
+		except OSError:
+			shutil.copyfile(cache_path, tmp_path)
+		os.replace(tmp_path, out_path)
+		# remember the access for the LRU order of the next session
+		os.utime(cache_path)
+		return out_path
+
+	def store( self, key, filepath ):
+		''' copy an optimized output into the cache, evicting least recently used entries '''
+		ext = filepath.rsplit('.', 1)[-1].lower()
+		cache_path = '%s/%s/%s.%s' % (self.path, key[:2], key, ext)
+		os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+		tmp_path = '%s.%d.tmp' % (cache_path, threading.get_ident())
+		shutil.copyfile(filepath, tmp_path)
+		os.replace(tmp_path, cache_path)
+		size = os.path.getsize(cache_path)
+		with self._lock:
+			old = self._entries.pop(key, None)
+			if old:
+				self._bytes -= old[1]
+			self._entries[key] = (cache_path, size)
+			self._bytes += size
+			self.stores += 1
+			self._evict()
+		return cache_path
+
+	def clear( self ):
+		''' delete every cached output '''
+		with self._lock:
+			shutil.rmtree(self.path, ignore_errors=True)
+			self._entries.clear()
+			self._bytes = 0
+		return True
+
+	def getStats( self ):
+		''' get cache counters dict '''
+		with self._lock:
+			stats = {
+				'entries': len(self._entries),
+				'bytes': self._bytes,
+				'max_bytes': self.max_bytes,
+				'hits': self.hits,
+				'misses': self.misses,
+				'stores': self.stores,
+				'evictions': self.evictions,
+			}
+		return stats
+
+	def _evict( self ):
+		''' drop least recently used entries until the cache fits (lock held) '''
+		while self._bytes > self.max_bytes and self._entries:
+			key, (cache_path, size) = self._entries.popitem(last=False)
+			self._bytes -= size
+			self.evictions += 1
+			try:
+				os.remove(cache_path)
+			except OSError:
+				pass
+
+	def _load( self ):
+		''' index the outputs stored by earlier sessions, oldest access first '''
+		os.makedirs(self.path, exist_ok=True)
+		found = []
+		for root, dirs, files in os.walk(self.path):
+			for file in files:
+				cache_path = os.path.join(root, file)
+				if file.endswith('.tmp'):
+					os.remove(cache_path)
+					continue
+				st = os.stat(cache_path)
+				found.append( (st.st_mtime, file.split('.', 1)[0], cache_path, st.st_size) )
+		for mtime, key, cache_path, size in sorted(found):
+			self._entries[key] = (cache_path, size)
+			self._bytes += size
+		self._evict()
+
+
+def _getBackendVersion( backend ):
+	''' version string of an optimizer backend, part of every cache key '''
+	if backend == 'optimize-images':
+		try:
+			from importlib.metadata import version
+			return 'optimize-images-%s' % version('optimize-images')
+		except Exception:
+			return 'optimize-images'
+	from PIL import __version__ as pil_version
+	return 'pillow-%s-wao%s' % (pil_version, constants.OPTIMIZER_VERSION)
@@ -0,0 +1,222 @@
+import os, json, sqlite3, threading
+try:
+	import constants
+except:
+	from . import constants
+'''
+SessionCatalog (SQLite, WAL mode, batched writes)
+'''
+
+class SessionCatalog:
+	''' persists every asset of the session so a closed or crashed session resumes
+		where it stopped; writes are queued and committed in batches '''
+	columns = (
+		'id', 'name_origin', 'name', 'path_src', 'path_dest', 'file_source', 'active_file',
+		'ext', 'type', 'bytes', 'mtime', 'width', 'height', 'content_hash',
+		'is_optimized', 'is_geotagged', 'outputs', 'phash', 'duplicate_of', 'similar_to',
+		'path_rel',
+	)
+	# columns added since the first catalogs, altered into older ones on open
+	added_columns = (
+		('phash', 'TEXT'),
+		('duplicate_of', 'INTEGER'),
+		('similar_to', 'INTEGER'),
+		('path_rel', 'TEXT'),
+	)
+
+	def __init__( self, path, batch=None ):
+		self.path = path
+		self.batch = batch or constants.CATALOG_BATCH
+		self._lock = threading.Lock()
+		# asset id -> record waiting for the next flush
+		self._pending = {}
+		self.db = sqlite3.connect( path, check_same_thread=False )
+		self.db.execute('PRAGMA journal_mode=WAL')
+		self.db.execute('PRAGMA synchronous=NORMAL')
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS assets (
+				id INTEGER PRIMARY KEY,
+				name_origin TEXT NOT NULL,
+				name TEXT NOT NULL,
+				path_src TEXT,
+				path_dest TEXT,
+				file_source TEXT NOT NULL,
+				active_file TEXT NOT NULL,
+				ext TEXT,
+				type TEXT,
+				bytes INTEGER,
+				mtime REAL,
+				width INTEGER,
+				height INTEGER,
+				content_hash TEXT,
+				is_optimized INTEGER NOT NULL DEFAULT 0,
+				is_geotagged INTEGER NOT NULL DEFAULT 0,
+				outputs TEXT,
+				phash TEXT,
+				duplicate_of INTEGER,
+				similar_to INTEGER,
+				path_rel TEXT
+			);
+			CREATE INDEX IF NOT EXISTS assets_ext ON assets (ext);
+			CREATE INDEX IF NOT EXISTS assets_hash ON assets (content_hash);
+			CREATE TABLE IF NOT EXISTS session (
+				key TEXT PRIMARY KEY,
+				value TEXT
+			);
+			CREATE TABLE IF NOT EXISTS watched (
+				path TEXT PRIMARY KEY,
+				bytes INTEGER,
+				mtime_ns INTEGER
+			);
+		''')
+		self._addColumns()
+		self.db.commit()
+
+	def __repr__( self ):
+		return '<%s path=%s pending=%d>' % (self.__class__.__name__, self.path, len(self._pending))
+
+	def save( self, asset ):
+		''' queue an asset's current state, committed with the next full batch or flush '''
+		record = asset.getRecord()
+		with self._lock:
+			self._pending[record['id']] = record
+			if len(self._pending) < self.batch:
+				return False
+		return self.flush()
+
+	def saveMany( self, assets ):
+		''' queue many assets, then commit them '''
+		with self._lock:
+			for asset in assets:
+				record = asset.getRecord()
+				self._pending[record['id']] = record
+		return self.flush()
+
+	def flush( self ):
+		''' commit every queued record in a single transaction '''
+		with self._lock:
+			if not self._pending:
+				return False
+			rows = [ self._getRow(record) for record in self._pending.values() ]
+			self._pending.clear()
+			with self.db:
+				self.db.executemany(
+					'INSERT OR REPLACE INTO assets (%s) VALUES (%s)' % (
+						', '.join(self.columns), ', '.join('?' * len(self.columns))
+					), rows
+				)
+		return True
+
+	def remove( self, ids ):
+		''' delete the records of the given asset ids '''
+		ids = list(ids)
+		with self._lock:
+			for aid in ids:
+				self._pending.pop(aid, None)
+			with self.db:
+				self.db.executemany('DELETE FROM assets WHERE id = ?', [ (aid,) for aid in ids ])
+		return True
+
+	def clear( self ):
+		''' forget the whole session '''
+		with self._lock:
+			self._pending.clear()
+			with self.db:
+				self.db.execute('DELETE FROM assets')
+				self.db.execute('DELETE FROM session')
+		return True
+
+	def load( self ):
+		''' every stored asset record, in import order '''
+		self.flush()
+		with self._lock:
+			cursor = self.db.execute('SELECT %s FROM assets ORDER BY id' % ', '.join(self.columns))
+			return [ self._getRecord(row) for row in cursor ]
+
+	def setValue( self, key, value ):
+		''' store a session setting (JSON encoded) '''
+		with self._lock, self.db:
+			self.db.execute('INSERT OR REPLACE INTO session (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+		return True
+
+	def getValue( self, key, default=None ):
+		with self._lock:
+			row = self.db.execute('SELECT value FROM session WHERE key = ?', (key,)).fetchone()
+		return json.loads(row[0]) if row else default
+
+	def getWatched( self, folder ):
+		''' path -> (bytes, mtime_ns) of the files the watch mode processed under
+			folder; kept across sessions, clear() does not forget them '''
+		prefix = os.path.join( folder, '' )
+		with self._lock:
+			cursor = self.db.execute('SELECT path, bytes, mtime_ns FROM watched WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))
+			return { path: (nbytes, mtime_ns) for path, nbytes, mtime_ns in cursor }
+
+	def setWatched( self, items ):
+		''' record processed files, items are (path, (bytes, mtime_ns)) '''
+		with self._lock, self.db:
+			self.db.executemany('INSERT OR REPLACE INTO watched (path, bytes, mtime_ns) VALUES (?, ?, ?)', [ (path, nbytes, mtime_ns) for path, (nbytes, mtime_ns) in items ])
+		return True
+
+	def removeWatched( self, paths ):
+		''' forget processed files that are gone '''
+		with self._lock, self.db:
+			self.db.executemany('DELETE FROM watched WHERE path = ?', [ (path,) for path in paths ])
+		return True
+
+	def findIds( self, ext=None, type=None, is_optimized=None, is_geotagged=None, min_bytes=None, max_bytes=None, content_hash=None ):
+		''' ids of the assets matching every given filter,
+			e.g. findIds(ext='png', is_geotagged=False, min_bytes=1024**2) '''
+		where, params = [], []
+		for column, value in (('ext', ext), ('type', type), ('content_hash', content_hash)):
+			if value is not None:
+				where.append('%s = ?' % column)
+				params.append(value.lower() if column == 'ext' else value)
+		for column, value in (('is_optimized', is_optimized), ('is_geotagged', is_geotagged)):
+			if value is not None:
+				where.append('%s = ?' % column)
+				params.append(int(bool(value)))
+		if min_bytes is not None:
+			where.append('bytes >= ?')
+			params.append(min_bytes)
+		if max_bytes is not None:
+			where.append('bytes <= ?')
+			params.append(max_bytes)
+		return self.query( ' AND '.join(where) or '1', params )
+
+	def query( self, where, params=() ):
+		''' ids of the assets matching a raw SQL where clause '''
+		self.flush()
+		with self._lock:
+			cursor = self.db.execute('SELECT id FROM assets WHERE %s ORDER BY id' % where, tuple(params))
+			return [ row[0] for row in cursor ]
+
+	def close( self ):
+		self.flush()
+		with self._lock:
+			self.db.close()
+		return True
+
+	def _addColumns( self ):
+		''' bring a catalog written by an older version up to the current columns '''
+		known = set( row[1] for row in self.db.execute('PRAGMA table_info(assets)') )
+		for column, kind in self.added_columns:
+			if column not in known:
+				self.db.execute('ALTER TABLE assets ADD COLUMN %s %s' % (column, kind))
+		return True
+
+	def _getRow( self, record ):
+		''' record dict -> column values '''
+		row = dict(record)
+		row['outputs'] = json.dumps(record.get('outputs') or {})
+		row['is_optimized'] = int(bool(record['is_optimized']))
+		row['is_geotagged'] = int(bool(record['is_geotagged']))
+		return [ row.get(column) for column in self.columns ]
+
+	def _getRecord( self, row ):
+		''' column values -> record dict '''
+		record = dict(zip(self.columns, row))
+		record['outputs'] = json.loads(record['outputs'] or '{}')
+		record['is_optimized'] = bool(record['is_optimized'])
+		record['is_geotagged'] = bool(record['is_geotagged'])
+		return record
@@ -1,15 +1,15 @@
-import os, shutil
+import os, re, shutil, hashlib
 from pathlib2 import Path
-from datetime import datetime, date
-import functools, operator
+from datetime import datetime
 import zipfile
 try:
 	import constants
+	from LogFactory import Logger
 except:
 	from . import constants
+	from .LogFactory import Logger
 '''
 FileFactory
-Logger (singleton)
 '''
 
 class FileFactory:
@@ -28,6 +28,27 @@ class FileFactory:
 		file_kbs = file_bytes/1000
 		return format(file_kbs, '.3f')
 
+	def getBytes( self, folder ):
+		''' returns the size of the file in bytes '''
+		return Path(folder).stat().st_size
+
+	def parseBytes( self, text ):
+		''' returns the byte count of a size like 250000, 200KB, 1.5MB or 2G (1KB = 1000
+			bytes, like getSize), None when it does not read as one '''
+		match = re.match( r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?\s*$', str(text), re.IGNORECASE )
+		if not match:
+			return None
+		scale = {'': 1, 'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3}[ match.group(2).lower() ]
+		return int( float(match.group(1)) * scale )
+
+	def getFileHash( self, filepath ):
+		''' returns the SHA-256 hex digest of the file contents '''
+		sha = hashlib.sha256()
+		with open(filepath, 'rb') as f:
+			for chunk in iter(lambda: f.read(1 << 20), b''):
+				sha.update(chunk)
+		return sha.hexdigest()
+
 	def getTimestamp( self, folder ):
 		''' returns the file last modified timestamp as interger ''' 
 		ts = Path(folder).stat().st_mtime
@@ -39,11 +60,26 @@ class FileFactory:
 
 	def determineFileType( self, ext ):
 		''' returns file type label '''
-		filetype = 'unknown'
-		for media in constants.MEDIATYPES:
-			if ext in constants.MEDIATYPES[media]:
-				filetype = media
-		return filetype
+		return constants.FILETYPES.get(ext, 'unknown')
+
+	def scanFiles( self, folder, recursive=True ):
+		''' yields an os.DirEntry per file under a folder as it is found, walking
+			sub-folders depth first; the entries carry the type (and once asked,
+			the stat) from the directory listing, symlinked folders are not followed '''
+		folders = [folder]
+		while folders:
+			try:
+				with os.scandir(folders.pop()) as entries:
+					subfolders = []
+					for entry in entries:
+						if entry.is_file():
+							yield entry
+						elif recursive and entry.is_dir(follow_symlinks=False):
+							subfolders.append(entry.path)
+			except OSError:
+				continue
+			# keep the walk in name order
+			folders.extend( sorted(subfolders, reverse=True) )
 
 	def copyFileFromTo( self, filename, path_from, path_to ):
 		''' move file from src path to provided path '''
@@ -59,6 +95,170 @@ class FileFactory:
 			dest_path = shutil.copy(file_src, file_dst)
 		return dest_path
 
+	def replaceFileWith( self, filepath, buffer ):
+		''' atomically replace a file with the contents of an in-memory buffer '''
+		tmp_path = '%s.tmp' % filepath
+		with open(tmp_path, 'wb') as f:
+			f.write( buffer.getbuffer() )
+		os.replace(tmp_path, filepath)
+		return filepath
+
+	def linkFileFromTo( self, filename, path_from, path_to ):
+		''' place file in provided path without duplicating its data: a reflink (copy
+			on write) or a hardlink when the filesystem allows it, else a copy;
+			hardlinked files must be detached before they get modified in place '''
+		if self._isSameFile( '%s/%s' % (path_from, filename), '%s/%s' % (path_to, filename) ):
+			return '%s/%s' % (path_to, filename)
+		if constants.IMPORT_MODE == 'copy':
+			return self.copyFileFromTo( filename, path_from, path_to )
+		os.makedirs(path_to, exist_ok=True)
+		return self.linkFile( '%s/%s' % (path_from, filename), '%s/%s' % (path_to, filename) )
+
+	def importFileTo( self, filename, path_from, path_to, hashed=False ):
+		''' linkFileFromTo for imports, returns (new path, SHA-256 hex digest); with
+			hashed, a file that gets copied (copy mode, or no links across
+			filesystems) is hashed in the same read, the digest is None when it was
+			linked (nothing was read) or not asked for '''
+		file_src, file_dst = '%s/%s' % (path_from, filename), '%s/%s' % (path_to, filename)
+		if self._isSameFile( file_src, file_dst ):
+			return file_dst, None
+		os.makedirs(path_to, exist_ok=True)
+		sha = hashlib.sha256() if hashed else None
+		copied = self._linkOrCopy( file_src, file_dst, sha )
+		return file_dst, sha.hexdigest() if copied and sha else None
+
+	def linkFile( self, file_src, file_dst ):
+		''' place file_src at file_dst (any name) like linkFileFromTo, replacing it;
+			a file_dst that already is file_src (same path or a link of it) is kept '''
+		if self._isSameFile( file_src, file_dst ):
+			return file_dst
+		if constants.IMPORT_MODE == 'copy':
+			return shutil.copy(file_src, file_dst)
+		self._linkOrCopy( file_src, file_dst )
+		return file_dst
+
+	def _linkOrCopy( self, file_src, file_dst, sha=None ):
+		''' replace file_dst with a reflink or hardlink of file_src, else a copy (in
+			copy mode always) whose data is fed to sha on the way; True when copied '''
+		if os.path.lexists(file_dst):
+			os.remove(file_dst)
+		if constants.IMPORT_MODE != 'copy':
+			if self._reflinkFile(file_src, file_dst):
+				return False
+			try:
+				os.link(file_src, file_dst)
+				return False
+			except OSError:
+				pass
+		self._copyFileData(file_src, file_dst, sha)
+		return True
+
+	def _isSameFile( self, file_src, file_dst ):
+		''' True when file_dst exists and is file_src itself (or a hardlink of it),
+			replacing it would delete the source '''
+		try:
+			return os.path.samefile( file_src, file_dst )
+		except OSError:
+			return False
+
+	def detachFile( self, filepath ):
+		''' give a hardlinked file its own data before it gets modified in place '''
+		if os.stat(filepath).st_nlink < 2:
+			return filepath
+		tmp_path = '%s.tmp' % filepath
+		if not self._reflinkFile(filepath, tmp_path):
+			self._copyFileData(filepath, tmp_path)
+		os.replace(tmp_path, filepath)
+		return filepath
+
+	def spliceFile( self, filepath, edits, file_to=None ):
+		''' replace byte ranges of a file, edits are (start, end, data) in file order;
+			same length edits of a file with a single link are written in place,
+			otherwise the untouched ranges are copied (in the kernel when possible)
+			around the new data into a temp file that replaces the original, or
+			file_to when given (the original is left as is) '''
+		st = os.stat(filepath)
+		if file_to is None and st.st_nlink < 2 and all( len(data) == end - start for start, end, data in edits ):
+			with open(filepath, 'r+b') as f:
+				for start, end, data in edits:
+					f.seek(start)
+					f.write(data)
+			return filepath
+		file_to = file_to or filepath
+		tmp_path = '%s.tmp' % file_to
+		with open(filepath, 'rb', buffering=0) as fsrc, open(tmp_path, 'wb', buffering=0) as fdst:
+			pos = 0
+			for start, end, data in edits:
+				self._copyFileRange(fsrc, fdst, pos, start - pos)
+				fdst.write(data)
+				pos = end
+			self._copyFileRange(fsrc, fdst, pos, st.st_size - pos)
+		os.chmod(tmp_path, st.st_mode & 0o7777)
+		os.replace(tmp_path, file_to)
+		return file_to
+
+	def _copyFileRange( self, fsrc, fdst, offset, count ):
+		''' append count bytes of fsrc from offset to fdst (unbuffered files) '''
+		if hasattr(os, 'copy_file_range'):
+			try:
+				while count > 0:
+					copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), count, offset)
+					if not copied:
+						break
+					offset += copied
+					count -= copied
+			except OSError:
+				pass
+		fsrc.seek(offset)
+		while count > 0:
+			chunk = fsrc.read(min(count, 1 << 20))
+			if not chunk:
+				break
+			fdst.write(chunk)
+			count -= len(chunk)
+		return True
+
+	def _reflinkFile( self, file_src, file_dst ):
+		''' clone file data with the FICLONE ioctl (btrfs, xfs, ...) into a new
+			file_dst, True on success; an existing file_dst is never touched '''
+		try:
+			import fcntl
+		except ImportError:
+			return False
+		try:
+			fdst = open(file_dst, 'xb')
+		except OSError:
+			return False
+		try:
+			with open(file_src, 'rb') as fsrc, fdst:
+				fcntl.ioctl(fdst.fileno(), constants.FICLONE, fsrc.fileno())
+			return True
+		except OSError:
+			os.remove(file_dst)
+			return False
+
+	def _copyFileData( self, file_src, file_dst, sha=None ):
+		''' copy file data in the kernel (copy_file_range) when possible; with sha
+			(a hashlib object) it is read through and hashed as it is copied '''
+		if sha is not None:
+			with open(file_src, 'rb') as fsrc, open(file_dst, 'wb') as fdst:
+				for chunk in iter(lambda: fsrc.read(1 << 20), b''):
+					sha.update(chunk)
+					fdst.write(chunk)
+			shutil.copymode(file_src, file_dst)
+			return file_dst
+		if hasattr(os, 'copy_file_range'):
+			try:
+				with open(file_src, 'rb') as fsrc, open(file_dst, 'wb') as fdst:
+					while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+						pass
+				shutil.copymode(file_src, file_dst)
+				return file_dst
+			except OSError:
+				pass
+		shutil.copy(file_src, file_dst)
+		return file_dst
+
 	def renameFileAppendTo( self, path_src, old_name, app_str ):
 		p = Path('%s/%s'%(path_src,old_name))
 		new_name = '%s_%s%s'%(p.stem,app_str,p.suffix)
@@ -69,7 +269,7 @@ class FileFactory:
 		try:
 			shutil.rmtree(path_src)
 		except OSError as e:
-			print("Error: %s : %s" % (path_src, e.strerror))
+			Logger.event( 'error', action='deleteFolderContents', path=path_src, error=e.strerror )
 		return True
 
 	def makeDir(self, path):
@@ -80,36 +280,61 @@ class FileFactory:
 		''' makes a file if it does not already exist '''
 		return Path(filepath).touch(exist_ok=True)
 
-	def makeZipFile( self, path_zip_from, path_zip_to, filename='WebOptimizedAssets'):
-		timestamp = self.getTimestamp( path_zip_to )
-		timesig = datetime.utcfromtimestamp( timestamp ).strftime('%y-%m-%d')
-		zip_filename = '%s-%s.zip' % (timesig, filename)
-		zipf = zipfile.ZipFile( '%s/%s'%(path_zip_to, zip_filename), 'w', zipfile.ZIP_DEFLATED)
-		for root, dirs, files in os.walk( path_zip_from ):
-			for file in files:
-				zipf.write( os.path.join(root, file),
-					os.path.relpath(os.path.join(root,file), os.path.join(path_zip_from,'..'))
-				)
-		zipf.close()
+	def makeZipFile( self, files, path_zip_to, filename='WebOptimizedAssets', progress=None, cancel=None ):
+		''' stream the given files into a ZIP in path_zip_to, named after today's
+			date: already compressed formats are stored as-is, the rest is deflated;
+			progress(None, done, total) runs per member, a set cancel event
+			discards the partial ZIP and returns None; files are paths, or (path,
+			name in the ZIP folder) pairs for members kept in a sub-folder '''
+		files = [ (str(file[0]), file[1]) if isinstance(file, tuple) else (str(file), None) for file in files ]
+		with Logger.span( 'package', files=len(files) ) as span:
+			zip_filename = self._makeZipFile( files, path_zip_to, filename, progress, cancel )
+			if zip_filename is None:
+				span.set( cancelled=True )
+			else:
+				bytes_in = sum( os.path.getsize(file) for file, name in files )
+				span.set( file=zip_filename ).addBytes( bytes_in, os.path.getsize('%s/%s' % (path_zip_to, zip_filename)) )
 		return zip_filename
 
+	def _makeZipFile( self, files, path_zip_to, filename, progress, cancel ):
+		zip_filename = '%s-%s.zip' % (datetime.now().strftime('%y-%m-%d'), filename)
+		zip_path = '%s/%s' % (path_zip_to, zip_filename)
+		members = self._getZipMembers( files, filename )
+		cancelled = False
+		# write next to the destination, then move in place
+		with zipfile.ZipFile( '%s.part' % zip_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True ) as zipf:
+			for done, (file, arcname) in enumerate(members, 1):
+				if file.split('.')[-1].lower() in constants.COMPRESSED_EXTS:
+					zipf.write( file, arcname, compress_type=zipfile.ZIP_STORED )
+				else:
+					zipf.write( file, arcname, compress_type=zipfile.ZIP_DEFLATED )
+				if progress:
+					progress(None, done, len(members))
+				cancelled = cancel is not None and cancel.is_set()
+				if cancelled:
+					break
+		if cancelled:
+			os.remove( '%s.part' % zip_path )
+			return None
+		os.replace( '%s.part' % zip_path, zip_path )
+		return zip_filename
 
-
-
-class Logger:
-	__instance = None
-	def __new__(cls, val=None):
-		if Logger.__instance is None:
-			Logger.__instance = object.__new__(cls)
-		Logger.__instance.val = val
-		return Logger.__instance
-
-	def __repr__( self ):
-		return '<%s>' % self.__class__.__name__
-
-	def __init__( self, filepath ):
-		self.src = filepath
-
+	def _getZipMembers( self, files, folder ):
+		''' pair each (file, name) with a unique archive name inside folder, the
+			file's own name when name is None '''
+		members = []
+		used = set()
+		for file, name in files:
+			name = name or os.path.basename(file)
+			stem, dot, ext = name.rpartition('.')
+			arcname = '%s/%s' % (folder, name)
+			count = 1
+			while arcname in used:
+				arcname = '%s/%s_%d%s%s' % (folder, stem, count, dot, ext)
+				count += 1
+			used.add(arcname)
+			members.append( (file, arcname) )
+		return members
 
 
 
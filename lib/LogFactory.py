@@ -0,0 +1,249 @@
+import os, json, time, atexit, threading, contextlib
+try:
+	import constants
+except:
+	from . import constants
+'''
+Logger (JSON-lines log, timing spans, counters, Prometheus text export, profiling hooks)
+Span
+'''
+
+class Span:
+	''' a timed section of work, its fields go into the log line written when it ends '''
+	__slots__ = ('logger', 'name', 'fields', 'start')
+
+	def __init__( self, logger, name, fields ):
+		self.logger = logger
+		self.name = name
+		self.fields = fields
+		self.start = time.perf_counter()
+
+	def __repr__( self ):
+		return '<%s name=%s>' % (self.__class__.__name__, self.name)
+
+	def set( self, **fields ):
+		''' add fields to the span's log line '''
+		self.fields.update(fields)
+		return self
+
+	def addBytes( self, bytes_in, bytes_out ):
+		''' record the bytes read and written, counted under the span's name '''
+		self.fields['bytes_in'] = bytes_in
+		self.fields['bytes_out'] = bytes_out
+		self.logger.addBytes( self.name, bytes_in, bytes_out )
+		return self
+
+
+class Logger:
+	''' where the time goes: spans (timed sections) and counters are aggregated in
+		memory and written as JSON lines to the log file; the aggregates export as a
+		Prometheus text file; cProfile and tracemalloc can be switched on per run '''
+	def __init__( self ):
+		self.path = None
+		self._file = None
+		self._lock = threading.RLock()
+		self._local = threading.local()
+		# span name -> [count, seconds, max seconds, errors]
+		self.spans = {}
+		# (counter name, sorted labels) -> value
+		self.counters = {}
+		# thread id -> cProfile.Profile, None when not profiling
+		self._profiles = None
+		self._tracing = False
+		atexit.register( self.close )
+
+	def __repr__( self ):
+		return '<%s path=%s spans=%d counters=%d>' % (self.__class__.__name__, self.path, len(self.spans), len(self.counters))
+
+	def setOutput( self, path, limit=None ):
+		''' append the log lines to path (None stops writing them); a log grown over
+			limit bytes is moved to path.1 first '''
+		limit = constants.LOG_LIMIT if limit is None else limit
+		with self._lock:
+			if self._file:
+				self._file.close()
+				self._file = None
+			self.path = path
+			if path is None:
+				return True
+			if os.path.exists(path) and os.path.getsize(path) > limit:
+				os.replace( path, '%s.1' % path )
+			self._file = open( path, 'a', encoding='utf-8' )
+		return True
+
+	def flush( self ):
+		with self._lock:
+			if self._file:
+				self._file.flush()
+		return True
+
+	def close( self ):
+		return self.setOutput( None )
+
+	def reset( self ):
+		''' forget the aggregated spans and counters '''
+		with self._lock:
+			self.spans.clear()
+			self.counters.clear()
+		return True
+
+	@contextlib.contextmanager
+	def span( self, name, **fields ):
+		''' time the block, e.g.
+			with Logger.span('optimize', file=name) as span:
+				span.addBytes( bytes_in, bytes_out ) '''
+		span = Span( self, name, fields )
+		depth = getattr(self._local, 'depth', 0)
+		profile = self._startThreadProfile() if depth == 0 else None
+		self._local.depth = depth + 1
+		error = None
+		try:
+			yield span
+		except BaseException as e:
+			error = e
+			span.fields['error'] = repr(e)
+			raise
+		finally:
+			seconds = time.perf_counter() - span.start
+			self._local.depth = depth
+			if profile is not None:
+				profile.disable()
+			with self._lock:
+				stats = self.spans.setdefault( name, [0, 0.0, 0.0, 0] )
+				stats[0] += 1
+				stats[1] += seconds
+				stats[2] = max(stats[2], seconds)
+				stats[3] += error is not None
+			self._write( dict(type='span', name=name, ms=round(seconds * 1000, 3), **span.fields) )
+
+	def count( self, name, value=1, **labels ):
+		''' add value to a counter '''
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+		return True
+
+	def addBytes( self, stage, bytes_in, bytes_out ):
+		''' the bytes a stage read, wrote and saved '''
+		self.count( 'bytes_in', bytes_in, stage=stage )
+		self.count( 'bytes_out', bytes_out, stage=stage )
+		self.count( 'bytes_saved', max(0, bytes_in - bytes_out), stage=stage )
+		return True
+
+	def event( self, name, **fields ):
+		''' write a single log line '''
+		self._write( dict(type='event', name=name, **fields) )
+		return True
+
+	def getStats( self ):
+		''' the aggregates as a JSON-safe dict '''
+		with self._lock:
+			spans = {
+				name: {'count': count, 'seconds': round(seconds, 6), 'max_seconds': round(longest, 6), 'errors': errors}
+				for name, (count, seconds, longest, errors) in self.spans.items()
+			}
+			counters = {}
+			for (name, labels), value in self.counters.items():
+				counters.setdefault( name, {} )[ ','.join('%s=%s' % label for label in labels) or 'total' ] = value
+		return {'spans': spans, 'counters': counters}
+
+	def writeMetrics( self, path ):
+		''' write the aggregates as a Prometheus text exposition file '''
+		lines = [
+			'# HELP wao_span_seconds Time spent in each WAO span.',
+			'# TYPE wao_span_seconds summary',
+		]
+		with self._lock:
+			spans = sorted(self.spans.items())
+			counters = sorted(self.counters.items())
+		for name, (count, seconds, longest, errors) in spans:
+			lines.append( 'wao_span_seconds_count{span="%s"} %d' % (name, count) )
+			lines.append( 'wao_span_seconds_sum{span="%s"} %.6f' % (name, seconds) )
+		lines.append( '# TYPE wao_span_seconds_max gauge' )
+		for name, (count, seconds, longest, errors) in spans:
+			lines.append( 'wao_span_seconds_max{span="%s"} %.6f' % (name, longest) )
+		lines.append( '# TYPE wao_span_errors_total counter' )
+		for name, (count, seconds, longest, errors) in spans:
+			lines.append( 'wao_span_errors_total{span="%s"} %d' % (name, errors) )
+		typed = set()
+		for (name, labels), value in counters:
+			if name not in typed:
+				typed.add(name)
+				lines.append( '# TYPE wao_%s_total counter' % name )
+			label_str = ','.join( '%s="%s"' % label for label in labels )
+			lines.append( 'wao_%s_total%s %s' % (name, '{%s}' % label_str if label_str else '', value) )
+		tmp_path = '%s.tmp' % path
+		with open(tmp_path, 'w') as f:
+			f.write( '\n'.join(lines) + '\n' )
+		os.replace( tmp_path, path )
+		return True
+
+	def startProfile( self, cpu=True, memory=False ):
+		''' cpu: cProfile every span (outermost span per thread), memory: trace
+			allocations with tracemalloc until stopProfile '''
+		if cpu:
+			self._profiles = {}
+		if memory:
+			import tracemalloc
+			tracemalloc.start()
+			self._tracing = True
+		return True
+
+	def stopProfile( self, path=None, top=10 ):
+		''' write the merged cProfile stats to path (pstats format), log the peak
+			traced memory and the top allocating lines '''
+		profiles, self._profiles = self._profiles, None
+		if profiles and path:
+			import pstats
+			stats = None
+			for profile in profiles.values():
+				if stats is None:
+					stats = pstats.Stats(profile)
+				else:
+					stats.add(profile)
+			stats.dump_stats(path)
+		if self._tracing:
+			import tracemalloc
+			snapshot = tracemalloc.take_snapshot()
+			current, peak = tracemalloc.get_traced_memory()
+			tracemalloc.stop()
+			self._tracing = False
+			self.event(
+				'memory', current_mb=round(current / 1024**2, 3), peak_mb=round(peak / 1024**2, 3),
+				top=[ str(stat) for stat in snapshot.statistics('lineno')[:top] ],
+			)
+		return True
+
+	def _startThreadProfile( self ):
+		''' enable this thread's profiler, None when not profiling '''
+		profiles = self._profiles
+		if profiles is None:
+			return None
+		import cProfile
+		thread_id = threading.get_ident()
+		profile = profiles.get(thread_id) or cProfile.Profile()
+		try:
+			profile.enable()
+		except ValueError:
+			# Python 3.12+ allows a single active profiler across threads
+			return None
+		profiles[thread_id] = profile
+		return profile
+
+	def _write( self, record ):
+		''' append a JSON line to the log '''
+		if self._file is None:
+			return False
+		record['ts'] = round(time.time(), 3)
+		record['thread'] = threading.current_thread().name
+		line = json.dumps( record, default=str ) + '\n'
+		with self._lock:
+			if self._file:
+				self._file.write( line )
+		return True
+
+
+
+# instantiate the Logger to be imported
+if not __name__ == "__main__":
+	Logger = Logger()
@@ -1,15 +1,23 @@
-from datetime import datetime
-import geocoder
-from PIL import Image, ExifTags
-from GPSPhoto import gpsphoto
+import os, json, time, zlib, threading
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
 try:
 	import constants
 	from FileFactory import FileFactory
+	from LogFactory import Logger
 except:
 	from . import constants
 	from .FileFactory import FileFactory
+	from .LogFactory import Logger
 '''
 GeoTagFactory
+GPSWriter (lossless JPEG/PNG/WebP EXIF GPS tagging)
+GeoLookup (cached, rate limited, async geocoding)
+OSMProvider, NominatimProvider
 '''
 
 class MetaTags:
@@ -45,31 +53,320 @@ class GeoTags(MetaTags):
 		super().__init__( self )
 		self.__dict__ = self.__shared_tags
 
-	def getCoordsFromAddress( self, address ):
-		if address:
-			geo = geocoder.osm(address)
-			geo_data = geo.json
-			# return the latitude and longitude as tuple
-			if geo_data['lat'] and geo_data['lng']:
-				return geo_data['lat'], geo_data['lng']
-		return False
-
 	def tagAssetWithCoords( self, asset, latitude, longitude, altft=1 ):
-		img_coords = ( float(latitude), float(longitude) )
-		img_timestamp = datetime.now().strftime("%Y:%m:%d %H:%M:%S")
 		filename = asset.getActiveFile()
-		# case jpgs
-		if asset.ext == 'jpg' or asset.ext == 'jpeg':
-			# create a GPSPhoto Object
-			photo = gpsphoto.GPSPhoto(filename)
-			# create GPSInfo Data Object
-			info = gpsphoto.GPSInfo(img_coords, alt=altft, timeStamp=img_timestamp)
-			# modify GPS Data
-			photo.modGPSData(info, filename)
-		# case pngs
-		elif asset.ext == 'png':
-			print('cannot GEOTag PNGs yet')
-		# case gifs
-		elif asset.ext == 'gif':
-			print('cannot GEOTag PNGs yet')
+		with Logger.span( 'geotag', file=asset.name_origin ) as span:
+			# jpgs, pngs and webps get their EXIF GPS tags spliced in
+			writer = GPSWriter()
+			if writer.canTag( asset.ext ):
+				bytes_in = os.path.getsize( filename )
+				writer.tagFile( filename, latitude, longitude, altft )
+				span.addBytes( bytes_in, os.path.getsize(filename) )
+			# case gifs
+			elif asset.ext == 'gif':
+				span.set( skipped='gif' )
 		return True
+
+
+class GPSWriter:
+	''' writes the GPS EXIF tags into JPEG (APP1), PNG (eXIf) and WebP (EXIF) files
+		without decoding any pixels: only the metadata segment is rebuilt, the rest of
+		the file is copied around it (or, when the new segment fits the old one, it is
+		patched in place); other EXIF tags are kept '''
+	exts = { 'jpg': '_tagJpeg', 'jpeg': '_tagJpeg', 'png': '_tagPng', 'webp': '_tagWebp' }
+
+	def __repr__( self ):
+		return '<%s>' % self.__class__.__name__
+
+	def canTag( self, ext ):
+		return ext in self.exts
+
+	def tagFile( self, filepath, latitude, longitude, altitude=1, utc=None, file_to=None ):
+		''' write the coordinates into the file (or a tagged copy of it into file_to),
+			returns False for formats without EXIF '''
+		ext = filepath.rsplit('.', 1)[-1].lower()
+		if ext not in self.exts:
+			return False
+		gps = self.getGPSTags( float(latitude), float(longitude), altitude, utc or datetime.now(timezone.utc) )
+		return getattr(self, self.exts[ext])( filepath, gps, file_to )
+
+	def getExif( self, latitude, longitude, altitude=1, utc=None ):
+		''' EXIF block holding only the GPS tags, for encoders (Image.save exif=) '''
+		gps = self.getGPSTags( float(latitude), float(longitude), altitude, utc or datetime.now(timezone.utc) )
+		return self._getExif( None, gps )
+
+	def getGPSTags( self, latitude, longitude, altitude, utc ):
+		''' GPS IFD tags dict, coordinates as degrees/minutes/seconds rationals '''
+		gps = {
+			0: b'\x02\x02\x00\x00', # GPSVersionID
+			1: 'N' if latitude >= 0 else 'S',
+			2: self._getDMS(latitude),
+			3: 'E' if longitude >= 0 else 'W',
+			4: self._getDMS(longitude),
+			5: b'\x00' if altitude >= 0 else b'\x01', # above/below sea level
+			6: IFDRational( int(round(abs(altitude) * 100)), 100 ),
+			7: ( IFDRational(utc.hour), IFDRational(utc.minute), IFDRational(utc.second) ),
+			29: utc.strftime('%Y:%m:%d'),
+		}
+		return gps
+
+	def _getDMS( self, value ):
+		value = abs(value)
+		degrees = int(value)
+		minutes = int((value - degrees) * 60)
+		seconds = (value - degrees - minutes / 60) * 3600
+		return ( IFDRational(degrees), IFDRational(minutes), IFDRational(int(round(seconds * 10000)), 10000) )
+
+	def _getExif( self, raw, gps ):
+		''' the EXIF block (with its Exif header) of raw plus the GPS tags '''
+		exif = Image.Exif()
+		if raw:
+			exif.load(raw)
+		exif[constants.GPS_IFD] = gps
+		return exif.tobytes()
+
+	def _tagJpeg( self, filepath, gps, file_to=None ):
+		''' replace (or add) the Exif APP1 segment, everything from the next segment on is copied '''
+		with open(filepath, 'rb') as f:
+			if f.read(2) != b'\xff\xd8':
+				raise ValueError('not a JPEG file: %s' % filepath)
+			pos, insert_at, exif_seg = 2, 2, None
+			while True:
+				header = f.read(4)
+				if len(header) < 4 or header[0] != 0xFF:
+					break
+				marker, length = header[1], int.from_bytes(header[2:4], 'big')
+				# metadata segments are the APPn + COM at the head of the file
+				if not (0xE0 <= marker <= 0xEF or marker == 0xFE):
+					break
+				if marker == 0xE1 and exif_seg is None:
+					payload = f.read(length - 2)
+					if payload.startswith(b'Exif\x00\x00'):
+						exif_seg = (pos, pos + 2 + length, payload)
+				else:
+					f.seek(length - 2, 1)
+				# keep the JFIF APP0 first
+				if marker == 0xE0 and insert_at == pos:
+					insert_at = pos + 2 + length
+				pos += 2 + length
+		payload = self._getExif( exif_seg[2] if exif_seg else None, gps )
+		if len(payload) > 0xFFFF - 2:
+			raise ValueError('EXIF block too large for a JPEG APP1 segment')
+		if exif_seg:
+			start, end, old = exif_seg
+			payload = self._padTo( payload, len(old) )
+		else:
+			start = end = insert_at
+		segment = b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload
+		FileFactory.spliceFile( filepath, [ (start, end, segment) ], file_to )
+		return True
+
+	def _tagPng( self, filepath, gps, file_to=None ):
+		''' replace (or add before the image data) the eXIf chunk '''
+		exif_chunk, idat = None, None
+		with open(filepath, 'rb') as f:
+			if f.read(8) != b'\x89PNG\r\n\x1a\n':
+				raise ValueError('not a PNG file: %s' % filepath)
+			pos = 8
+			while idat is None:
+				header = f.read(8)
+				if len(header) < 8:
+					raise ValueError('PNG file without image data: %s' % filepath)
+				length, kind = int.from_bytes(header[:4], 'big'), header[4:]
+				if kind == b'IDAT':
+					idat = pos
+				elif kind == b'eXIf' and exif_chunk is None:
+					exif_chunk = (pos, pos + 12 + length, f.read(length))
+					f.seek(4, 1)
+				else:
+					f.seek(length + 4, 1)
+				pos += 12 + length
+		raw = exif_chunk[2] if exif_chunk else None
+		payload = self._getExif( raw, gps )[6:]
+		if exif_chunk:
+			start, end = exif_chunk[:2]
+			payload = self._padTo( payload, len(raw) )
+		else:
+			start = end = idat
+		chunk = len(payload).to_bytes(4, 'big') + b'eXIf' + payload
+		chunk += zlib.crc32(chunk[4:]).to_bytes(4, 'big')
+		FileFactory.spliceFile( filepath, [ (start, end, chunk) ], file_to )
+		return True
+
+	def _tagWebp( self, filepath, gps, file_to=None ):
+		''' replace (or append) the EXIF chunk, turning a simple WebP into an
+			extended (VP8X) one when needed '''
+		chunks = []
+		with open(filepath, 'rb') as f:
+			head = f.read(12)
+			if head[:4] != b'RIFF' or head[8:] != b'WEBP':
+				raise ValueError('not a WebP file: %s' % filepath)
+			size = os.fstat(f.fileno()).st_size
+			pos = 12
+			while pos + 8 <= size:
+				f.seek(pos)
+				header = f.read(8)
+				kind, length = header[:4], int.from_bytes(header[4:], 'little')
+				data = f.read(length) if kind in (b'EXIF', b'VP8X') else None
+				chunks.append( (kind, pos, pos + 8 + length + (length & 1), data) )
+				pos = chunks[-1][2]
+		kinds = [ chunk[0] for chunk in chunks ]
+		exif_chunk = chunks[kinds.index(b'EXIF')] if b'EXIF' in kinds else None
+		raw = exif_chunk[3] if exif_chunk else None
+		payload = self._getExif( raw, gps )[6:]
+		if exif_chunk:
+			payload = self._padTo( payload, len(raw) )
+		chunk = b'EXIF' + len(payload).to_bytes(4, 'little') + payload + b'\x00' * (len(payload) & 1)
+		edits = []
+		if b'VP8X' in kinds:
+			# set the EXIF flag
+			vp8x = chunks[kinds.index(b'VP8X')]
+			edits.append( (vp8x[1] + 8, vp8x[1] + 9, bytes([ vp8x[3][0] | 0x08 ])) )
+		else:
+			with Image.open(filepath) as pimg:
+				width, height = pimg.size
+				flags = 0x08 | (0x10 if 'A' in pimg.mode else 0)
+			vp8x = b'VP8X' + (10).to_bytes(4, 'little') + bytes([flags, 0, 0, 0])
+			vp8x += (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little')
+			edits.append( (12, 12, vp8x) )
+		if exif_chunk:
+			edits.append( (exif_chunk[1], exif_chunk[2], chunk) )
+		else:
+			edits.append( (size, size, chunk) )
+		grown = sum( len(data) - (end - start) for start, end, data in edits )
+		edits.insert( 0, (4, 8, (size + grown - 8).to_bytes(4, 'little')) )
+		FileFactory.spliceFile( filepath, sorted(edits, key=lambda edit: edit[0]), file_to )
+		return True
+
+	def _padTo( self, payload, length ):
+		''' pad a rebuilt EXIF block to the old one's length so it is patched in
+			place, readers follow the IFD offsets and ignore the trailing zeros '''
+		if len(payload) <= length:
+			return payload + b'\x00' * (length - len(payload))
+		return payload
+
+
+class OSMProvider:
+	''' geocodes an address with OpenStreetMap through the geocoder package '''
+	def __call__( self, address ):
+		# imported on use, headless runs may never geocode
+		import geocoder
+		geo_data = geocoder.osm(address).json
+		if geo_data and geo_data.get('lat') and geo_data.get('lng'):
+			return float(geo_data['lat']), float(geo_data['lng'])
+		return None
+
+
+class NominatimProvider:
+	''' geocodes an address against any Nominatim compatible /search endpoint,
+		e.g. a self-hosted instance or a local stand-in server '''
+	def __init__( self, base_url, timeout=10 ):
+		self.base_url = base_url.rstrip('/')
+		self.timeout = timeout
+
+	def __call__( self, address ):
+		query = urlencode({ 'q': address, 'format': 'json', 'limit': 1 })
+		request = Request( '%s/search?%s' % (self.base_url, query), headers={'User-Agent': 'WAO'} )
+		with urlopen(request, timeout=self.timeout) as response:
+			places = json.loads( response.read().decode('utf-8') )
+		if places:
+			return float(places[0]['lat']), float(places[0]['lon'])
+		return None
+
+
+class GeoLookup:
+	''' address -> coordinates with an in-memory + persistent (JSON, TTL) cache;
+		provider calls are rate limited and run on a single background thread '''
+	def __init__( self, cache_file, provider=None, ttl=None, interval=None ):
+		self.cache_file = cache_file
+		self.provider = provider or self._getDefaultProvider()
+		self.ttl = constants.GEOCODE_TTL if ttl is None else ttl
+		self.interval = constants.GEOCODE_INTERVAL if interval is None else interval
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		self._last_request = 0.0
+		self._executor = ThreadPoolExecutor(max_workers=1)
+		self._memory = self._load()
+
+	def __repr__( self ):
+		return '<%s entries=%d hits=%d misses=%d>' % (self.__class__.__name__, len(self._memory), self.hits, self.misses)
+
+	def setProvider( self, provider ):
+		self.provider = provider
+		return True
+
+	def lookup( self, address ):
+		''' returns (latitude, longitude) for an address, or False '''
+		key = self._getKey(address)
+		if not key:
+			return False
+		coords = self.getCached(address)
+		if coords:
+			return coords
+		coords = self._request(address)
+		if not coords:
+			return False
+		with self._lock:
+			self._memory[key] = [ coords[0], coords[1], time.time() ]
+			self._save()
+		return coords
+
+	def lookupAsync( self, address, callback=None ):
+		''' lookup off the calling thread, callback(address, coords) runs on the
+			worker thread (Qt callers should emit a signal from it) '''
+		def task():
+			try:
+				coords = self.lookup(address)
+			except Exception:
+				coords = False
+			if callback:
+				callback(address, coords)
+			return coords
+		return self._executor.submit(task)
+
+	def getCached( self, address ):
+		''' cached coordinates of an address that have not expired, or None '''
+		key = self._getKey(address)
+		with self._lock:
+			entry = self._memory.get(key)
+			if entry and time.time() - entry[2] < self.ttl:
+				self.hits += 1
+				return entry[0], entry[1]
+			self.misses += 1
+		return None
+
+	def _request( self, address ):
+		''' call the provider, at most once per interval '''
+		with self._lock:
+			wait = self._last_request + self.interval - time.monotonic()
+			self._last_request = time.monotonic() + max(0, wait)
+		if wait > 0:
+			time.sleep(wait)
+		with Logger.span( 'geocode' ):
+			return self.provider(address)
+
+	def _getKey( self, address ):
+		return ' '.join( str(address or '').lower().split() )
+
+	def _getDefaultProvider( self ):
+		if constants.GEOCODE_URL:
+			return NominatimProvider( constants.GEOCODE_URL )
+		return OSMProvider()
+
+	def _load( self ):
+		''' unexpired entries of the persistent cache '''
+		try:
+			with open(self.cache_file) as f:
+				entries = json.load(f)
+		except (OSError, ValueError):
+			return {}
+		now = time.time()
+		return { key: entry for key, entry in entries.items() if now - entry[2] < self.ttl }
+
+	def _save( self ):
+		''' write the cache file atomically (lock held) '''
+		tmp_path = '%s.tmp' % self.cache_file
+		with open(tmp_path, 'w') as f:
+			json.dump(self._memory, f)
+		os.replace(tmp_path, self.cache_file)
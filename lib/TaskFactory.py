@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+	import constants
+except:
+	from . import constants
+'''
+TaskPool (bounded worker pool)
+TaskResult
+TaskCancelled
+'''
+
+class TaskCancelled(Exception):
+	''' the task was skipped because its batch got cancelled '''
+
+class TaskResult:
+	''' outcome of running a task against a single asset '''
+	def __init__( self, asset, ok, value=None, error=None ):
+		self.asset = asset
+		self.ok = ok
+		self.value = value
+		self.error = error
+
+	def __repr__( self ):
+		return '<%s ok=%s asset=%s error=%s>' % (self.__class__.__name__, self.ok, self.asset, self.error)
+
+	def isCancelled( self ):
+		return isinstance(self.error, TaskCancelled)
+
+	def getDict( self ):
+		''' get result data dict '''
+		asdict = {
+			'id': getattr(self.asset, 'index', None),
+			'file': getattr(self.asset, 'name', str(self.asset)),
+			'ok': self.ok,
+			'error': str(self.error) if self.error else None,
+		}
+		return asdict
+
+
+class TaskPool:
+	''' runs a task against many assets on a bounded pool of worker threads;
+		the heavy lifting (subprocesses, image codecs) releases the GIL '''
+	def __init__( self, workers=None ):
+		self.workers = max(1, int(workers or constants.WORKERS))
+
+	def __repr__( self ):
+		return '<%s workers=%d>' % (self.__class__.__name__, self.workers)
+
+	def map( self, task, items, *args, progress=None, cancel=None ):
+		''' run task(item, *args) for every item, returns TaskResults in item order;
+			progress(result, done, total) is called on the calling thread as each item
+			finishes, setting the cancel event skips every item not started yet '''
+		items = list(items)
+		results = [None] * len(items)
+		total = len(items)
+		# nothing to parallelize
+		if self.workers == 1 or total < 2:
+			for pos, item in enumerate(items):
+				results[pos] = self._run(task, item, args, cancel)
+				if progress:
+					progress(results[pos], pos + 1, total)
+			return results
+		with ThreadPoolExecutor(max_workers=min(self.workers, total)) as executor:
+			futures = {}
+			for pos, item in enumerate(items):
+				futures[executor.submit(self._run, task, item, args, cancel)] = pos
+			for done, future in enumerate(as_completed(futures), 1):
+				results[futures[future]] = future.result()
+				if progress:
+					progress(results[futures[future]], done, total)
+		return results
+
+	def _run( self, task, item, args, cancel=None ):
+		''' run a single task, capturing its error instead of raising '''
+		if cancel is not None and cancel.is_set():
+			return TaskResult(item, False, error=TaskCancelled('cancelled'))
+		try:
+			value = task(item, *args)
+			return TaskResult(item, bool(value), value)
+		except Exception as e:
+			return TaskResult(item, False, error=e)
@@ -8,51 +8,68 @@ CONTROLLER: manages actions between the WAOWindow and Factories
 5b.	handles a factory raised error
 6.	returns data or error message to WAOWindow
 '''
-import sys
+import os, json, math
+from concurrent.futures import ThreadPoolExecutor
 try:
 	import constants
-	from FileFactory import FileFactory, Logger
-	from AssetFactory import Asset
-	from MetaTagFactory import MetaTags, GeoTags
+	from FileFactory import FileFactory
+	from AssetFactory import Asset, AssetRegistry
+	from MetaTagFactory import GeoTags, GeoLookup
+	from TaskFactory import TaskPool, TaskResult
+	from CacheFactory import OptimizeCache
+	from CatalogFactory import SessionCatalog
+	from LogFactory import Logger
 except:
 	from . import constants
-	from .FileFactory import FileFactory, Logger
-	from .AssetFactory import Asset
-	from .MetaTagFactory import MetaTags, GeoTags
+	from .FileFactory import FileFactory
+	from .AssetFactory import Asset, AssetRegistry
+	from .MetaTagFactory import GeoTags, GeoLookup
+	from .TaskFactory import TaskPool, TaskResult
+	from .CacheFactory import OptimizeCache
+	from .CatalogFactory import SessionCatalog
+	from .LogFactory import Logger
 
-def run():
+def run( path_cache=None, upload_root=None ):
 	'''create initial files and folders'''
-	WAO = WAODirector()
-	LOG = '%s/%s' % (WAO.path_data, 'log.txt')
-	try:
-		# make console.log file
-		FileFactory.makeFile(LOG)
-		CONSOLE = Logger( LOG )
-	except FileExistsError:
-		pass
+	WAO = WAODirector( path_cache, upload_root )
+	# spans, counters and events go to the log file as JSON lines
+	Logger.setOutput( WAO.path_log )
+	# pick up where the last session stopped
+	WAO.resumeSession()
 	# return the director obj.
 	return WAO
 
 class WAODirector:
-	uploaded = []
-	invalid = []
 
 	# -----------------------------------------------------------------------
 	# CLASS FUNCTIONS
-	def __init__( self ):
-		''' constructor '''
+	def __init__( self, path_cache=None, upload_root=None ):
+		''' constructor, upload_root holds the session (WAOassets by default) '''
 		self.index = 0
-		self.upload_root = '%s/%s' % (constants.ROOT, 'WAOassets')
+		self.upload_root = upload_root or '%s/%s' % (constants.ROOT, 'WAOassets')
 		self.path_export = '%s/%s' % (constants.ROOT, '_exports')
 		self.path_data = '%s/%s' % (self.upload_root, 'data')
 		self.path_ignore = '%s/%s' % (self.upload_root, 'ignored')
 		self.path_upload = '%s/%s' % (self.upload_root, 'original')
 		self.path_optmze = '%s/%s' % (self.upload_root, 'optimized')
 		self.path_geotag = '%s/%s' % (self.upload_root, 'geotagged')
+		self.path_variants = '%s/%s' % (self.upload_root, 'variants')
+		self.path_cache = path_cache or constants.CACHE_ROOT or '%s/%s' % (self.path_data, 'cache')
+		self.path_log = '%s/%s' % (self.path_data, 'log.txt')
+		self.path_metrics = '%s/%s' % (self.path_data, 'metrics.prom')
 		self.limit = constants.LIMITS
+		self.workers = constants.WORKERS
+		self.dedupe = constants.DEDUPE
+		self.perceptual_hash = constants.PERCEPTUAL_HASH
 		self.is_download = False
+		# imported assets, and the files ignored on import
+		self.uploaded = AssetRegistry()
+		self.invalid = []
 		# build initial file structure
 		self.buildFileStructure()
+		self.cache = OptimizeCache( self.path_cache )
+		self.geocoder = GeoLookup( '%s/%s' % (self.path_data, 'geocache.json') )
+		self.catalog = SessionCatalog( '%s/%s' % (self.path_data, 'catalog.db') )
 
 	def __repr__( self ):
 		return '<%s uploaded="%d" ignored="%d">' % (
@@ -62,13 +79,14 @@ class WAODirector:
 		)
 
 	def setFlag( self, attr, value ):
-		if setattr(self, attr, value):
-			return True
+		setattr(self, attr, value)
+		self.catalog.setValue(attr, value)
 
 	def reset( self ):
 		# empty all asset objects
 		self.uploaded.clear()
 		self.invalid.clear()
+		self.catalog.clear()
 		# reset index to initial
 		self.index = 0
 		self.is_download = False
@@ -84,8 +102,64 @@ class WAODirector:
 		FileFactory.makeDir(self.path_upload)
 		FileFactory.makeDir(self.path_optmze)
 		FileFactory.makeDir(self.path_geotag)
+		FileFactory.makeDir(self.path_variants)
 		return True
 
+	def resumeSession( self ):
+		''' reload the assets of the last session from the catalog, returns how many;
+			assets whose imported file is gone are dropped, assets whose stage output
+			is gone restart from the imported file '''
+		assets, dropped, restarted = [], [], []
+		for record in self.catalog.load():
+			if not os.path.exists( record['file_source'] ):
+				dropped.append( record['id'] )
+				continue
+			asset = Asset.fromRecord( record )
+			if not os.path.exists( asset.active_file ):
+				asset.setActiveSrc( *os.path.split(asset.file_source) )
+				asset.is_optimized = asset.is_geotagged = False
+				asset.outputs = None
+				restarted.append( asset )
+			assets.append( asset )
+		self.uploaded.extend( assets )
+		self.catalog.remove( dropped )
+		self.catalog.saveMany( restarted )
+		self.index = max( [ asset.index + 1 for asset in assets ] or [0] )
+		self.is_download = self.catalog.getValue( 'is_download', False )
+		return len(assets)
+
+	def saveSession( self ):
+		''' commit the queued catalog writes '''
+		return self.catalog.flush()
+
+	def saveMetrics( self, path=None ):
+		''' flush the log and write the span/counter totals (Prometheus text format) '''
+		Logger.flush()
+		return Logger.writeMetrics( path or self.path_metrics )
+
+	def findAssets( self, **filters ):
+		''' assets matching the catalog filters (see SessionCatalog.findIds),
+			e.g. findAssets(ext='png', is_geotagged=False, min_bytes=1024**2) '''
+		return [ self.uploaded.getById(aid) for aid in self.catalog.findIds(**filters) ]
+
+	def getUnfinished( self, images, stage, options ):
+		''' the images without a current output of a stage ran with the same options '''
+		flag = {'optimize': 'is_optimized', 'geotag': 'is_geotagged'}[stage]
+		todo = []
+		for asset in images:
+			output = asset.getOutput(stage)
+			is_done = getattr(asset, flag) and output and output['options'] == _getJSONSafe(options)
+			# geotagging rewrites the active file, re-optimizing replaces it
+			if is_done and stage == 'geotag':
+				is_done = output['file'] == asset.active_file
+			if not is_done or not os.path.exists( output['file'] ):
+				todo.append(asset)
+		return todo
+
+	def getStagePaths( self ):
+		''' the per-session folders, cleared on reset (data and cache persist) '''
+		return [ self.path_ignore, self.path_upload, self.path_optmze, self.path_geotag, self.path_variants ]
+
 	def getFileFilteredAssets( self, kind ):
 		'''grab a list of file extensions to filter in a QFileDialog'''
 		ogkind = kind
@@ -101,44 +175,490 @@ class WAODirector:
 		filefilter += ');;'
 		return str(filefilter)
 
-	def importAsset( self, path_from, filename ):
-		# check file valid
-		if self.validateAsset( filename ):
-			# add the upload file to a list of uploads to manipulate
-			aObj = Asset(self.index, filename, path_from, self.path_upload)
-			self.uploaded.append( aObj )
-			self.index += 1
-		else:
-			# add the invalid file to a list of uploads to ignore
-			aObj = Asset(-1, filename, path_from, self.path_ignore )
-			self.invalid.append( aObj )
+	def importAsset( self, path_from, filename, st=None ):
+		with Logger.span( 'import', files=1 ) as span:
+			# check file valid
+			if self.validateAsset( filename ):
+				# add the upload file to a list of uploads to manipulate
+				aObj = Asset(self.index, filename, path_from, self.path_upload, st, self._getUploadFolder( path_from, filename ), self.dedupe)
+				self.index += 1
+				registered, duplicates = self._registerAssets( [aObj] )
+				self.catalog.saveMany( registered )
+				Logger.count( 'files', len(registered), stage='import' )
+				if not registered:
+					span.set( ignored=filename )
+					Logger.count( 'files_ignored', stage='import' )
+			else:
+				# record the invalid file in a list of uploads to ignore (not copied)
+				aObj = Asset(-1, filename, path_from, None, st)
+				self.invalid.append( aObj )
+				span.set( ignored=filename )
+				Logger.count( 'files_ignored', stage='import' )
+
+	def importFiles( self, files, progress=None, cancel=None, root=None ):
+		''' import file paths (or os.DirEntry objects) as they come, in batches that
+			grow up to IMPORT_BATCH; progress(None, imported, 0) runs after each batch,
+			returns the number of assets imported; files under root are staged in
+			their sub-folder of it (see _getUploadFolder) '''
+		batch, size, done = [], constants.IMPORT_FIRST_BATCH, 0
+		for item in files:
+			if cancel is not None and cancel.is_set():
+				break
+			batch.append( item )
+			if len(batch) >= size:
+				done += self._importBatch( batch, root )
+				batch, size = [], min(size * 2, constants.IMPORT_BATCH)
+				if progress:
+					progress( None, done, 0 )
+		if batch:
+			done += self._importBatch( batch, root )
+			if progress:
+				progress( None, done, 0 )
+		return done
+
+	def importFolder( self, folder, progress=None, cancel=None ):
+		''' import every file under a folder and its sub-folders, streamed from the walk '''
+		return self.importFiles( FileFactory.scanFiles(folder), progress=progress, cancel=cancel, root=folder )
+
+	def _importBatch( self, items, root=None ):
+		''' import a batch, registered and cataloged together, reusing the
+			directory entry's stat '''
+		assets, ignored = [], 0
+		with Logger.span( 'import', files=len(items) ) as span:
+			for item in items:
+				path_from, filename = os.path.split( os.fspath(item) )
+				st = item.stat() if isinstance(item, os.DirEntry) else None
+				if self.validateAsset( filename ):
+					assets.append( Asset(self.index, filename, path_from, self.path_upload, st, self._getUploadFolder( path_from, filename, root ), self.dedupe) )
+					self.index += 1
+				else:
+					self.invalid.append( Asset(-1, filename, path_from, None, st) )
+					ignored += 1
+			registered, duplicates = self._registerAssets( assets )
+			ignored += len(assets) - len(registered)
+			assets = registered
+			self.catalog.saveMany( assets )
+			span.set( imported=len(assets), ignored=ignored, duplicates=duplicates )
+		Logger.count( 'files', len(assets), stage='import' )
+		Logger.count( 'files_ignored', ignored, stage='import' )
+		return len(assets)
+
+	def _getUploadFolder( self, path_from, filename, root=None ):
+		''' the sub-folder a file gets staged in (its Asset.path_rel): the folder it
+			came from under root, or a folder named after its id when a file of the
+			same name is staged there already (same name from another folder, or the
+			same file imported twice) '''
+		path_rel = os.path.relpath( path_from, root ) if root else ''
+		if path_rel in ('', '.') or path_rel.startswith('..'):
+			path_rel = ''
+		if os.path.lexists( os.path.join(self.path_upload, path_rel, filename) ):
+			path_rel = os.path.join( path_rel, str(self.index) )
+		return path_rel
+
+	def _registerAssets( self, assets ):
+		''' add newly imported assets to the session; with dedupe their originals are
+			hashed first (the copied ones as they were copied, the linked ones in
+			parallel here) and an exact copy of an earlier asset records its id in
+			duplicate_of (it gets processed along with it), with perceptual_hash a
+			near copy records the closest one in similar_to; an original that cannot
+			be read is ignored like an unsupported file; returns (registered assets,
+			number of exact duplicates) '''
+		if not self.dedupe:
+			self.uploaded.extend( assets )
+			return assets, 0
+		pool = TaskPool( self.workers )
+		failed = [ result for result in pool.map( _hashAsset, [ asset for asset in assets if asset.content_hash is None ] ) if not result.ok ]
+		if failed:
+			self._ignoreAssets( failed )
+			dropped = set( result.asset.index for result in failed )
+			assets = [ asset for asset in assets if asset.index not in dropped ]
+		unique, seen = [], {}
+		for asset in assets:
+			copies = self.uploaded.getByHash( asset.content_hash ) or seen.get( asset.content_hash )
+			if copies:
+				first = copies[0]
+				asset.duplicate_of = first.index if first.duplicate_of is None else first.duplicate_of
+			else:
+				seen[asset.content_hash] = [asset]
+				unique.append( asset )
+		if self.perceptual_hash:
+			pool.map( _hashAsset, unique, True )
+		for asset in assets:
+			if self.perceptual_hash and asset.duplicate_of is None:
+				similar = self.uploaded.getSimilar( asset.phash )
+				if similar:
+					asset.similar_to = similar[0].index
+					Logger.count( 'files_similar', stage='import' )
+			self.uploaded.add( asset )
+		duplicates = len(assets) - len(unique)
+		Logger.count( 'files_duplicate', duplicates, stage='import' )
+		return assets, duplicates
+
+	def _ignoreAssets( self, results ):
+		''' imported assets whose task failed (e.g. an unreadable original) go to the
+			ignored files, their staged link is deleted '''
+		for result in results:
+			asset = result.asset
+			Logger.event( 'error', action='import', file=asset.file_origin, error=str(result.error) )
+			if asset.file_source.startswith(self.upload_root + '/') and os.path.lexists(asset.file_source):
+				os.remove( asset.file_source )
+			self.invalid.append( asset )
+		return True
 
 	def validateAsset( self, filename ):
 		''' make sure the file extension is an allowed media type '''
 		f_ext = filename.split('.')[-1].lower()
-		is_valid = False
 		# only images for now
-		if f_ext in constants.MEDIATYPES['image']:
-			is_valid = True
-		# return validation
-		return is_valid
+		return constants.FILETYPES.get(f_ext) == 'image'
 
 	def getAssetByIndex( self, index ):
 		''' return the asset object with same the given index '''
-		for item in self.uploaded:
-			if item.index == int(index):
-				return item
+		return self.uploaded.getById( index )
 
-	def optimizeImages( self, images, options ):
-		# loop all images
+	def removeAssets( self, assets ):
+		''' drop assets from the session, their staged files stay until reset '''
+		assets = list(assets)
+		self.catalog.remove( asset.index for asset in assets )
+		return self.uploaded.remove( assets )
+
+	def stageAssets( self, images, path_to, app_str, from_origin=False ):
+		''' link each asset's active file into a stage folder and make the link active;
+			an asset re-run through the same stage (its active file is that stage's
+			output) is linked from its optimized file, or its original '''
 		for asset in images:
-			if asset.optimizeImage(options):
-				asset.setFlag('is_optimized', True)
+			path_stage = asset.getStagePath( path_to )
+			# restart from the original upload
+			if from_origin:
+				asset.setActiveSrc( *os.path.split(asset.file_source) )
+			# never from the stage's own output, it would link onto itself
+			elif os.path.dirname( asset.getActiveFile() ) == path_stage:
+				output = asset.getOutput('optimize')
+				file_from = output['file'] if output and os.path.exists(output['file']) else asset.file_source
+				asset.setActiveSrc( *os.path.split(file_from) )
+			path_from, cur_name = os.path.split( asset.getActiveFile() )
+			FileFactory.linkFileFromTo( cur_name, path_from, path_stage )
+			new_name = FileFactory.renameFileAppendTo( path_stage, cur_name, app_str )
+			asset.setActiveSrc( path_stage, new_name )
+			self.catalog.save( asset )
+		self.catalog.flush()
 		return True
 
-	def geotagImages( self, images, options ):
-		# loop all images
+	def packageAssets( self, path_zip_to, filename='WebOptimizedAssets', progress=None, cancel=None ):
+		''' ZIP the final file of every uploaded asset into path_zip_to, with the
+			srcset variants, WebP/AVIF copies and their manifest when there are any;
+			each asset's files go in its staged sub-folder (see _getUploadFolder) '''
+		files, has_variants = [], False
+		for asset in self.uploaded:
+			variants = self.getVariantFiles( [asset] )
+			has_variants = has_variants or bool(variants)
+			files += [ (file, os.path.join(asset.path_rel, os.path.basename(file))) for file in [ asset.getActiveFile() ] + variants ]
+		if has_variants:
+			files.append( self.writeVariantManifest() )
+		return FileFactory.makeZipFile( files, path_zip_to, filename, progress=progress, cancel=cancel )
+
+	def optimizeImages( self, images, options, workers=None, use_cache=True, progress=None, cancel=None ):
+		''' optimize images in parallel, returns a TaskResult per asset;
+			progress(result, done, total) runs as each asset finishes;
+			options['variants'] (widths) also writes each image's srcset ladder and
+			options['formats'] (e.g. ['webp', 'avif']) its smaller modern format
+			copies, all encoded in parallel, then the variants manifest;
+			options['batch_target'] shares a byte budget out over the images;
+			exact duplicates are optimized once, see _mapUnique '''
+		def flag( result ):
+			self._setResultFlag( result, 'is_optimized', 'optimize', options )
+		workers = workers or self.workers
+		pool = TaskPool( workers )
+		targets = self.getTargets( images, options ) if options.get('batch_target') else None
+		if options.get('variants') or options.get('formats'):
+			with ThreadPoolExecutor( max_workers=workers ) as encoder:
+				results = self._mapUnique( pool, 'optimize', _optimizeAsset, images, options, None, self.path_variants, encoder, targets, flag=flag, progress=progress, cancel=cancel )
+			self.writeVariantManifest()
+		else:
+			results = self._mapUnique( pool, 'optimize', _optimizeAsset, images, options, self.cache if use_cache else None, None, None, targets, flag=flag, progress=progress, cancel=cancel )
+		self.catalog.flush()
+		Logger.flush()
+		return results
+
+	def getTargets( self, images, options ):
+		''' per batch target size mode: options['batch_target'] bytes shared out over
+			the images, returns {asset index: target bytes}; files that are not
+			re-encoded as JPEGs count at their current size, the JPEGs split the
+			rest by their output area (capped by options['target'] when given), but
+			never below TARGET_MIN_PIXEL_BYTES per pixel: a batch too small for that
+			is logged as a missed batch target (the 'batch_target_missed' counter) '''
+		budget, areas = options['batch_target'], {}
+		for asset in images:
+			if asset.ext.lower() not in ('jpg', 'jpeg'):
+				budget -= os.path.getsize( asset.getActiveFile() )
+				continue
+			width, height = asset.probeImage()['size']
+			scale = min( 1.0, options['width'] / width, options['height'] / height )
+			areas[asset.index] = width * height * scale * scale
+		total = sum(areas.values())
+		targets = {}
+		for index, area in areas.items():
+			floor = int(math.ceil( area * constants.TARGET_MIN_PIXEL_BYTES ))
+			targets[index] = max( floor, int(budget * area / total) ) if total else floor
+			if options.get('target'):
+				targets[index] = min( targets[index], options['target'] )
+		needed = options['batch_target'] - budget + sum(targets.values())
+		if needed > options['batch_target']:
+			Logger.event( 'batch_target', action='missed', target=options['batch_target'], needed=needed, files=len(images) )
+			Logger.count( 'batch_target_missed', stage='optimize' )
+		return targets
+
+	def getVariantFiles( self, assets=None ):
+		''' the srcset variant and format files of the uploaded assets (or the given ones) '''
+		files = []
+		for asset in self.uploaded if assets is None else assets:
+			for stage in ('variants', 'formats'):
+				output = asset.getOutput(stage)
+				if output:
+					path_from = asset.getStagePath( self.path_variants )
+					files += [ '%s/%s' % (path_from, variant['file']) for variant in output['files'] ]
+		return files
+
+	def getManifestEntry( self, asset ):
+		''' an asset's variants manifest entry: optimized file, srcset string and rungs,
+			and the modern format copies kept (smallest first); None without any '''
+		variants, formats = asset.getOutput('variants'), asset.getOutput('formats')
+		if not variants and not formats:
+			return None
+		entry = { 'src': os.path.basename( asset.getActiveFile() ) }
+		if variants:
+			entry['srcset'] = ', '.join( '%s %dw' % (variant['file'], variant['width']) for variant in variants['files'] )
+			entry['variants'] = variants['files']
+		if formats:
+			entry['formats'] = sorted( formats['files'], key=lambda item: item['bytes'] )
+		return entry
+
+	def writeVariantManifest( self ):
+		''' write the variants manifest (variants/manifest.json) of the uploaded assets,
+			original name (under its staged sub-folder) -> manifest entry (see
+			getManifestEntry); returns its path '''
+		manifest = {}
+		for asset in self.uploaded:
+			entry = self.getManifestEntry( asset )
+			if entry:
+				manifest[ os.path.join(asset.path_rel, asset.name_origin) ] = entry
+		path_manifest = '%s/%s' % (self.path_variants, 'manifest.json')
+		with open(path_manifest, 'w') as f:
+			json.dump( manifest, f, indent=1 )
+		return path_manifest
+
+	def exportAssets( self, assets, path_to, relative_to=None ):
+		''' link the final file, srcset variants and format copies of each asset into
+			path_to, in the sub-folder its original came from under relative_to;
+			their manifest entries are merged into path_to/manifest.json (keyed by
+			that relative path); returns the exported files '''
+		files, manifest = [], {}
+		for asset in assets:
+			folder = path_to
+			if relative_to:
+				folder = os.path.normpath( os.path.join(path_to, os.path.relpath(asset.path_src, relative_to)) )
+			os.makedirs( folder, exist_ok=True )
+			for file_from in [ asset.getActiveFile() ] + self.getVariantFiles( [asset] ):
+				files.append( FileFactory.linkFile( file_from, os.path.join(folder, os.path.basename(file_from)) ) )
+			entry = self.getManifestEntry( asset )
+			if entry:
+				manifest[ os.path.relpath(os.path.join(folder, asset.name_origin), path_to) ] = entry
+		if manifest:
+			path_manifest = os.path.join( path_to, 'manifest.json' )
+			if os.path.exists(path_manifest):
+				with open(path_manifest) as f:
+					manifest = dict( json.load(f), **manifest )
+			with open('%s.tmp' % path_manifest, 'w') as f:
+				json.dump( manifest, f, indent=1 )
+			os.replace( '%s.tmp' % path_manifest, path_manifest )
+		return files
+
+	def releaseAssets( self, assets ):
+		''' drop finished (exported) assets from the session and delete their staged
+			files: the imported link, the stage outputs, variants and format copies;
+			watch mode releases every batch, so weeks of it leave nothing behind '''
+		assets, folders = list(assets), set()
+		for asset in assets:
+			files = set( [asset.file_source, asset.getActiveFile()] + self.getVariantFiles([asset]) )
+			for output in (asset.outputs or {}).values():
+				if output.get('file'):
+					files.add( output['file'] )
+			# only the session's own copies, never an original
+			for file in files:
+				if file.startswith(self.upload_root + '/') and os.path.lexists(file):
+					os.remove( file )
+					folders.add( os.path.dirname(file) )
+		# and the staged sub-folders left empty
+		stage_paths = set( self.getStagePaths() )
+		for folder in sorted( folders, reverse=True ):
+			while folder.startswith(self.upload_root + '/') and folder not in stage_paths:
+				try:
+					os.rmdir( folder )
+				except OSError:
+					break
+				folder = os.path.dirname( folder )
+		return self.removeAssets( assets )
+
+	def geotagImages( self, images, options, workers=None, progress=None, cancel=None ):
+		''' geotag images in parallel, returns a TaskResult per asset '''
+		def flag( result ):
+			self._setResultFlag( result, 'is_geotagged', 'geotag', options )
+		pool = TaskPool( workers or self.workers )
+		results = self._mapUnique( pool, 'geotag', _geotagAsset, images, options, flag=flag, progress=progress, cancel=cancel )
+		self.catalog.flush()
+		Logger.flush()
+		return results
+
+	def processImages( self, images, options, geo_options, workers=None, progress=None, cancel=None ):
+		''' pipeline mode: optimize + geotag each image in one pass, writing only its
+			final file into the geotagged folder, returns a TaskResult per asset '''
+		def flag( result ):
+			self._setResultFlag( result, 'is_optimized', 'optimize', options )
+			self._setResultFlag( result, 'is_geotagged', 'geotag', geo_options )
+		workers = workers or self.workers
+		pool = TaskPool( workers )
+		targets = self.getTargets( images, options ) if options.get('batch_target') else None
+		with ThreadPoolExecutor( max_workers=workers ) as encoder:
+			results = self._mapUnique( pool, 'process', _processAsset, images, options, geo_options, self.path_geotag, self.path_variants, encoder, targets, flag=flag, progress=progress, cancel=cancel )
+		if options.get('variants') or options.get('formats'):
+			self.writeVariantManifest()
+		self.catalog.flush()
+		Logger.flush()
+		return results
+
+	def _mapUnique( self, pool, stage, task, images, *args, flag=None, progress=None, cancel=None ):
+		''' pool.map(task, images, *args) with a single job per distinct input: exact
+			duplicates (duplicate_of, with a stage input of the same size) ride on the
+			job of the first of them in images and get its outputs linked under their
+			own names as it finishes; flag(result) runs for every result before
+			progress(result, done, total), returns a TaskResult per image in order '''
+		grouped = set( asset.duplicate_of for asset in images if asset.duplicate_of is not None )
+		jobs, riders, leaders = [], {}, {}
 		for asset in images:
-			if GeoTags.tagAssetWithCoords(GeoTags, asset, options['lat'], options['long']):
-				asset.setFlag('is_geotagged', True)
+			primary = asset.index if asset.duplicate_of is None else asset.duplicate_of
+			if primary not in grouped:
+				jobs.append( asset )
+				continue
+			key = (primary, os.path.getsize( asset.getActiveFile() ))
+			if key in leaders:
+				riders.setdefault( leaders[key].index, [] ).append( asset )
+			else:
+				leaders[key] = asset
+				jobs.append( asset )
+		results, total = {}, len(images)
+		def finished( result, done, count ):
+			# the job's own result is flagged before its outputs are fanned out
+			for rider in [None] + riders.get( result.asset.index, [] ):
+				each = result if rider is None else self._fanOut( result, rider )
+				if flag:
+					flag( each )
+				results[each.asset.index] = each
+				if progress:
+					progress( each, len(results), total )
+		pool.map( task, jobs, *args, progress=finished, cancel=cancel )
+		if len(jobs) < total:
+			Logger.count( 'files_deduped', total - len(jobs), stage=stage )
+		return [ results[asset.index] for asset in images ]
+
+	def _fanOut( self, result, asset ):
+		''' the TaskResult of an exact duplicate riding on result's job: the job's
+			stage output, srcset variants and format copies linked under its own name '''
+		if not result.ok:
+			return TaskResult( asset, False, result.value, result.error )
+		leader = result.asset
+		path_from, name_from = os.path.split( leader.getActiveFile() )
+		# the same stage folder, in the asset's own sub-folder
+		path_to = asset.getStagePath( _getStageRoot(leader, path_from) )
+		new_name = _getCopyName( leader, asset, name_from )
+		# the staged input gets replaced (it may have another extension), the
+		# imported file never
+		old_file = asset.getActiveFile()
+		if os.path.dirname(old_file) == path_to and old_file != asset.file_source and os.path.basename(old_file) != new_name:
+			os.remove( old_file )
+		FileFactory.linkFile( leader.getActiveFile(), '%s/%s' % (path_to, new_name) )
+		asset.setActiveSrc( path_to, new_name )
+		variants_from, variants_to = leader.getStagePath( self.path_variants ), asset.getStagePath( self.path_variants )
+		for stage in ('variants', 'formats'):
+			output = leader.getOutput(stage)
+			if not output:
+				continue
+			files = []
+			for item in output['files']:
+				name = _getCopyName( leader, asset, item['file'] )
+				FileFactory.linkFile( '%s/%s' % (variants_from, item['file']), '%s/%s' % (variants_to, name) )
+				files.append( dict(item, file=name) )
+			asset.setOutput( stage, dict(output, files=files) )
+		return TaskResult( asset, True, result.value )
+
+	def _setResultFlag( self, result, attr, stage, options ):
+		''' cancelled assets keep their flag, the others take their outcome;
+			the stage output is recorded in the catalog '''
+		if result.isCancelled():
+			return False
+		asset = result.asset
+		asset.setFlag( attr, result.ok )
+		if result.ok:
+			asset.setOutput( stage, {'file': asset.getActiveFile(), 'options': _getJSONSafe(options)} )
+		else:
+			asset.setOutput( stage, None )
+		# a new optimized file still needs its geotag, and has no ladder or format
+		# copies unless asked for
+		if stage == 'optimize':
+			asset.setOutput( 'geotag', None )
+			for output in ('variants', 'formats'):
+				if not result.ok or not options.get(output):
+					asset.setOutput( output, None )
+		self.catalog.save( asset )
+		return True
+
+def _getJSONSafe( options ):
+	''' options as they read back from the catalog (tuples become lists) '''
+	return json.loads( json.dumps(options, sort_keys=True, default=str) )
+
+def _getCopyName( leader, asset, name ):
+	''' a file named after the leader's original, renamed after the asset's '''
+	stem_from = leader.name_origin.rsplit('.', 1)[0]
+	stem_to = asset.name_origin.rsplit('.', 1)[0]
+	if name.startswith(stem_from):
+		return stem_to + name[len(stem_from):]
+	return '%s_%s' % (stem_to, name)
+
+def _getStageRoot( asset, folder ):
+	''' the stage folder holding folder, the asset's path_rel sub-folder of it '''
+	if asset.path_rel and folder.endswith( '/' + asset.path_rel ):
+		return folder[:-len(asset.path_rel) - 1]
+	return folder
+
+def _hashAsset( asset, perceptual=False ):
+	''' pool task: the content (or perceptual) hash of a single asset's original '''
+	return asset.getPerceptualHash() if perceptual else asset.getContentHash()
+
+def _optimizeAsset( asset, options, cache=None, path_variants=None, encoder=None, targets=None ):
+	''' pool task: optimize a single asset, served from the cache when possible;
+		targets holds the per asset byte budgets of the batch target size mode '''
+	if targets and asset.index in targets:
+		options = dict(options, target=targets[asset.index])
+	if cache is None:
+		return asset.optimizeImage( options, path_variants, encoder )
+	file_path = asset.getActiveFile()
+	key = cache.getKey( file_path, options )
+	cached_path = cache.fetch( key, file_path )
+	if cached_path:
+		# the cached output may have another extension (big PNG -> JPG)
+		if cached_path != file_path:
+			os.remove( file_path )
+			asset.setActiveSrc( *os.path.split(cached_path) )
+		return True
+	if asset.optimizeImage(options):
+		cache.store( key, asset.getActiveFile() )
 		return True
+	return False
+
+def _processAsset( asset, options, geo_options, path_to, path_variants=None, encoder=None, targets=None ):
+	''' pool task: optimize + geotag a single asset in one pass '''
+	if targets and asset.index in targets:
+		options = dict(options, target=targets[asset.index])
+	return asset.processImage( options, geo_options['lat'], geo_options['long'], path_to, path_variants=path_variants, encoder=encoder )
+
+def _geotagAsset( asset, options ):
+	''' pool task: geotag a single asset '''
+	return GeoTags.tagAssetWithCoords(GeoTags, asset, options['lat'], options['long'])
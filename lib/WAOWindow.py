@@ -5,20 +5,18 @@ VIEW: manages the UI window display:
 3. receives formatted data from WAODirector
 4. returns/displays a response to the UI
 '''
-import sys, os
+import sys, os, time, threading
 from screeninfo import get_monitors
-from pathlib2 import Path
-from tr import tr
 from PyQt5 import QtCore
 from PyQt5 import QtWidgets as qtw
 try:
 	import constants
 	from FileFactory import FileFactory
-	from MetaTagFactory import MetaTags, GeoTags
+	from MetaTagFactory import MetaTags
 except:
 	from . import constants
 	from .FileFactory import FileFactory
-	from .MetaTagFactory import MetaTags, GeoTags
+	from .MetaTagFactory import MetaTags
 
 def open( WAObj ):
 	WAOApp = qtw.QApplication(sys.argv)
@@ -29,6 +27,119 @@ def open( WAObj ):
 		WAOApp.resetUI(exit=True)
 		sys.exit(WAOApp)
 
+class JobSignals(QtCore.QObject):
+	''' carries a job's progress and outcome from the thread pool to the ui thread '''
+	progress = QtCore.pyqtSignal(object, int, int)
+	finished = QtCore.pyqtSignal(object)
+	failed = QtCore.pyqtSignal(str)
+
+class Job(QtCore.QRunnable):
+	''' runs a WAODirector action on the QThreadPool, the action gets progress and
+		cancel keyword arguments (see TaskPool.map) '''
+	def __init__( self, action, *args ):
+		super().__init__()
+		self.action = action
+		self.args = args
+		self.signals = JobSignals()
+		self.cancel = threading.Event()
+		self.started = time.monotonic()
+
+	def run( self ):
+		self.started = time.monotonic()
+		try:
+			value = self.action( *self.args, progress=self._progress, cancel=self.cancel )
+		except Exception as e:
+			self.signals.failed.emit( str(e) )
+			return
+		self.signals.finished.emit( value )
+
+	def _progress( self, result, done, total ):
+		self.signals.progress.emit( result, done, total )
+
+class AssetTableModel(QtCore.QAbstractTableModel):
+	''' read-only table over the director's uploaded assets; rows are only
+		rendered when visible, and refresh() signals just the rows that changed '''
+	headers = "ID;file name;optmized;geotagged;duplicate".split(";")
+
+	def __init__( self, assets, parent=None ):
+		super().__init__(parent)
+		self.assets = assets
+		# last rendered (name, is_opt, is_geo, duplicate) of every row
+		self.states = []
+		self.refresh()
+
+	def rowCount( self, parent=QtCore.QModelIndex() ):
+		return 0 if parent.isValid() else len(self.states)
+
+	def columnCount( self, parent=QtCore.QModelIndex() ):
+		return 0 if parent.isValid() else len(self.headers)
+
+	def headerData( self, section, orientation, role=QtCore.Qt.DisplayRole ):
+		if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+			return self.headers[section]
+		return None
+
+	def data( self, index, role=QtCore.Qt.DisplayRole ):
+		if not index.isValid():
+			return None
+		column = index.column()
+		if role == QtCore.Qt.TextAlignmentRole and column > 1:
+			return QtCore.Qt.AlignCenter
+		if role != QtCore.Qt.DisplayRole:
+			return None
+		asset = self.assets[index.row()]
+		if column == 0:
+			return str(asset.index)
+		if column == 1:
+			return asset.name
+		if column == 2:
+			return '☑' if asset.is_optimized else '☐'
+		if column == 3:
+			return '☑' if asset.is_geotagged else '☐'
+		# '= id' exact copy (processed along with it), '≈ id' near copy
+		return asset.getDuplicateLabel()
+
+	def getAsset( self, row ):
+		return self.assets[row]
+
+	def getRow( self, asset ):
+		return self.assets.getRow(asset)
+
+	def refresh( self, changed=() ):
+		''' pick up added/removed assets, then re-render the rows of the changed
+			assets (a finished job's TaskResult assets) that differ '''
+		count, known = len(self.assets), len(self.states)
+		if count < known:
+			self.beginRemoveRows(QtCore.QModelIndex(), count, known - 1)
+			del self.states[count:]
+			self.endRemoveRows()
+		for asset in changed:
+			self.refreshAsset( asset )
+		if count > known:
+			self.beginInsertRows(QtCore.QModelIndex(), known, count - 1)
+			self.states.extend( self._getState(asset) for asset in self.assets[known:count] )
+			self.endInsertRows()
+		return True
+
+	def refreshAsset( self, asset ):
+		''' re-render a single asset's row if it changed '''
+		row = self.getRow(asset)
+		state = self._getState(asset)
+		if row < len(self.states) and state != self.states[row]:
+			self.states[row] = state
+			self._emitChanged(row, row)
+		return True
+
+	def _emitChanged( self, first, last ):
+		self.dataChanged.emit( self.index(first, 0), self.index(last, len(self.headers) - 1) )
+
+	def _getState( self, asset ):
+		return (asset.name, asset.is_optimized, asset.is_geotagged, asset.getDuplicateLabel())
+
+class GeoSignals(QtCore.QObject):
+	''' carries geocoding results from the lookup thread to the ui thread '''
+	found = QtCore.pyqtSignal(str, object)
+
 class WAOWindow(qtw.QWidget):
 	
 	def __init__( self, assets=None ):
@@ -41,6 +152,9 @@ class WAOWindow(qtw.QWidget):
 		self.top = (self.m.height/2-self.height/2)
 		self.wao = assets
 		self.initLoader()
+		# a resumed session goes straight to its assets
+		if len(self.wao.uploaded):
+			self.initUI()
 
 	def initLoader( self ):
 		self.wao.buildFileStructure()
@@ -75,18 +189,20 @@ class WAOWindow(qtw.QWidget):
 		self.container_grid.setColumnStretch(1,1)
 		self.container.setLayout( self.container_grid )
 		# upload list
-		self.table = qtw.QTableWidget()
+		self.table_model = AssetTableModel( self.wao.uploaded )
+		self.table = qtw.QTableView()
+		self.table.setModel( self.table_model )
 		self.table.setSelectionBehavior(qtw.QTableView.SelectRows)
-		self.table.setRowCount( len(self.wao.uploaded) )
-		self.table.setColumnCount( len(self.wao.uploaded[0].getDict()) )
-		self.table.setHorizontalHeaderLabels("ID;file name;optmized;geotagged".split(";"))
-		self.table.horizontalHeader().setSectionResizeMode(0, qtw.QHeaderView.ResizeToContents)
+		# fixed row heights and header sizes, so nothing measures every row
+		self.table.verticalHeader().setSectionResizeMode(qtw.QHeaderView.Fixed)
+		self.table.horizontalHeader().setSectionResizeMode(0, qtw.QHeaderView.Interactive)
 		self.table.horizontalHeader().setSectionResizeMode(1, qtw.QHeaderView.Stretch)
-		self.table.horizontalHeader().setSectionResizeMode(2, qtw.QHeaderView.ResizeToContents)
-		self.table.horizontalHeader().setSectionResizeMode(3, qtw.QHeaderView.ResizeToContents)
+		self.table.horizontalHeader().setSectionResizeMode(2, qtw.QHeaderView.Interactive)
+		self.table.horizontalHeader().setSectionResizeMode(3, qtw.QHeaderView.Interactive)
+		self.table.horizontalHeader().setSectionResizeMode(4, qtw.QHeaderView.Interactive)
+		self.table.resizeColumnsToContents()
 		self.table.horizontalHeader().setStretchLastSection(False)
 		self.table.verticalHeader().setVisible(False)
-		self._setUploadedTableItems( self.wao.uploaded )
 		# controls
 		self.btn_view_meta = qtw.QPushButton('View Images Metadata')
 		self.img_dimensions_label = qtw.QLabel('Image Resize:')
@@ -98,6 +214,14 @@ class WAOWindow(qtw.QWidget):
 		self.img_qlty_input = qtw.QLineEdit(self)
 		self.num_colors_label = qtw.QLabel('Number of Colors:')
 		self.num_colors_input = qtw.QLineEdit(self)
+		self.srcset_label = qtw.QLabel('srcset Widths:')
+		self.srcset_input = qtw.QLineEdit(self)
+		self.preset_label = qtw.QLabel('Speed Preset:')
+		self.preset_input = qtw.QComboBox(self)
+		self.formats_label = qtw.QLabel('Extra Formats:')
+		self.formats_input = qtw.QLineEdit(self)
+		self.target_label = qtw.QLabel('Target Size:')
+		self.target_input = qtw.QLineEdit(self)
 		self.btn_optimize = qtw.QPushButton('Optimize Images')
 		self.geolocation_label = qtw.QLabel('Geo Tagging:')
 		self.geo_address_label = qtw.QLabel('Address Lookup:')
@@ -108,17 +232,25 @@ class WAOWindow(qtw.QWidget):
 		self.geo_longitude_label = qtw.QLabel('Longitude:')
 		self.geo_longitude_input = qtw.QLineEdit(self)
 		self.btn_geotag = qtw.QPushButton('GeoTag Images')
+		self.btn_process = qtw.QPushButton('Optimize + GeoTag Images')
 		self.btn_download = qtw.QPushButton('Download Package')
 		self.btn_reset = qtw.QPushButton('Reset WAO / Start Fresh!')
+		self.job_bar = qtw.QProgressBar()
+		self.job_label = qtw.QLabel('')
+		self.btn_cancel = qtw.QPushButton('Cancel')
+		self.btn_cancel.setEnabled(False)
+		self.job = None
 		# connect actions
 		self.btn_view_meta.clicked.connect(self.openViewMetaData)
 		self.btn_optimize.clicked.connect(self.runOptimizeSelected)
 		self.geo_address_lookup_btn.clicked.connect(self.lookupGeoCoords)
 		self.btn_geotag.clicked.connect(self.runGeotagSelected)
+		self.btn_process.clicked.connect(self.runProcessSelected)
 		self.btn_download.clicked.connect(self.runDownloadPackage)
 		self.btn_reset.clicked.connect(self.resetUI)
+		self.btn_cancel.clicked.connect(self.cancelJob)
 		# add inputs to layout
-		self.container.layout().addWidget(self.table,0,0,15,1)
+		self.container.layout().addWidget(self.table,0,0,20,1)
 		self.container.layout().addWidget(self.btn_view_meta,0,1,1,1)
 		self.container.layout().addWidget(self.img_dimensions_label,1,1,1,1)
 		self.container.layout().addWidget(self.img_width_label,2,1,1,1)
@@ -129,52 +261,70 @@ class WAOWindow(qtw.QWidget):
 		self.container.layout().addWidget(self.img_qlty_input,4,1,1,1)
 		self.container.layout().addWidget(self.num_colors_label,5,1,1,1)
 		self.container.layout().addWidget(self.num_colors_input,5,1,1,1)
-		self.container.layout().addWidget(self.btn_optimize,6,1,1,1)
-		self.container.layout().addWidget(self.geolocation_label,7,1,1,1)
-		self.container.layout().addWidget(self.geo_address_label,8,1,1,1)
-		self.container.layout().addWidget(self.geo_address_input,8,1,1,1)
-		self.container.layout().addWidget(self.geo_address_lookup_btn,9,1,1,1)
-		self.container.layout().addWidget(self.geo_latitude_label,10,1,1,1)
-		self.container.layout().addWidget(self.geo_latitude_input,10,1,1,1)
-		self.container.layout().addWidget(self.geo_longitude_label,11,1,1,1)
-		self.container.layout().addWidget(self.geo_longitude_input,11,1,1,1)
-		self.container.layout().addWidget(self.btn_geotag,12,1,1,1)
-		self.container.layout().addWidget(self.btn_download,13,1,1,1)
-		self.container.layout().addWidget(self.btn_reset,14,1,1,1)
+		self.container.layout().addWidget(self.srcset_label,6,1,1,1)
+		self.container.layout().addWidget(self.srcset_input,6,1,1,1)
+		self.container.layout().addWidget(self.preset_label,7,1,1,1)
+		self.container.layout().addWidget(self.preset_input,7,1,1,1)
+		self.container.layout().addWidget(self.formats_label,8,1,1,1)
+		self.container.layout().addWidget(self.formats_input,8,1,1,1)
+		self.container.layout().addWidget(self.target_label,9,1,1,1)
+		self.container.layout().addWidget(self.target_input,9,1,1,1)
+		self.container.layout().addWidget(self.btn_optimize,10,1,1,1)
+		self.container.layout().addWidget(self.geolocation_label,11,1,1,1)
+		self.container.layout().addWidget(self.geo_address_label,12,1,1,1)
+		self.container.layout().addWidget(self.geo_address_input,12,1,1,1)
+		self.container.layout().addWidget(self.geo_address_lookup_btn,13,1,1,1)
+		self.container.layout().addWidget(self.geo_latitude_label,14,1,1,1)
+		self.container.layout().addWidget(self.geo_latitude_input,14,1,1,1)
+		self.container.layout().addWidget(self.geo_longitude_label,15,1,1,1)
+		self.container.layout().addWidget(self.geo_longitude_input,15,1,1,1)
+		self.container.layout().addWidget(self.btn_geotag,16,1,1,1)
+		self.container.layout().addWidget(self.btn_process,17,1,1,1)
+		self.container.layout().addWidget(self.btn_download,18,1,1,1)
+		self.container.layout().addWidget(self.btn_reset,19,1,1,1)
+		self.container.layout().addWidget(self.job_bar,20,0,1,1)
+		self.container.layout().addWidget(self.btn_cancel,20,1,1,1)
+		self.container.layout().addWidget(self.job_label,21,0,1,2)
 		# set default values
 		self.img_width_input.setText( str(self.wao.limit['width']) )
 		self.img_height_input.setText( str(self.wao.limit['height']) )
 		self.img_qlty_input.setText( str(self.wao.limit['qlty']) )
 		self.num_colors_input.setText( str(self.wao.limit['colors']) )
+		self.srcset_input.setPlaceholderText( 'none, or e.g. 320,640,1280,1920' )
+		self.preset_input.addItems( list(constants.PRESETS) )
+		self.preset_input.setCurrentText( constants.PRESET )
+		self.formats_input.setPlaceholderText( 'none, or e.g. %s' % ','.join(constants.FORMATS) )
+		self.target_input.setPlaceholderText( 'none, or e.g. 200KB (per image) or 20MB batch' )
 		self.geo_address_input.setText( constants.DEFAULT_ADDRESS )
 		self.geo_latitude_input.setText( str(self.wao.limit['latitude']) )
 		self.geo_longitude_input.setText( str(self.wao.limit['longitude']) )
+		# geocode off the ui thread, debounced while the address is typed
+		self.geo_signals = GeoSignals()
+		self.geo_signals.found.connect(self._setGeoCoords)
+		self.geo_timer = QtCore.QTimer(self)
+		self.geo_timer.setSingleShot(True)
+		self.geo_timer.setInterval(constants.GEOCODE_DEBOUNCE)
+		self.geo_timer.timeout.connect(self.lookupGeoCoords)
+		self.geo_address_input.textEdited.connect(self.geo_timer.start)
 		# set layout and show
 		self.layout().addWidget(self.container)
 		self.updateUI()
+		self.lookupGeoCoords()
 		self.show()
 
-	def updateUI( self ):
-		# update table items
-		self._setUploadedTableItems( self.wao.uploaded )
+	def updateUI( self, results=() ):
+		# update the table rows the job results touched
+		self.table_model.refresh( result.asset for result in results )
 		# optimize before geotagging
-		if self._checkAssetsOptimized( self.wao.uploaded ):
+		if self.wao.uploaded.isOptimized():
 			self.btn_geotag.setEnabled(True)
 		else:
 			self.btn_geotag.setEnabled(False)
 		# optimized and geotagged before download
-		if self._checkAssetsReady( self.wao.uploaded ):
+		if self.wao.uploaded.isReady():
 			self.btn_download.setEnabled(True)
 		else:
 			self.btn_download.setEnabled(False)
-		# update the geolocation information
-		geo_coords = GeoTags.getCoordsFromAddress(GeoTags, str(self.geo_address_input.text()))
-		if geo_coords:
-			self.geo_latitude_input.setText( str(geo_coords[0]) )
-			self.geo_longitude_input.setText( str(geo_coords[1]) )
-		else:
-			self.geo_latitude_input.setText( str(self.wao.limit['latitude']) )
-			self.geo_longitude_input.setText( str(self.wao.limit['longitude']) )
 		# if package downloaded
 		if self.wao.is_download:
 			self.btn_reset.setEnabled(True)
@@ -182,9 +332,11 @@ class WAOWindow(qtw.QWidget):
 			self.btn_reset.setEnabled(False)
 
 	def resetUI( self, exit=False ):
+		self.cancelJob()
 		# delete all folder contents
 		FileFactory.deleteFolderContents(self.wao.path_export)
-		FileFactory.deleteFolderContents(self.wao.upload_root)
+		for path_stage in self.wao.getStagePaths():
+			FileFactory.deleteFolderContents(path_stage)
 		# reset wao director
 		self.wao.reset()
 		# close the UI
@@ -202,9 +354,9 @@ class WAOWindow(qtw.QWidget):
 		options |= dir_dialogue.DontUseNativeDialog
 		folder = dir_dialogue.getExistingDirectory( self, "Select a Folder of Images", "/Users/joeygrable/Pictures", dir_dialogue.DontUseNativeDialog | dir_dialogue.ShowDirsOnly | dir_dialogue.DontResolveSymlinks )
 		if folder:
-			files = self._getUploadList( folder )
-			if self._setUploadsList( files ):
-				self.initUI()
+			# show the window right away, rows appear as the folder tree is walked
+			self.initUI()
+			self.startJob( 'Importing', self.wao.importFolder, folder )
 
 	def openImageUploader( self ):
 		file_dialogue = qtw.QFileDialog()
@@ -213,8 +365,8 @@ class WAOWindow(qtw.QWidget):
 		ImageFilter = self.wao.getFileFilteredAssets('image')
 		files, _ = file_dialogue.getOpenFileNames( self, "Select Images to Upload", "/Users/joeygrable/Pictures", ImageFilter, options=options )
 		if files:
-			if self._setUploadsList( files ):
-				self.initUI()
+			self.initUI()
+			self.startJob( 'Importing', self.wao.importFiles, files )
 
 	def openViewMetaData( self ):
 		''' open window to view the selected images' metadata '''
@@ -267,12 +419,12 @@ class WAOWindow(qtw.QWidget):
 	def runOptimizeSelected( self ):
 		''' get selected images or all, then optimize them '''
 		selected = self._getAssetsByCellIndex( self._getSelectedTableRows(self.table) )
-		for asset in selected:
-			cur_name = asset.getActiveName()
-			FileFactory.copyFileFromTo( cur_name, self.wao.path_upload, self.wao.path_optmze )
-			new_name = FileFactory.renameFileAppendTo( self.wao.path_optmze, cur_name, 'web' )
-			asset.setActiveSrc( self.wao.path_optmze, new_name )
-		# get options based on the app inputs
+		options = self._getOptimizeOptions()
+		# optimize the images in the background
+		self.startJob( 'Optimizing', self._optimizeJob, selected, options )
+
+	def _getOptimizeOptions( self ):
+		''' get options based on the app inputs '''
 		img_width = int(self.img_width_input.text()) or self.wao.limit['width']
 		img_height = int(self.img_height_input.text()) or self.wao.limit['height']
 		img_qlty = int(self.img_qlty_input.text()) or self.wao.limit['qlty']
@@ -282,133 +434,190 @@ class WAOWindow(qtw.QWidget):
 			'height': img_height,
 			'qlty': img_qlty,
 			'colors': num_colors,
+			'preset': str(self.preset_input.currentText()),
 		}
-		# optimize the images
-		if self.wao.optimizeImages(selected, options):
-			# update the ui
-			self.updateUI()
+		# srcset ladder widths, optional
+		widths = [ int(width) for width in str(self.srcset_input.text()).replace(' ', '').split(',') if width.isdigit() and int(width) > 0 ]
+		if widths:
+			options['variants'] = sorted(set(widths))
+		# WebP/AVIF copies, optional
+		formats = [ fmt for fmt in str(self.formats_input.text()).replace(' ', '').lower().split(',') if fmt in constants.FORMATS ]
+		if formats:
+			options['formats'] = formats
+		# byte budget per image, or shared by the batch, optional
+		target_text = str(self.target_input.text()).lower()
+		target = FileFactory.parseBytes( target_text.replace('batch', '') )
+		if target:
+			options['batch_target' if 'batch' in target_text else 'target'] = target
+		return options
+
+	def _optimizeJob( self, selected, options, progress=None, cancel=None ):
+		''' job thread: stage the originals, then optimize them (done ones are skipped) '''
+		selected = self.wao.getUnfinished( selected, 'optimize', options )
+		self.wao.stageAssets( selected, self.wao.path_optmze, 'web', from_origin=True )
+		return self.wao.optimizeImages( selected, options, progress=progress, cancel=cancel )
 
 	def runGeotagSelected( self ):
 		''' get selected images or all, then geotag them '''
 		selected = self._getAssetsByCellIndex( self._getSelectedTableRows(self.table) )
-		for asset in selected:
-			cur_name = asset.getActiveName()
-			FileFactory.copyFileFromTo( cur_name, self.wao.path_optmze, self.wao.path_geotag )
-			new_name = FileFactory.renameFileAppendTo( self.wao.path_geotag, cur_name, 'geo' )
-			asset.setActiveSrc( self.wao.path_geotag, new_name )
-		# get lat/long from address
+		options = self._getGeotagOptions()
+		# geotag the selected images in the background
+		self.startJob( 'GeoTagging', self._geotagJob, selected, options )
+
+	def _getGeotagOptions( self ):
+		''' get lat/long from the address inputs '''
 		geo_latitude = self.geo_latitude_input.text() or self.wao.limit['latitude']
 		geo_longitude = self.geo_longitude_input.text() or self.wao.limit['longitude']
 		options = {
 			'lat': geo_latitude,
 			'long': geo_longitude,
 		}
-		# geotag the selected images
-		if self.wao.geotagImages(selected, options):
-			# update the ui
-			self.updateUI()
+		return options
+
+	def _geotagJob( self, selected, options, progress=None, cancel=None ):
+		''' job thread: stage the optimized files, then geotag them (done ones are skipped) '''
+		selected = self.wao.getUnfinished( selected, 'geotag', options )
+		self.wao.stageAssets( selected, self.wao.path_geotag, 'geo' )
+		return self.wao.geotagImages( selected, options, progress=progress, cancel=cancel )
+
+	def runProcessSelected( self ):
+		''' get selected images or all, then optimize + geotag them in one pass '''
+		selected = self._getAssetsByCellIndex( self._getSelectedTableRows(self.table) )
+		self.startJob( 'Processing', self._processJob, selected, self._getOptimizeOptions(), self._getGeotagOptions() )
+
+	def _processJob( self, selected, options, geo_options, progress=None, cancel=None ):
+		''' job thread: optimize + geotag straight from the originals (done ones are skipped) '''
+		todo = set( self.wao.getUnfinished(selected, 'optimize', options) + self.wao.getUnfinished(selected, 'geotag', geo_options) )
+		selected = [ asset for asset in selected if asset in todo ]
+		return self.wao.processImages( selected, options, geo_options, progress=progress, cancel=cancel )
 
 	def lookupGeoCoords( self ):
-		# update the ui
-		self.updateUI()
+		''' geocode the address in the background, _setGeoCoords gets the result '''
+		self.geo_timer.stop()
+		address = str(self.geo_address_input.text())
+		coords = self.wao.geocoder.getCached( address )
+		if coords:
+			self._setGeoCoords( address, coords )
+		else:
+			self.wao.geocoder.lookupAsync( address, self.geo_signals.found.emit )
+
+	def _setGeoCoords( self, address, coords ):
+		''' update the geolocation information (on the ui thread) '''
+		# the address changed while this one was looked up
+		if address != str(self.geo_address_input.text()):
+			return False
+		if coords:
+			self.geo_latitude_input.setText( str(coords[0]) )
+			self.geo_longitude_input.setText( str(coords[1]) )
+		else:
+			self.geo_latitude_input.setText( str(self.wao.limit['latitude']) )
+			self.geo_longitude_input.setText( str(self.wao.limit['longitude']) )
+		return True
 
 	def runDownloadPackage( self ):
 		''' check if all assets are optimized and geotagged, then download a ZIP file to '''
-		# create a ZipFile object
-		zip_file = FileFactory.makeZipFile( path_zip_from=self.wao.upload_root, path_zip_to=self.wao.path_export, filename='WebOptimizedAssets' )
-		print(zip_file)
-		try:
-			# set Mac User download path and move zip there
-			download_path = os.path.join(os.path.expanduser("~"), "Downloads")
-			if FileFactory.copyFileFromTo( zip_file, self.wao.path_export, download_path ):
-				# update ui
-				self.wao.setFlag('is_download', True)
-				self.showMessage('Download Success', '<p>Your Web Assets are Optimized<br>+ saved to your ~/Downloads folder</p>')
-				self.updateUI()
-		except:
-			# update ui
-			self.showMessage('Download Failed', '<p>Oops! We encountered an error when downloading your files.</p>')
-			self.updateUI()
+		# set Mac User download path and write the zip straight there
+		download_path = os.path.join(os.path.expanduser("~"), "Downloads")
+		self.startJob( 'Packaging', self._packageJob, download_path )
 
-	def _checkAssetsReady( self, assets ):
-		for item in assets:
-			if not item.is_optimized or not item.is_geotagged:
-				return False
-		return True
+	def _packageJob( self, download_path, progress=None, cancel=None ):
+		''' job thread: ZIP the assets into the download path '''
+		FileFactory.makeDir(download_path)
+		return self.wao.packageAssets( download_path, filename='WebOptimizedAssets', progress=progress, cancel=cancel )
 
-	def _checkAssetsOptimized( self, assets ):
-		for item in assets:
-			if not item.is_optimized:
-				return False
-		return True
+	def startJob( self, label, action, *args ):
+		''' run a WAODirector action on the thread pool, reporting its progress '''
+		self.job = Job( action, *args )
+		self.job.signals.progress.connect(self._onJobProgress)
+		self.job.signals.finished.connect(self._onJobFinished)
+		self.job.signals.failed.connect(self._onJobFailed)
+		self.job_name = label
+		self._setJobControls(True)
+		self.job_bar.setRange(0, 0)
+		self.job_label.setText( '%s...' % label )
+		QtCore.QThreadPool.globalInstance().start(self.job)
+		return self.job
 
-	def _checkAssetsGeoTagged( self, assets ):
-		for item in assets:
-			if not item.is_geotagged:
-				return False
+	def cancelJob( self ):
+		''' ask the running job to stop, assets already started still finish '''
+		if self.job:
+			self.job.cancel.set()
+			self.job_label.setText( '%s - cancelling...' % self.job_name )
 		return True
 
-	def _getUploadList( self, folder ):
-		flist = []
-		for fa in os.listdir(folder):
-			filepath = '%s/%s' % (folder, fa)
-			if os.path.isfile(filepath):
-				flist.append(filepath)
-		return flist
-
-	def _setUploadsList( self, files ):
-		for from_path in files:
-			filename = from_path.split('/')[-1]
-			fileext = filename.split('.')[-1]
-			copy_from = '/'.join( from_path.split('/')[0:-1] )
-			# import the asset to WAO Director to handle
-			self.wao.importAsset( copy_from, filename )
-		return True
+	def _onJobProgress( self, result, done, total ):
+		''' update the progress bar, eta and the finished asset's table row '''
+		if not total:
+			# streamed job (imports), the total is not known up front
+			self.job_label.setText( '%s %d...' % (self.job_name, done) )
+			self.table_model.refresh()
+			return True
+		elapsed = time.monotonic() - self.job.started
+		eta = int(elapsed / done * (total - done))
+		self.job_bar.setRange(0, total)
+		self.job_bar.setValue(done)
+		self.job_label.setText( '%s %d/%d - about %d:%02d left' % (self.job_name, done, total, eta // 60, eta % 60) )
+		if result is not None:
+			self.table_model.refreshAsset( result.asset )
+
+	def _onJobFinished( self, value ):
+		''' job done: refresh the ui and report what went wrong '''
+		name = self.job_name
+		cancelled = self.job.cancel.is_set()
+		self.job = None
+		self._setJobControls(False)
+		self.job_label.setText( '%s %s.' % (name, 'cancelled' if cancelled else 'done') )
+		self.wao.saveMetrics()
+		self.updateUI( value if isinstance(value, list) else () )
+		if name == 'Packaging':
+			if value:
+				self.wao.setFlag('is_download', True)
+				self.showMessage('Download Success', '<p>Your Web Assets are Optimized<br>+ saved to your ~/Downloads folder</p>')
+				self.updateUI()
+		elif isinstance(value, list):
+			self._showFailedResults( '%s Failed' % name, [ result for result in value if not result.isCancelled() ] )
+
+	def _onJobFailed( self, error ):
+		''' the action itself raised '''
+		name = self.job_name
+		self.job = None
+		self._setJobControls(False)
+		self.job_label.setText( '%s failed.' % name )
+		self.updateUI()
+		if name == 'Packaging':
+			self.showMessage('Download Failed', '<p>Oops! We encountered an error when downloading your files.</p>')
+		else:
+			self.showMessage( '%s Failed' % name, '<p>%s</p>' % error )
+
+	def _setJobControls( self, running ):
+		''' lock the actions while a job runs, only cancel stays available '''
+		for btn in (self.btn_view_meta, self.btn_optimize, self.btn_geotag, self.btn_process, self.btn_download, self.btn_reset):
+			btn.setEnabled(not running)
+		self.btn_cancel.setEnabled(running)
+		if not running:
+			self.job_bar.setRange(0, 1)
+			self.job_bar.setValue(0)
 
-	def _setUploadedTableItems( self, uploads_dict ):
-		for index, asset in enumerate(uploads_dict):
-			asdict = asset.getDict()
-			# index
-			id_cell = qtw.QTableWidgetItem()
-			id_cell.setText( str(asdict['id']) )
-			# filename
-			name_cell = qtw.QTableWidgetItem()
-			name_cell.setText(asdict['file'])
-			# optimized state
-			opt_state = qtw.QTableWidgetItem()
-			if asdict['is_opt']:
-				opt_state.setText('☑')
-			else:
-				opt_state.setText('☐')
-			opt_state.setTextAlignment(QtCore.Qt.AlignCenter)
-			# geotagged state
-			geo_state = qtw.QTableWidgetItem()
-			if asdict['is_geo']:
-				geo_state.setText('☑')
-			else:
-				geo_state.setText('☐')
-			geo_state.setTextAlignment(QtCore.Qt.AlignCenter)
-			# set table rows
-			self.table.setItem(index,0,id_cell)
-			self.table.setItem(index,1,name_cell)
-			self.table.setItem(index,2,opt_state)
-			self.table.setItem(index,3,geo_state)
+	def _showFailedResults( self, title, results ):
+		''' list any assets a pooled action could not process '''
+		failed = []
+		for result in results:
+			if not result.ok:
+				failed.append( '<strong>%s</strong>: %s' % (result.asset.getActiveName(), result.error or 'no output') )
+		if failed:
+			self.showMessage(title, failed)
+		return not failed
 
 	def _getSelectedTableRows( self, table ):
-		# first get selected rows
-		indexes = table.selectionModel().selectedRows()
-		rows = []
-		for index in sorted(indexes):
-			rows.append( index.row() )
+		# first get selected rows, walking the selection ranges not every cell
+		rows = set()
+		for block in table.selectionModel().selection():
+			rows.update( range(block.top(), block.bottom() + 1) )
+		rows = sorted(rows)
 		if not rows:
-			rows = range(0,self.wao.index)
+			rows = range(0, table.model().rowCount())
 		return rows
 
 	def _getAssetsByCellIndex( self, selected ):
-		# get asset objects by id
-		assets = []
-		for row in selected:
-			cell_index = self.table.item(row,0).text()
-			anAsset = self.wao.getAssetByIndex( cell_index )
-			assets.append(anAsset)
-		return assets
+		# get asset objects by row
+		return [ self.table_model.getAsset(row) for row in selected ]
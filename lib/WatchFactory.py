@@ -0,0 +1,269 @@
+import os, time, errno, select, struct, fnmatch, ctypes, ctypes.util
+try:
+	import constants
+	from FileFactory import FileFactory
+	from LogFactory import Logger
+except:
+	from . import constants
+	from .FileFactory import FileFactory
+	from .LogFactory import Logger
+'''
+FolderWatcher (inotify with a polling fallback, hands out settled files)
+'''
+
+# inotify event bits (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+class FolderWatcher:
+	''' hands out the new and changed files under a folder once they settled (size
+		and mtime unchanged for settle seconds, files still being written wait);
+		inotify says which files to look at, without it (or out of inotify watches)
+		the folder is rescanned every interval seconds; seen maps path -> (bytes,
+		mtime_ns) of the files handed out already, kept as long as they exist '''
+	mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+	def __init__( self, folder, seen=None, settle=None, interval=None, use_inotify=True ):
+		self.folder = os.path.abspath(folder)
+		self.seen = dict(seen or {})
+		self.settle = constants.WATCH_SETTLE if settle is None else settle
+		self.interval = constants.WATCH_POLL if interval is None else interval
+		# path -> ((bytes, mtime_ns), monotonic time it last changed)
+		self.pending = {}
+		# paths dropped from seen since the last batch (deleted or moved away)
+		self.gone = set()
+		self.next_scan = 0
+		self.fd = None
+		self.libc = None
+		# inotify watch descriptor -> folder
+		self.wds = {}
+		if use_inotify:
+			self._startInotify()
+
+	def __repr__( self ):
+		return '<%s folder=%s mode=%s seen=%d pending=%d>' % (
+			self.__class__.__name__, self.folder, self.mode, len(self.seen), len(self.pending)
+		)
+
+	@property
+	def mode( self ):
+		return 'inotify' if self.fd is not None else 'polling'
+
+	def watch( self, stop=None, limit=None ):
+		''' yields (settled, gone) until the stop event is set: the paths that settled
+			(at most limit at a time) and the paths forgotten since the last batch;
+			the folder is scanned first, files changed while nobody watched come first '''
+		try:
+			self.scan()
+			while stop is None or not stop.is_set():
+				self.wait( self._getTimeout(), stop )
+				settled = self.getSettled( limit )
+				gone, self.gone = sorted(self.gone), set()
+				if settled or gone:
+					yield settled, gone
+		finally:
+			self.close()
+
+	def wait( self, timeout, stop=None ):
+		''' wait up to timeout seconds for inotify events and handle them, or when
+			polling, wait and rescan once the interval passed '''
+		if self.fd is not None:
+			ready, _, _ = select.select( [self.fd], [], [], timeout )
+			if ready:
+				self._readEvents()
+			return True
+		if stop is not None:
+			stop.wait( timeout )
+		else:
+			time.sleep( timeout )
+		if time.monotonic() >= self.next_scan:
+			self.scan()
+		return True
+
+	def scan( self, folder=None ):
+		''' look at every file under the folder (or one of its sub-folders); a full
+			scan also forgets the files that are gone '''
+		found = set()
+		for entry in FileFactory.scanFiles( folder or self.folder ):
+			if self._isIgnored( entry.path ):
+				continue
+			found.add( entry.path )
+			try:
+				self._touch( entry.path, entry.stat() )
+			except OSError:
+				continue
+		if folder is None:
+			for path in [ path for path in self.seen if path not in found ]:
+				self._forget( path )
+			for path in [ path for path in self.pending if path not in found ]:
+				del self.pending[path]
+			self.next_scan = time.monotonic() + self.interval
+		return len(found)
+
+	def getSettled( self, limit=None ):
+		''' the pending files unchanged for settle seconds, in name order; they are
+			recorded in seen as they are handed out '''
+		now, settled = time.monotonic(), []
+		for path, (signature, since) in list(self.pending.items()):
+			if now - since < self.settle:
+				continue
+			try:
+				st = os.stat( path )
+			except OSError:
+				del self.pending[path]
+				continue
+			current = (st.st_size, st.st_mtime_ns)
+			# still being written
+			if current != signature:
+				self.pending[path] = (current, now)
+				continue
+			del self.pending[path]
+			self.seen[path] = current
+			settled.append( path )
+			if limit and len(settled) >= limit:
+				break
+		return sorted(settled)
+
+	def close( self ):
+		if self.fd is not None:
+			os.close( self.fd )
+			self.fd = None
+			self.wds.clear()
+		return True
+
+	def _touch( self, path, st ):
+		''' a file was written: pending until it settles, unless it is the version
+			handed out already '''
+		signature = (st.st_size, st.st_mtime_ns)
+		if self.seen.get(path) == signature:
+			self.pending.pop( path, None )
+			return False
+		entry = self.pending.get(path)
+		if entry is None or entry[0] != signature:
+			self.pending[path] = (signature, time.monotonic())
+		return True
+
+	def _forget( self, path ):
+		''' a file was deleted or moved away '''
+		self.pending.pop( path, None )
+		if self.seen.pop( path, None ) is not None:
+			self.gone.add( path )
+		return True
+
+	def _forgetFolder( self, folder ):
+		''' a whole sub-folder was deleted or moved away '''
+		prefix = folder + os.sep
+		for path in [ path for path in list(self.seen) + list(self.pending) if path.startswith(prefix) ]:
+			self._forget( path )
+		return True
+
+	def _isIgnored( self, path ):
+		''' hidden, temporary and partial download files (constants.WATCH_IGNORE),
+			and anything inside a folder named like one '''
+		parts = os.path.relpath( path, self.folder ).split( os.sep )
+		return any( fnmatch.fnmatch(part, pattern) for part in parts for pattern in constants.WATCH_IGNORE )
+
+	def _getTimeout( self ):
+		''' seconds until the next pending file may have settled, the next rescan
+			when polling, and at most a second (stop is checked in between) '''
+		timeout = 1.0
+		if self.pending:
+			now = time.monotonic()
+			timeout = min( timeout, max(0.05, min( since + self.settle - now for signature, since in self.pending.values() )) )
+		if self.fd is None:
+			timeout = min( timeout, max(0.0, self.next_scan - time.monotonic()) )
+		return timeout
+
+	def _startInotify( self ):
+		''' watch every folder of the tree with inotify, False (polling) when it is
+			not available '''
+		libc = _getLibc()
+		if libc is None:
+			return False
+		fd = libc.inotify_init1( os.O_NONBLOCK | os.O_CLOEXEC )
+		if fd < 0:
+			return False
+		self.libc, self.fd = libc, fd
+		return self._watchTree( self.folder )
+
+	def _watchTree( self, folder ):
+		''' add an inotify watch per folder under folder, falls back to polling when
+			the watches run out (fs.inotify.max_user_watches) '''
+		for path, dirs, files in os.walk( folder ):
+			dirs[:] = [ name for name in dirs if not self._isIgnored( os.path.join(path, name) ) ]
+			wd = self.libc.inotify_add_watch( self.fd, os.fsencode(path), self.mask )
+			if wd >= 0:
+				self.wds[wd] = path
+				continue
+			error = ctypes.get_errno()
+			# the folder went away meanwhile
+			if error in (errno.ENOENT, errno.ENOTDIR):
+				continue
+			Logger.event( 'watch', action='polling', path=path, error=os.strerror(error) )
+			self.close()
+			self.next_scan = 0
+			return False
+		return True
+
+	def _readEvents( self ):
+		''' handle every queued inotify event '''
+		rescan = False
+		while self.fd is not None:
+			try:
+				data = os.read( self.fd, 64 * 1024 )
+			except BlockingIOError:
+				break
+			pos = 0
+			while pos + 16 <= len(data):
+				wd, mask, cookie, length = struct.unpack_from( 'iIII', data, pos )
+				name = data[pos + 16:pos + 16 + length].split(b'\0', 1)[0]
+				pos += 16 + length
+				if mask & IN_Q_OVERFLOW:
+					rescan = True
+					continue
+				if mask & IN_IGNORED:
+					self.wds.pop( wd, None )
+					continue
+				folder = self.wds.get(wd)
+				if folder is None or not name:
+					continue
+				path = os.path.join( folder, os.fsdecode(name) )
+				if self._isIgnored( path ):
+					continue
+				if mask & IN_ISDIR:
+					if mask & (IN_CREATE | IN_MOVED_TO):
+						# files may have landed before the watch was added
+						if self._watchTree( path ):
+							self.scan( path )
+					elif mask & (IN_DELETE | IN_MOVED_FROM):
+						self._forgetFolder( path )
+					continue
+				if mask & (IN_DELETE | IN_MOVED_FROM):
+					self._forget( path )
+					continue
+				try:
+					self._touch( path, os.stat(path) )
+				except OSError:
+					self._forget( path )
+		# events were dropped, only a full scan can tell what changed
+		if rescan or self.fd is None:
+			self.scan()
+		return True
+
+def _getLibc():
+	''' the C library with inotify (Linux), None elsewhere '''
+	try:
+		libc = ctypes.CDLL( ctypes.util.find_library('c') or 'libc.so.6', use_errno=True )
+		libc.inotify_init1
+		libc.inotify_add_watch
+	except (OSError, AttributeError):
+		return None
+	return libc
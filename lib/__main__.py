@@ -0,0 +1,303 @@
+'''
+CLI: runs WAO headless (no PyQt), straight through the WAODirector
+1.	imports the given files and folders (recursively)
+2.	optimizes the images
+3.	geotags the images (optional)
+4.	packages the results in a ZIP file (optional)
+5.	prints one JSON line per asset per stage, then a summary line (with the stage timings)
+with --watch, a single folder is watched instead and every new or changed image
+goes through 1-3 once it settled, its final files exported into --out as it goes
+
+usage: python -m lib [options] PATH [PATH ...]
+       python -m lib --watch --out DIR [options] FOLDER
+'''
+import os, sys, json, signal, argparse, threading, contextlib, functools
+try:
+	import constants
+	import WAODirector
+	from FileFactory import FileFactory
+	from LogFactory import Logger
+	from WatchFactory import FolderWatcher
+except:
+	from . import constants
+	from . import WAODirector
+	from .FileFactory import FileFactory
+	from .LogFactory import Logger
+	from .WatchFactory import FolderWatcher
+
+# exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_NO_ASSETS = 3
+
+def getParser():
+	parser = argparse.ArgumentParser( prog='python -m lib', description='Web Asset Optimizer, headless batch mode.' )
+	parser.add_argument('paths', nargs='+', help='image files and/or folders of images to import')
+	parser.add_argument('--width', type=int, default=constants.LIMITS['width'], help='max image width')
+	parser.add_argument('--height', type=int, default=constants.LIMITS['height'], help='max image height')
+	parser.add_argument('--quality', type=int, default=constants.LIMITS['qlty'], help='image quality (1-100)')
+	parser.add_argument('--colors', type=int, default=constants.LIMITS['colors'], help='max PNG colors')
+	parser.add_argument('--backend', choices=['pillow', 'optimize-images'], default=constants.OPTIMIZER, help='image optimizer backend')
+	parser.add_argument('--target-size', metavar='SIZE', help='search the JPEG quality (up to --quality) to land just under SIZE per image, e.g. 200KB (pillow backend)')
+	parser.add_argument('--batch-size', metavar='SIZE', help='like --target-size, with SIZE shared out over the whole batch, e.g. 20MB')
+	parser.add_argument('--preset', choices=list(constants.PRESETS), default=constants.PRESET, help='speed/quality preset of the pillow backend')
+	parser.add_argument('--no-dedupe', action='store_true', help='process exact duplicates (same content) separately')
+	parser.add_argument('--similar', action='store_true', help='flag near-duplicates (perceptual hash) at import')
+	parser.add_argument('--workers', type=int, default=constants.WORKERS, help='number of assets processed at once')
+	parser.add_argument('--no-optimize', action='store_true', help='skip the optimize stage')
+	parser.add_argument('--no-cache', action='store_true', help='always re-optimize, ignoring cached outputs')
+	parser.add_argument('--cache', metavar='DIR', help='optimized outputs cache folder')
+	parser.add_argument('--geotag', action='store_true', help='geotag the images')
+	parser.add_argument('--address', help='address to look up the geotag coordinates for')
+	parser.add_argument('--lat', type=float, default=constants.LIMITS['latitude'], help='geotag latitude')
+	parser.add_argument('--long', type=float, default=constants.LIMITS['longitude'], help='geotag longitude')
+	parser.add_argument('--variants', metavar='WIDTHS', help='also write a srcset ladder at these widths, e.g. 320,640,1280,1920 (pillow backend)')
+	parser.add_argument('--formats', metavar='FORMATS', help='also write %s copies, each kept when smaller than the optimized file (pillow backend)' % ','.join(constants.FORMATS))
+	parser.add_argument('--pipeline', action='store_true', help='optimize + geotag in one pass, writing each final file once (pillow backend)')
+	parser.add_argument('--package', metavar='DIR', help='write a ZIP package of the results to DIR')
+	parser.add_argument('--watch', action='store_true', help='keep watching the folder, processing new and changed images as they settle (needs --out)')
+	parser.add_argument('--out', metavar='DIR', help='watch mode: export the final files here, in the sub-folders of their originals')
+	parser.add_argument('--settle', type=float, default=constants.WATCH_SETTLE, help='watch mode: seconds a file must stay unchanged before it is picked up')
+	parser.add_argument('--poll', action='store_true', help='watch mode: rescan the folder instead of using inotify')
+	parser.add_argument('--root', metavar='DIR', help='session folder of the run (default %s, the UI session in WAOassets is left alone)' % constants.BATCH_FOLDER)
+	parser.add_argument('--log', metavar='FILE', help='JSON-lines log of the spans and events (default %s/data/log.txt)' % constants.BATCH_FOLDER)
+	parser.add_argument('--metrics', metavar='FILE', help='write the stage totals as a Prometheus text file')
+	parser.add_argument('--profile', metavar='FILE', help='cProfile the stages, pstats output written to FILE')
+	parser.add_argument('--trace-memory', action='store_true', help='trace allocations, the top ones are logged at the end')
+	return parser
+
+def main( argv=None ):
+	parser = getParser()
+	args = parser.parse_args(argv)
+	if args.width < 1 or args.height < 1:
+		parser.error('--width and --height take a positive number of pixels')
+	if args.pipeline and (args.no_optimize or not args.geotag or args.backend != 'pillow'):
+		parser.error('--pipeline needs --geotag and the pillow backend')
+	if args.variants:
+		try:
+			args.variants = sorted( int(width) for width in args.variants.split(',') )
+		except ValueError:
+			parser.error('--variants takes comma separated widths')
+		if args.no_optimize or args.backend != 'pillow':
+			parser.error('--variants runs with the optimize stage and the pillow backend')
+	for name in ('target_size', 'batch_size'):
+		if getattr(args, name) is None:
+			continue
+		size = FileFactory.parseBytes( getattr(args, name) )
+		if not size:
+			parser.error('--%s takes a size like 250000, 200KB or 1.5MB' % name.replace('_', '-'))
+		if args.no_optimize or args.backend != 'pillow':
+			parser.error('--%s runs with the optimize stage and the pillow backend' % name.replace('_', '-'))
+		setattr(args, name, size)
+	if args.formats:
+		args.formats = [ fmt.strip().lower() for fmt in args.formats.split(',') if fmt.strip() ]
+		if not set(args.formats) <= set(constants.FORMATS):
+			parser.error('--formats takes a comma separated list of: %s' % ', '.join(constants.FORMATS))
+		if args.no_optimize or args.backend != 'pillow':
+			parser.error('--formats runs with the optimize stage and the pillow backend')
+	args.root = os.path.abspath( args.root or '%s/%s' % (constants.ROOT, constants.BATCH_FOLDER) )
+	if args.watch:
+		if len(args.paths) != 1 or not os.path.isdir(args.paths[0]) or not args.out:
+			parser.error('--watch takes a single folder and --out DIR')
+		if args.package:
+			parser.error('--watch exports into --out, there is no package')
+		if os.path.abspath(args.out).startswith( os.path.join(os.path.abspath(args.paths[0]), '') ):
+			parser.error('--out cannot be inside the watched folder')
+		if args.root.startswith( os.path.join(os.path.abspath(args.paths[0]), '') ):
+			parser.error('--root cannot be inside the watched folder')
+	elif args.out:
+		parser.error('--out is for --watch, use --package otherwise')
+	# keep stdout for the JSON lines, anything else printed goes to stderr
+	out = sys.stdout
+	with contextlib.redirect_stdout(sys.stderr):
+		return runBatch( args, out )
+
+def runBatch( args, out ):
+	''' run every requested stage, writing JSON lines to out '''
+	emit = functools.partial( _emitTo, out )
+	wao = WAODirector.run( path_cache=args.cache, upload_root=args.root )
+	if args.log:
+		Logger.setOutput( args.log )
+	if args.profile or args.trace_memory:
+		Logger.startProfile( cpu=bool(args.profile), memory=args.trace_memory )
+	try:
+		return _runWatch( args, wao, emit ) if args.watch else _runStages( args, wao, emit )
+	finally:
+		Logger.stopProfile( args.profile )
+		wao.saveMetrics( args.metrics )
+
+def _startSession( args, wao ):
+	''' start from a clean session (the cache persists) set up as the arguments ask;
+		only the run's own root is cleared, never the UI session '''
+	for path_stage in wao.getStagePaths():
+		FileFactory.deleteFolderContents(path_stage)
+	wao.reset()
+	wao.workers = args.workers
+	wao.dedupe = not args.no_dedupe
+	wao.perceptual_hash = args.similar
+	return True
+
+def _runStages( args, wao, emit ):
+	''' import, optimize, geotag and package, returns the exit code '''
+	_startSession( args, wao )
+	# import the files and folders
+	for path in args.paths:
+		if os.path.isdir(path):
+			wao.importFolder( os.path.abspath(path) )
+		elif os.path.isfile(path):
+			wao.importFiles( [os.path.abspath(path)] )
+		else:
+			emit({'stage': 'import', 'file': path, 'ok': False, 'error': 'no such file or folder'})
+			return EXIT_USAGE
+	for asset in wao.invalid:
+		emit({'stage': 'import', 'file': asset.name, 'ok': False, 'error': _getIgnoredReason( wao, asset )})
+	assets = list(wao.uploaded)
+	if not assets:
+		emit({'stage': 'summary', 'ok': False, 'assets': 0, 'failed': 0, 'ignored': len(wao.invalid)})
+		return EXIT_NO_ASSETS
+	options, geo_options = _getOptions( args, wao, emit )
+	if options is None:
+		return EXIT_FAILED
+	failed = _runAssets( args, wao, emit, assets, options, geo_options )
+	# package
+	package = None
+	if args.package:
+		FileFactory.makeDir(args.package)
+		zip_file = wao.packageAssets( args.package, filename='WebOptimizedAssets' )
+		package = '%s/%s' % (args.package, zip_file)
+		emit({'stage': 'package', 'file': package, 'ok': True})
+	emit({
+		'stage': 'summary',
+		'ok': not failed,
+		'assets': len(assets),
+		'failed': len(failed),
+		'ignored': len(wao.invalid),
+		'duplicates': sum( asset.duplicate_of is not None for asset in assets ),
+		'similar': sum( asset.similar_to is not None for asset in assets ),
+		'package': package,
+		'cache': wao.cache.getStats(),
+		'metrics': Logger.getStats(),
+	})
+	return EXIT_FAILED if failed else EXIT_OK
+
+def _runWatch( args, wao, emit ):
+	''' watch mode: the new and changed images under the folder go through the
+		stages as they settle, their final files are exported into --out right
+		away; each batch is released from the session once exported, so memory
+		and the staged files stay flat however long it runs '''
+	folder = os.path.abspath( args.paths[0] )
+	_startSession( args, wao )
+	options, geo_options = _getOptions( args, wao, emit )
+	if options is None:
+		return EXIT_FAILED
+	watcher = FolderWatcher( folder, seen=wao.catalog.getWatched(folder), settle=args.settle, use_inotify=not args.poll )
+	emit({'stage': 'watch', 'folder': folder, 'out': args.out, 'mode': watcher.mode, 'ok': True})
+	stop = threading.Event()
+	signal.signal( signal.SIGTERM, lambda signum, frame: stop.set() )
+	failed_total = 0
+	try:
+		for settled, gone in watcher.watch( stop, limit=constants.WATCH_BATCH ):
+			if gone:
+				wao.catalog.removeWatched( gone )
+			if not settled:
+				continue
+			first = wao.index
+			wao.importFiles( settled, root=folder )
+			for asset in wao.invalid:
+				emit({'stage': 'import', 'file': asset.file_origin, 'ok': False, 'error': _getIgnoredReason( wao, asset )})
+			wao.invalid.clear()
+			assets = [ asset for asset in wao.uploaded if asset.index >= first ]
+			failed = _runAssets( args, wao, emit, assets, options, geo_options ) if assets else set()
+			exported = wao.exportAssets( [ asset for asset in assets if asset.index not in failed ], args.out, relative_to=folder )
+			wao.releaseAssets( assets )
+			# failed files wait for their next change, like the processed ones
+			wao.catalog.setWatched( (path, watcher.seen[path]) for path in settled if path in watcher.seen )
+			failed_total += len(failed)
+			emit({'stage': 'batch', 'ok': not failed, 'assets': len(assets), 'failed': len(failed), 'exported': len(exported), 'gone': len(gone)})
+			# the totals so far, and the log moved aside past LOG_LIMIT
+			wao.saveMetrics( args.metrics )
+			Logger.setOutput( Logger.path )
+	except KeyboardInterrupt:
+		pass
+	emit({'stage': 'summary', 'ok': not failed_total, 'failed': failed_total, 'cache': wao.cache.getStats(), 'metrics': Logger.getStats()})
+	return EXIT_FAILED if failed_total else EXIT_OK
+
+def _getOptions( args, wao, emit ):
+	''' the optimize and geotag options of the arguments, (None, None) when the
+		geotag address cannot be found '''
+	options = {
+		'width': args.width,
+		'height': args.height,
+		'qlty': args.quality,
+		'colors': args.colors,
+		'backend': args.backend,
+		'preset': args.preset,
+	}
+	if args.variants:
+		options['variants'] = args.variants
+	if args.formats:
+		options['formats'] = args.formats
+	if args.target_size:
+		options['target'] = args.target_size
+	if args.batch_size:
+		options['batch_target'] = args.batch_size
+	geo_options = None
+	if args.geotag:
+		latitude, longitude = args.lat, args.long
+		if args.address:
+			coords = wao.geocoder.lookup( args.address )
+			if not coords:
+				emit({'stage': 'geotag', 'ok': False, 'error': 'address not found: %s' % args.address})
+				return None, None
+			latitude, longitude = coords
+		geo_options = {'lat': latitude, 'long': longitude}
+	return options, geo_options
+
+def _getIgnoredReason( wao, asset ):
+	''' why an imported file was ignored '''
+	return 'unreadable file' if wao.validateAsset( asset.name_origin ) else 'unsupported file type'
+
+def _runAssets( args, wao, emit, assets, options, geo_options ):
+	''' optimize and geotag the assets as the arguments ask, returns the failed ids '''
+	failed = set()
+	# exact duplicates get processed along with their first copy, near ones are flagged
+	for asset in assets:
+		if asset.duplicate_of is not None or asset.similar_to is not None:
+			emit({'stage': 'import', 'id': asset.index, 'file': asset.name, 'ok': True, 'duplicate_of': asset.duplicate_of, 'similar_to': asset.similar_to})
+	# optimize + geotag in one pass
+	if args.pipeline:
+		for result in wao.processImages( assets, options, geo_options, workers=args.workers ):
+			emit( _getResultDict('process', result) )
+			if not result.ok:
+				failed.add(result.asset.index)
+	# optimize
+	if not args.no_optimize and not args.pipeline:
+		wao.stageAssets( assets, wao.path_optmze, 'web', from_origin=True )
+		for result in wao.optimizeImages( assets, options, workers=args.workers, use_cache=not args.no_cache ):
+			emit( _getResultDict('optimize', result) )
+			if not result.ok:
+				failed.add(result.asset.index)
+	# geotag
+	if args.geotag and not args.pipeline:
+		wao.stageAssets( assets, wao.path_geotag, 'geo' )
+		for result in wao.geotagImages( assets, geo_options, workers=args.workers ):
+			emit( _getResultDict('geotag', result) )
+			if not result.ok:
+				failed.add(result.asset.index)
+	return failed
+
+def _getResultDict( stage, result ):
+	''' JSON record for a TaskResult '''
+	asdict = result.getDict()
+	asdict['stage'] = stage
+	asdict['file'] = result.asset.getActiveFile()
+	return asdict
+
+def _emitTo( out, record ):
+	''' write a single machine-readable JSON line '''
+	out.write( json.dumps(record) + '\n' )
+	out.flush()
+
+if __name__ == '__main__':
+	sys.exit( main() )
@@ -16,6 +16,15 @@ MEDIATYPES = {
 	'db': [ 'sqlite', 'sql', 'mmdb' ],
 }
 
+# file extension -> media type, precomputed from MEDIATYPES
+FILETYPES = { ext: media for media in MEDIATYPES for ext in MEDIATYPES[media] }
+
+# formats that are already compressed, stored as-is when packaging
+COMPRESSED_EXTS = [ 'jpg', 'jpeg', 'png', 'gif', 'webp', 'avif', 'heic', 'jxr',
+	'mp4', 'm4v', 'mkv', 'webm', 'mov', 'avi', 'wmv', 'mpg', 'flv',
+	'mp3', 'm4a', 'ogg', 'flac', 'amr',
+	'zip', 'rar', 'gz', 'bz2', '7z', 'xz', 'lz', 'Z', 'woff', 'woff2' ]
+
 LIMITS = {
 	'width': 1920,
 	'height': 1080,
@@ -26,3 +35,91 @@ LIMITS = {
 }
 
 DEFAULT_ADDRESS = '1015 E Chapman Ave, Orange, CA 92866'
+
+# geocoding: None uses OpenStreetMap, or a Nominatim compatible base url
+GEOCODE_URL = None
+GEOCODE_TTL = 30 * 24 * 60 * 60 # seconds cached
+GEOCODE_INTERVAL = 1.0 # seconds between provider requests
+GEOCODE_DEBOUNCE = 600 # milliseconds after typing stops
+
+# import + stage files as 'link' (reflink/hardlink, copy fallback) or 'copy'
+IMPORT_MODE = 'link'
+# assets imported per batch, the first batches are smaller so rows show up early
+IMPORT_BATCH = 1024
+IMPORT_FIRST_BATCH = 32
+FICLONE = 0x40049409 # linux ioctl
+# duplicates found at import: exact copies (same content hash) are processed once,
+# the outputs are linked to every name; PERCEPTUAL_HASH also flags near-duplicates
+# (resaved, resized or recompressed copies), a 64 bit difference hash of a tiny
+# draft decode within SIMILAR_DISTANCE differing bits
+DEDUPE = True
+PERCEPTUAL_HASH = False
+SIMILAR_DISTANCE = 4
+
+# exif sub-IFD tags
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+
+# rows scanned for transparency before the full scan
+TRANSPARENCY_SAMPLE_ROWS = 16
+
+# image optimizer backend: 'pillow' (in-process) or 'optimize-images' (command)
+OPTIMIZER = 'pillow'
+# bump whenever the pillow backend output changes (invalidates cached outputs)
+OPTIMIZER_VERSION = '1'
+# big PNG photos (area in pixels, unique colors) get converted to JPG
+BIG_PNG_AREA = 800 * 600
+BIG_PNG_COLORS = 2 ** 16
+# pillow backend speed/quality presets (measured: benchmarks/bench_presets.py)
+# draft: JPEGs decode DCT-scaled down to this many times the output size (None: full decode)
+# resample, reducing_gap: the resize filter, reduce() takes whole factors until
+#   reducing_gap times the output size is left for it
+# optimize: the extra JPEG encoder pass for optimal Huffman tables
+# compress_level: PNG zlib level (9 is PNG optimize)
+# quantize: PNG palette method, None is the ADAPTIVE (median cut) conversion
+# webp_method, avif_speed: the WebP effort (0-6, slowest) and AVIF speed (0 slowest - 10)
+PRESETS = {
+	'fast': {'draft': 1.0, 'resample': 'bilinear', 'reducing_gap': 1.0, 'optimize': False, 'compress_level': 1, 'quantize': 'fastoctree', 'webp_method': 2, 'avif_speed': 9},
+	'balanced': {'draft': 1.0, 'resample': 'lanczos', 'reducing_gap': 2.0, 'optimize': True, 'compress_level': 6, 'quantize': None, 'webp_method': 4, 'avif_speed': 8},
+	'max': {'draft': None, 'resample': 'lanczos', 'reducing_gap': 2.0, 'optimize': True, 'compress_level': 9, 'quantize': None, 'webp_method': 6, 'avif_speed': 6},
+}
+PRESET = 'max'
+# target size mode (options['target'] bytes per image, or options['batch_target']
+# bytes shared out over a batch): JPEG quality is searched on a trial downscaled
+# to about this many pixels, then corrected with at most TARGET_TRIES full encodes;
+# a full encode within TARGET_SLACK under the target ends the search
+TARGET_TRIAL_PIXELS = 256 * 256
+TARGET_TRIES = 4
+TARGET_SLACK = 0.05
+# a batch target never leaves a JPEG less than this many bytes per output pixel
+# (about quality 10 for a photo), a batch that cannot afford it misses its target
+TARGET_MIN_PIXEL_BYTES = 0.05
+# modern formats the optimize stage can add next to the legacy one (options['formats']),
+# each one kept only when smaller; AVIF needs a Pillow built with libavif
+FORMATS = ('webp', 'avif')
+
+# watch mode (python -m lib --watch): a new or changed file is picked up once its
+# size and mtime held still for WATCH_SETTLE seconds; without inotify the folder is
+# rescanned every WATCH_POLL seconds; names (or folders) matching WATCH_IGNORE are
+# skipped, and at most WATCH_BATCH files go through the stages at once
+WATCH_SETTLE = 2.0
+WATCH_POLL = 5.0
+WATCH_IGNORE = ( '.*', '*~', '*.tmp', '*.part', '*.crdownload', '*.download' )
+WATCH_BATCH = 256
+
+# headless runs (python -m lib) keep their session in this folder under ROOT,
+# apart from the UI's WAOassets so they never wipe its resumable session
+BATCH_FOLDER = 'WAObatch'
+
+# optimized outputs cache, None keeps it in WAOassets/data/cache
+CACHE_ROOT = None
+CACHE_LIMIT = 2 * 1024 ** 3 # bytes
+
+# session catalog records written per transaction
+CATALOG_BATCH = 256
+
+# WAOassets/data/log.txt is moved to log.txt.1 past this size (bytes)
+LOG_LIMIT = 10 * 1024 ** 2
+
+# number of assets processed at once (one per core)
+WORKERS = os.cpu_count() or 1